@@ -0,0 +1,134 @@
+# Import-time budget of the workflow modules
+# Each module is imported in a fresh interpreter after numpy, pandas and xarray (which all of
+# them need), and the time of the import itself is compared with its budget. Importing a
+# module must not log in to Earthdata or pull in plotting or Argo libraries: those are only
+# imported by the functions that use them. The slowest imports of a module over budget are
+# listed from python -X importtime. Exits with status 1 if any module fails
+#
+# EXAMPLES
+#   python benchmarks/import_time.py
+#   python benchmarks/import_time.py --only cluster_fxns --repeat 5 --scale 2
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+# Modules that must not be imported (or logged in to) when a workflow module is imported
+LAZY_MODULES = ('earthaccess', 'matplotlib', 'cartopy', 'argopy', 'gapstatistics', 'dask')
+
+# module -> budget (s) on top of numpy, pandas and xarray. The K-means modules need
+# scikit-learn at import, the others only import it when they fit
+BUDGETS = {
+    'cluster_fxns': 0.3,
+    'get_L3_8Day': 0.1,
+    'getSST8day': 0.1,
+    'get_avw': 0.1,
+    'get_nFLH': 0.1,
+    'Rrs_avg': 0.1,
+    'get_psc': 0.3,
+    'phyto_size_turner': 0.1,
+    'band_math': 0.1,
+    'feature_cube': 0.1,
+    'cluster_model': 0.3,
+    'model_selection': 0.3,
+    'matchup': 0.1,
+    'regridder': 0.1,
+    'argo_index': 0.1,
+    'argo_profiles': 0.1,
+    'granule_cache': 0.1,
+    'instrument': 0.05,
+    'pipeline': 0.1,
+    'gap_statistic': 2.,
+    'streaming_kmeans': 2.,
+    'temporal_clustering': 2.,
+}
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {functions!r})
+import numpy, pandas, xarray
+t0 = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t0
+print(json.dumps({{'seconds': seconds,
+                  'lazy_imported': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def ImportTime(module, repeat=3):
+
+    """
+        Best import time (s) of module over repeat fresh interpreters, and the lazy modules
+        it imported
+    """
+    best = None
+    for r in range(repeat):
+        code = _PROBE.format(functions=FUNCTIONS_DIR, module=module, lazy=LAZY_MODULES)
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1:]
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best['seconds'], best['lazy_imported']
+
+
+def SlowestImports(module, n=8):
+
+    """
+        The n slowest imports (cumulative s, package) of module from python -X importtime
+    """
+    code = 'import sys; sys.path.insert(0, {!r}); import numpy, pandas, xarray; import {}'.format(FUNCTIONS_DIR, module)
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    # Lines are "import time: self [us] | cumulative | imported package", numpy/pandas/xarray come first
+    lines = [line for line in out.stderr.splitlines() if line.startswith('import time:') and '|' in line]
+    start = max([i for i, line in enumerate(lines) if line.split('|')[-1].strip() == 'xarray'], default=-1) + 1
+    times = []
+    for line in lines[start:]:
+        fields = line[len('import time:'):].split('|')
+        try:
+            times.append((int(fields[1])/1e6, fields[2].rstrip()))
+        except ValueError:
+            continue
+    return sorted(times, reverse=True)[:n]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import time of the workflow modules')
+    parser.add_argument('--only', nargs='+', default=None, help='modules to check (default all)')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per module (best time is kept)')
+    parser.add_argument('--scale', type=float, default=1., help='multiply the budgets (e.g. for slow machines)')
+    args = parser.parse_args(argv)
+
+    failed = []
+    print('{:<22} {:>9} {:>9}  {}'.format('module', 'time (s)', 'budget', 'status'))
+    for module in (args.only or list(BUDGETS)):
+        budget = BUDGETS.get(module, 0.1)*args.scale
+        seconds, lazy = ImportTime(module, args.repeat)
+        if seconds is None:
+            status = 'ERROR ' + ' '.join(lazy)
+        elif lazy:
+            status = 'FAIL imports ' + ', '.join(lazy)
+        elif seconds > budget:
+            status = 'FAIL over budget'
+        else:
+            status = 'ok'
+        print('{:<22} {:>9} {:>9.3f}  {}'.format(module, '-' if seconds is None else '{:.3f}'.format(seconds),
+                                                  budget, status))
+        if status != 'ok':
+            failed.append(module)
+            if seconds is not None:
+                for cumulative, package in SlowestImports(module):
+                    print('{:>32.3f}  {}'.format(cumulative, package))
+
+    if failed:
+        print('\nOver budget or importing lazy dependencies: ' + ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+# Offline benchmarks of the hot functions of the workflow on synthetic data (see synthetic.py)
+# Each benchmark is run in its own process; the time is the best of --repeat runs and the
+# memory is the peak of the allocations traced during one extra run (tracemalloc, numpy
+# arrays included) and the peak resident size of the process
+#
+# EXAMPLES
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --sizes small medium large --only regrid psc --output base.json
+#   python benchmarks/run_benchmarks.py --compare base.json
+
+import argparse
+import csv
+import gc
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCHMARK_DIR)
+sys.path.append(os.path.join(BENCHMARK_DIR, '..', 'functions'))
+
+import synthetic
+
+# name -> setup(cfg, workdir), which builds the inputs and returns the function to time
+BENCHMARKS = {}
+
+
+def Benchmark(name):
+
+    """
+        Register a benchmark setup function under name
+    """
+    def Register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return Register
+
+
+def _Files(folder, pattern, writer):
+
+    # Synthetic files are written once per work directory and reused by later benchmarks
+    files = sorted(glob.glob(os.path.join(folder, pattern)))
+    return files if len(files) > 0 else writer()
+
+
+@Benchmark('regrid_nearest')
+def _RegridNearest(cfg, workdir):
+    import regridder
+    from cluster_fxns import Regrid
+    sst = synthetic.MakeSST8Day(cfg)
+    LO, LA = np.meshgrid(*synthetic.Grid(cfg['n_lat'], cfg['n_lon'])[::-1])
+
+    def Run():
+        regridder._MAPPING_CACHE.clear()
+        Regrid(sst.values, (sst.longitude.values, sst.latitude.values), (LO, LA))
+    return Run
+
+
+@Benchmark('regrid_nearest_warm')
+def _RegridNearestWarm(cfg, workdir):
+    from cluster_fxns import Regrid
+    sst = synthetic.MakeSST8Day(cfg)
+    LO, LA = np.meshgrid(*synthetic.Grid(cfg['n_lat'], cfg['n_lon'])[::-1])
+    grid = (sst.longitude.values, sst.latitude.values)
+    Regrid(sst.values, grid, (LO, LA))
+    return lambda: Regrid(sst.values, grid, (LO, LA))
+
+
+@Benchmark('regrid_mean')
+def _RegridMean(cfg, workdir):
+    import regridder
+    from cluster_fxns import Regrid
+    sst = synthetic.MakeSST8Day(cfg)
+    LO, LA = np.meshgrid(*synthetic.Grid(cfg['n_lat'], cfg['n_lon'])[::-1])
+
+    def Run():
+        regridder._MAPPING_CACHE.clear()
+        Regrid(sst.values, (sst.longitude.values, sst.latitude.values), (LO, LA), method='mean')
+    return Run
+
+
+@Benchmark('closest_cluster')
+def _ClosestCluster(cfg, workdir):
+    from cluster_fxns import GetClosestCluster
+    labels, LO, LA = synthetic.MakeLabels(cfg)
+    lat, lon, dates = synthetic.MakeMatchupPoints(cfg)
+    periods = synthetic.Periods(cfg['n_periods'])
+    return lambda: GetClosestCluster(LO, LA, labels, lat, lon, dates, periods=periods)
+
+
+@Benchmark('moana_means')
+def _MOANAMeans(cfg, workdir):
+    from cluster_fxns import GetMOANAMeans
+    labels, LO, LA = synthetic.MakeLabels(cfg)
+    folder = os.path.join(workdir, 'moana')
+    files = _Files(folder, '*.L2_MOANA.*.nc', lambda: synthetic.WriteMOANASwaths(folder, cfg))
+    periods = synthetic.Periods(cfg['n_periods'])
+    return lambda: GetMOANAMeans(files, 6, LO, LA, labels, periods=periods, max_workers=1)
+
+
+@Benchmark('rrs_avg')
+def _RrsAvg(cfg, workdir):
+    from Rrs_avg import Rrs_avg
+    data = synthetic.MakeDataset(cfg, products=('RRS',))
+    labels, LO, LA = synthetic.MakeLabels(cfg)
+
+    # The per-cluster, per-period loop of the notebook
+    def Run():
+        for ti in range(labels.shape[0]):
+            period = data.isel(time=ti)
+            for n in range(6):
+                Rrs_avg(period, labels[ti], n)
+    return Run
+
+
+@Benchmark('rrs_cluster_stats')
+def _RrsClusterStats(cfg, workdir):
+    from Rrs_avg import Rrs_cluster_stats
+    data = synthetic.MakeDataset(cfg, products=('RRS',))
+    labels, LO, LA = synthetic.MakeLabels(cfg)
+    return lambda: Rrs_cluster_stats(data, labels, 6)
+
+
+@Benchmark('get_nflh')
+def _GetNFLH(cfg, workdir):
+    from get_nFLH import get_nFLH
+    data = synthetic.MakeDataset(cfg, products=('RRS',))
+    return lambda: get_nFLH(data)
+
+
+@Benchmark('band_math')
+def _BandMath(cfg, workdir):
+    from band_math import BandMath, PRODUCTS
+    data = synthetic.MakeDataset(cfg, products=('RRS',))
+    return lambda: BandMath(data.Rrs, list(PRODUCTS))
+
+
+@Benchmark('psc')
+def _PSC(cfg, workdir):
+    from phyto_size_turner import psc
+    data = synthetic.MakeDataset(cfg, products=('CHL', 'SST'))
+    return lambda: psc(data.chlor_a, data.sst)
+
+
+@Benchmark('kmeans_fit')
+def _KMeansFit(cfg, workdir):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    from feature_cube import FeatureCube
+    from cluster_model import BuildFeatures
+    data = synthetic.MakeDataset(cfg)
+
+    def Run():
+        cube = FeatureCube(BuildFeatures(data))
+        X = StandardScaler().fit_transform(cube.X)
+        KMeans(n_clusters=6, n_init=1, random_state=0).fit(X)
+    return Run
+
+
+@Benchmark('streaming_kmeans_fit')
+def _StreamingKMeansFit(cfg, workdir):
+    from feature_cube import FeatureCube
+    from cluster_model import BuildFeatures
+    from streaming_kmeans import FitStreamingKMeans
+    data = synthetic.MakeDataset(cfg)
+    features = BuildFeatures(data)
+    return lambda: FitStreamingKMeans(FeatureCube(features), 6, random_state=0)
+
+
+@Benchmark('cluster_model_predict')
+def _ClusterModelPredict(cfg, workdir):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    from feature_cube import FeatureCube
+    from cluster_model import BuildFeatures, ClusterModel
+    data = synthetic.MakeDataset(cfg)
+    features = BuildFeatures(data)
+    cube = FeatureCube(features)
+    scaler = StandardScaler().fit(cube.X)
+    kmeans = KMeans(n_clusters=6, n_init=1, random_state=0).fit(scaler.transform(cube.X))
+    model = ClusterModel.FromFit(scaler, kmeans, cube.names, data=data)
+    return lambda: model.Predict(features)
+
+
+@Benchmark('get_avw')
+def _GetAVW(cfg, workdir):
+    from get_avw import get_avw
+    folder = os.path.join(workdir, 'avw')
+    _Files(folder, '*.L3m.8D.AVW.*.nc', lambda: synthetic.WriteL3Granules(folder, ('AVW',), cfg))
+    return lambda: get_avw(data_dir=folder).load()
+
+
+@Benchmark('argo_filter')
+def _ArgoFilter(cfg, workdir):
+    from argo_index import BuildParameterIndex, FilterArgoIndex
+    idx = synthetic.MakeArgoIndex(cfg, n_other=100*cfg['n_profiles'])
+    date_range = [str(synthetic.Periods(1)[0]), str(synthetic.Periods(cfg['n_periods'])[-1] + 7)]
+
+    def Run():
+        params, bitmap = BuildParameterIndex(idx)
+        FilterArgoIndex(idx, params, bitmap, ['DOXY', 'BBP700'], region=synthetic.REGION, date_range=date_range)
+    return Run
+
+
+@Benchmark('argo_surface_values')
+def _ArgoSurfaceValues(cfg, workdir):
+    from argo_profiles import GetSurfaceProfileValues
+    idx = synthetic.MakeArgoIndex(cfg, n_other=0)
+    files = idx['file'].values
+    parameters = idx['parameters'].values
+    return lambda: GetSurfaceProfileValues(files, parameters, ['DOXY', 'BBP700', 'CHLA'], cache_dir=None,
+                                           max_workers=1, fetch_fn=synthetic.MakeProfile)
+
+
+def RunCase(name, size, workdir, repeat=3):
+
+    """
+        Run one benchmark at one size
+
+        OUTPUTS
+        - dict with the benchmark, size, grid, best and median time (s), traced peak (MB),
+          peak RSS of the process (MB), or the error when it could not run
+    """
+    cfg = synthetic.SIZES[size]
+    result = {'benchmark': name, 'size': size, 'grid': '{}x{}x{}'.format(cfg['n_periods'], cfg['n_lat'], cfg['n_lon'])}
+    try:
+        workdir = os.path.join(workdir, size)
+        os.makedirs(workdir, exist_ok=True)
+        run = BENCHMARKS[name](cfg, workdir)
+        run()  # warm up (imports, lazy caches, page cache)
+
+        times = []
+        for r in range(repeat):
+            gc.collect()
+            t0 = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t0)
+
+        gc.collect()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    except Exception as err:
+        result['error'] = type(err).__name__ + ': ' + str(err)
+        return result
+
+    result.update(time_s=min(times), median_s=float(np.median(times)), peak_mb=peak/2**20,
+                  rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10)
+    return result
+
+
+def WriteResults(results, output):
+
+    """
+        Save the results as JSON, or as CSV when output ends with .csv
+    """
+    if output.endswith('.csv'):
+        fields = ['benchmark', 'size', 'grid', 'time_s', 'median_s', 'peak_mb', 'rss_mb', 'error']
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+def PrintResults(results, baseline=None):
+
+    """
+        Print a results table; with a baseline (earlier JSON results) the time and peak memory
+        ratios to the baseline are added (< 1 is faster / smaller)
+    """
+    base = {(r['benchmark'], r['size']): r for r in (baseline or []) if 'error' not in r}
+    header = '{:<24} {:<7} {:>14} {:>10} {:>10} {:>10}'.format('benchmark', 'size', 'grid', 'time (s)',
+                                                                 'peak (MB)', 'rss (MB)')
+    if baseline is not None:
+        header += ' {:>8} {:>8}'.format('time x', 'peak x')
+    print(header)
+    for r in results:
+        if 'error' in r:
+            print('{:<24} {:<7} {:>14} {}'.format(r['benchmark'], r['size'], r['grid'], r['error']))
+            continue
+        line = '{:<24} {:<7} {:>14} {:>10.3f} {:>10.1f} {:>10.1f}'.format(r['benchmark'], r['size'], r['grid'],
+                                                                          r['time_s'], r['peak_mb'], r['rss_mb'])
+        b = base.get((r['benchmark'], r['size']))
+        if b is not None:
+            line += ' {:>8.2f} {:>8.2f}'.format(r['time_s']/b['time_s'], r['peak_mb']/max(b['peak_mb'], 1e-9))
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the workflow functions on synthetic data')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=list(synthetic.SIZES))
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='benchmarks to run (names or prefixes), default all: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--workdir', default=None, help='folder for the synthetic files (default a temporary folder)')
+    parser.add_argument('--output', default=None, help='save the results (.json or .csv)')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS
+             if args.only is None or any(name.startswith(prefix) for prefix in args.only)]
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='kaemeans_bench_')
+
+    # A fresh process per benchmark, so the peak RSS is that of the benchmark alone
+    results = []
+    for size in args.sizes:
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                result = pool.submit(RunCase, name, size, workdir, args.repeat).result()
+            results.append(result)
+            print(result['benchmark'], result['size'],
+                  result.get('error', '{:.3f} s'.format(result.get('time_s', np.nan))), flush=True)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print()
+    PrintResults(results, baseline)
+    if args.output is not None:
+        WriteResults(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+# Synthetic stand-ins for the data the workflow downloads: PACE L3m 8-day granules
+# (CHL, POC, Kd, hyperspectral Rrs, AVW), L2 MOANA swaths, ERDDAP-like SST cubes and
+# BGC-Argo index / profile tables. The fields are smooth (fronts, a coastal gradient and
+# cloud gaps) so clustering, regridding and matchups do the same work as on real data,
+# and every generator is seeded so benchmark runs are repeatable
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Domain sizes of the benchmarks: L3 grid (lat, lon), number of 8-day periods, Rrs bands,
+# SST grid refinement (0.02 deg ACSPO over a 0.1 deg L3 grid = 5), MOANA swath files and
+# shape, matchup points and Argo profiles
+SIZES = {
+    'small': dict(n_lat=150, n_lon=175, n_periods=2, n_bands=172, sst_factor=5,
+                  n_swaths=2, swath_shape=(400, 300), n_points=100000, n_profiles=200),
+    'medium': dict(n_lat=300, n_lon=350, n_periods=2, n_bands=172, sst_factor=5,
+                   n_swaths=4, swath_shape=(1000, 640), n_points=1000000, n_profiles=1000),
+    'large': dict(n_lat=600, n_lon=700, n_periods=4, n_bands=172, sst_factor=5,
+                  n_swaths=8, swath_shape=(1700, 1272), n_points=4000000, n_profiles=5000),
+}
+
+# Western Atlantic region of the hackweek [latN, latS, lonW, lonE]
+REGION = [50, 20, -80, -45]
+FIRST_PERIOD = '2024-07-19'
+KD_WAVELENGTHS = np.array([351, 361, 385, 413, 425, 442, 475, 490, 510, 532, 555, 583, 618, 640, 655, 665, 678, 711, 760])
+ARGO_PARAMETERS = ['PRES', 'TEMP', 'PSAL', 'DOXY', 'BBP700', 'CHLA', 'NITRATE']
+
+
+def Grid(n_lat, n_lon, region=REGION):
+
+    """
+        Cell centres of an L3m-like grid over region (latitudes descending, as in the L3m files)
+
+        OUTPUTS
+        - lat (n_lat,), lon (n_lon,) float32
+    """
+    latN, latS, lonW, lonE = region
+    dlat = (latN - latS)/n_lat
+    dlon = (lonE - lonW)/n_lon
+    lat = latN - dlat*(np.arange(n_lat) + 0.5)
+    lon = lonW + dlon*(np.arange(n_lon) + 0.5)
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+
+def Periods(n_periods, first=FIRST_PERIOD):
+
+    """
+        Start dates of n_periods consecutive 8-day composites
+    """
+    return np.datetime64(first, 'D') + 8*np.arange(n_periods)
+
+
+def OCIWavelengths(n_bands=172):
+
+    """
+        n_bands wavelengths over the OCI blue to red range (346-719 nm); with the default
+        172 bands the spacing is about 2.2 nm, close to the real band set
+    """
+    return np.linspace(346., 719., n_bands).astype(np.float32)
+
+
+def _Field(lat, lon, seed, period=0):
+
+    # Smooth field in [0, 1]: a cross-shelf gradient, a meandering front and eddies that
+    # drift a little from one period to the next
+    rng = np.random.default_rng(seed)
+    LO, LA = np.meshgrid(lon, lat)
+    y = (LA - lat.min())/max(float(lat.max() - lat.min()), 1e-6)
+    x = (LO - lon.min())/max(float(lon.max() - lon.min()), 1e-6)
+    front = np.tanh(8*(y - 0.45 - 0.08*np.sin(2*np.pi*(2*x + 0.05*period))))
+    field = 0.35*(1 - x) + 0.25*(front + 1)
+    for k in range(6):
+        cx, cy, r, a = rng.uniform(0, 1), rng.uniform(0, 1), rng.uniform(0.03, 0.1), rng.uniform(-0.2, 0.2)
+        cx += 0.01*period
+        field += a*np.exp(-((x - cx)**2 + (y - cy)**2)/(2*r**2))
+    field += 0.03*rng.standard_normal(field.shape)
+    field -= field.min()
+    return (field/field.max()).astype(np.float32)
+
+
+def _Clouds(shape, seed, fraction=0.3):
+
+    # Blocky cloud mask with about fraction of the cells missing
+    rng = np.random.default_rng(seed)
+    coarse = rng.uniform(size=(max(shape[0]//10, 1) + 1, max(shape[1]//10, 1) + 1))
+    rows = np.minimum(np.arange(shape[0])//10, coarse.shape[0] - 1)
+    cols = np.minimum(np.arange(shape[1])//10, coarse.shape[1] - 1)
+    return coarse[rows][:, cols] < fraction
+
+
+def _L3Attrs(period, product):
+
+    start = pd.Timestamp(period)
+    end = start + pd.Timedelta(days=8) - pd.Timedelta(seconds=1)
+    return {'time_coverage_start': start.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'time_coverage_end': end.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'product_name': 'PACE_OCI.{}_{}.L3m.8D.{}.V2_0.NRT.nc'.format(start.strftime('%Y%m%d'),
+                                                                           end.strftime('%Y%m%d'), product),
+            'processing_version': '2.0', 'instrument': 'OCI', 'platform': 'PACE'}
+
+
+def MakeL3Granule(product, lat, lon, period, n_bands=172, seed=0, period_index=0):
+
+    """
+        One synthetic L3m 8-day granule
+
+        INPUTS
+        - product: 'CHL', 'POC', 'KD', 'RRS' or 'AVW'
+        - lat, lon: grid (see Grid)
+        - period: start date of the composite
+        - n_bands: number of Rrs bands
+        - seed, period_index: random seed and period number (the fields drift with the period)
+
+        OUTPUTS
+        - dataset laid out like the L3m file (lat, lon[, wavelength]) with the
+          time_coverage_start / time_coverage_end attributes
+    """
+    field = _Field(lat, lon, seed, period_index)
+    clouds = _Clouds(field.shape, seed + 1000 + period_index)
+    chl = (0.05*np.exp(4.5*field)).astype(np.float32)
+    chl[clouds] = np.nan
+    coords = {'lat': ('lat', lat), 'lon': ('lon', lon)}
+
+    if product == 'CHL':
+        data = {'chlor_a': (('lat', 'lon'), chl)}
+    elif product == 'POC':
+        data = {'poc': (('lat', 'lon'), (60*chl**0.65).astype(np.float32))}
+    elif product == 'AVW':
+        data = {'avw': (('lat', 'lon'), (470 + 90*field**1.5).astype(np.float32))}
+        data['avw'][1][clouds] = np.nan
+    elif product == 'KD':
+        wv = KD_WAVELENGTHS.astype(np.float32)
+        kw = 0.0166 + 0.3*np.exp(-(wv - 350)/80) + 0.5*np.clip((wv - 580)/200, 0, None)
+        kd = kw[None, None, :] + 0.08*chl[..., None]**0.67*np.exp(-(wv - 440)**2/(2*90**2))
+        data = {'Kd': (('lat', 'lon', 'wavelength'), kd.astype(np.float32))}
+        coords['wavelength'] = ('wavelength', wv)
+    elif product == 'RRS':
+        wv = OCIWavelengths(n_bands)
+        # Blue water peaks near 440 nm, green water near 555 nm, plus a fluorescence bump at 683 nm
+        green = np.clip(np.log10(np.where(np.isnan(chl), 0.1, chl)) + 1.3, 0, 2)[..., None]/2
+        blue = np.exp(-(wv - 440)**2/(2*60**2))
+        green_peak = np.exp(-(wv - 555)**2/(2*45**2))
+        red = np.exp(-(wv - 683)**2/(2*10**2))
+        rrs = 0.012*(1 - green)*blue + 0.006*green*green_peak + 2e-4*green*red + 2e-4
+        rrs = rrs.astype(np.float32)
+        rrs[clouds] = np.nan
+        data = {'Rrs': (('lat', 'lon', 'wavelength'), rrs)}
+        coords['wavelength'] = ('wavelength', wv)
+    else:
+        raise ValueError('Unknown product ' + product + ", expected 'CHL', 'POC', 'KD', 'RRS' or 'AVW'")
+
+    return xr.Dataset(data, coords=coords, attrs=_L3Attrs(period, product))
+
+
+def WriteL3Granules(folder, products=('CHL', 'POC', 'KD', 'RRS', 'AVW'), size='small', seed=0):
+
+    """
+        Write a series of L3m granules with the NASA file names (AVW files can be read with get_avw)
+
+        OUTPUTS
+        - dict of product -> list of files, one per period
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    lat, lon = Grid(cfg['n_lat'], cfg['n_lon'])
+    os.makedirs(folder, exist_ok=True)
+    files = {}
+    for product in products:
+        files[product] = []
+        for pi, period in enumerate(Periods(cfg['n_periods'])):
+            granule = MakeL3Granule(product, lat, lon, period, cfg['n_bands'], seed, pi)
+            fname = os.path.join(folder, granule.attrs['product_name'].replace('.nc', '.x_' + product.lower() + '.nc'))
+            encoding = {name: {'zlib': True, 'complevel': 1} for name in granule.data_vars}
+            granule.to_netcdf(fname, encoding=encoding)
+            files[product].append(fname)
+    return files
+
+
+def MakeDataset(size='small', products=('SST', 'AVW', 'CHL', 'POC', 'KD', 'RRS'), seed=0):
+
+    """
+        In-memory dataset laid out like the output of cluster_fxns.GetData
+
+        OUTPUTS
+        - dataset (time, lat, lon) with sst, avw, chlor_a, poc, Kd (kd_wavelength) and Rrs (wavelength)
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    lat, lon = Grid(cfg['n_lat'], cfg['n_lon'])
+    periods = Periods(cfg['n_periods']).astype('datetime64[ns]')
+    data = xr.Dataset(coords={'time': periods, 'lat': lat, 'lon': lon})
+
+    names = {'CHL': 'chlor_a', 'POC': 'poc', 'AVW': 'avw', 'KD': 'Kd', 'RRS': 'Rrs'}
+    for product in products:
+        if product == 'SST':
+            sst = [28 - 12*(1 - _Field(lat, lon, seed + 7, pi)) for pi in range(len(periods))]
+            data['sst'] = (('time', 'lat', 'lon'), np.array(sst, dtype=np.float32))
+            continue
+        granules = [MakeL3Granule(product, lat, lon, period, cfg['n_bands'], seed, pi)
+                    for pi, period in enumerate(periods)]
+        var = xr.concat([g[names[product]] for g in granules], dim='time').assign_coords(time=periods)
+        if product == 'KD':
+            var = var.rename({'wavelength': 'kd_wavelength'})
+        data[names[product]] = var
+    for product in products:
+        data.attrs['version_' + product] = '2.0'
+    return data
+
+
+def MakeSST8Day(size='small', seed=0):
+
+    """
+        8-day mean SST laid out like getSST8day.SST8day (time, latitude descending, longitude),
+        on a grid sst_factor times finer than the L3 grid
+
+        OUTPUTS
+        - DataArray sea_surface_temperature
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    f = cfg['sst_factor']
+    lat, lon = Grid(cfg['n_lat']*f, cfg['n_lon']*f)
+    periods = Periods(cfg['n_periods']).astype('datetime64[ns]')
+    sst = np.array([28 - 12*(1 - _Field(lat, lon, seed + 7, pi)) for pi in range(len(periods))], dtype=np.float32)
+    sst[:, _Clouds(sst.shape[1:], seed + 2000, fraction=0.1)] = np.nan
+    return xr.DataArray(sst, coords={'time': periods, 'latitude': lat, 'longitude': lon},
+                        dims=('time', 'latitude', 'longitude'), name='sea_surface_temperature')
+
+
+def MakeDailySST(size='small', n_days=16, seed=0):
+
+    """
+        Daily SST cube laid out like the ACSPO ERDDAP griddap dataset (time, latitude, longitude),
+        e.g. to serve from a local ERDDAP-like endpoint for SST8day
+
+        OUTPUTS
+        - dataset with sea_surface_temperature (float32, with missing days of clouds)
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    f = cfg['sst_factor']
+    lat, lon = Grid(cfg['n_lat']*f, cfg['n_lon']*f)
+    times = (np.datetime64(FIRST_PERIOD, 'D') + np.arange(n_days)).astype('datetime64[ns]') + np.timedelta64(12, 'h')
+    base = 28 - 12*(1 - _Field(lat, lon, seed + 7))
+    rng = np.random.default_rng(seed)
+    sst = np.empty((n_days,) + base.shape, dtype=np.float32)
+    for di in range(n_days):
+        sst[di] = base + 0.3*rng.standard_normal(base.shape)
+        sst[di][_Clouds(base.shape, seed + 3000 + di, fraction=0.4)] = np.nan
+    return xr.Dataset({'sea_surface_temperature': (('time', 'latitude', 'longitude'), sst)},
+                      coords={'time': times, 'latitude': lat, 'longitude': lon})
+
+
+def WriteMOANASwaths(folder, size='small', seed=0):
+
+    """
+        Write L2 MOANA swath files (geophysical_data and navigation_data groups) with the
+        PACE file names, dated inside the synthetic periods
+
+        OUTPUTS
+        - list of files
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    n_lines, n_pixels = cfg['swath_shape']
+    latN, latS, lonW, lonE = REGION
+    periods = Periods(cfg['n_periods'])
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    files = []
+    for si in range(cfg['n_swaths']):
+        day = periods[si % len(periods)] + np.timedelta64(int(rng.integers(0, 8)), 'D')
+        fname = os.path.join(folder, 'PACE_OCI.{}T17{:04d}.L2_MOANA.V2.nc'.format(
+            str(day).replace('-', ''), si))
+
+        # A tilted swath crossing the region
+        line = np.linspace(0, 1, n_lines, dtype=np.float32)[:, None]
+        pixel = np.linspace(-0.5, 0.5, n_pixels, dtype=np.float32)[None, :]
+        centre = rng.uniform(lonW + 5, lonE - 5)
+        lat = latS - 2 + (latN - latS + 4)*line + 0.5*pixel
+        lon = centre + 10*pixel + 4*(line - 0.5)
+        field = np.clip(1 - (lat - latS)/(latN - latS), 0, 1)
+        valid = (rng.uniform(size=lat.shape) > 0.3)
+
+        geo = {}
+        for name, scale in (('picoeuk_moana', 2e4), ('prococcus_moana', 2e5), ('syncoccus_moana', 6e4)):
+            values = (scale*(0.2 + field)*rng.lognormal(0, 0.3, size=lat.shape)).astype(np.float32)
+            values[~valid] = np.nan
+            geo[name] = (('number_of_lines', 'pixels_per_line'), values)
+        nav = {'latitude': (('number_of_lines', 'pixels_per_line'), lat.astype(np.float32)),
+               'longitude': (('number_of_lines', 'pixels_per_line'), lon.astype(np.float32))}
+
+        xr.Dataset(attrs={'product_name': os.path.basename(fname)}).to_netcdf(fname, mode='w')
+        xr.Dataset(geo).to_netcdf(fname, mode='a', group='geophysical_data')
+        xr.Dataset(nav).to_netcdf(fname, mode='a', group='navigation_data')
+        files.append(fname)
+    return files
+
+
+def MakeLabels(size='small', n_clusters=6, seed=0):
+
+    """
+        Cluster labels (time, lat, lon) with NaN under the clouds, like the scattered K-means
+        labels of the workflow, and the LO, LA mesh of the grid
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    lat, lon = Grid(cfg['n_lat'], cfg['n_lon'])
+    labels = []
+    for pi in range(cfg['n_periods']):
+        field = _Field(lat, lon, seed, pi)
+        lab = np.minimum(np.floor(field*n_clusters), n_clusters - 1).astype(np.float32)
+        lab[_Clouds(field.shape, seed + 1000 + pi)] = np.nan
+        labels.append(lab)
+    LO, LA = np.meshgrid(lon, lat)
+    return np.array(labels), LO, LA
+
+
+def MakeMatchupPoints(size='small', seed=0):
+
+    """
+        Random points (lat, lon, date) inside the region and periods, for GetClosestCluster
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    latN, latS, lonW, lonE = REGION
+    rng = np.random.default_rng(seed)
+    n = cfg['n_points']
+    days = rng.integers(0, 8*cfg['n_periods'], size=n)
+    dates = np.datetime64(FIRST_PERIOD, 'ns') + days*np.timedelta64(1, 'D')
+    return rng.uniform(latS, latN, size=n), rng.uniform(lonW, lonE, size=n), dates
+
+
+def MakeArgoIndex(size='small', seed=0, n_other=None):
+
+    """
+        BGC-Argo index table like argo_index.LoadArgoIndex (file, date, latitude, longitude,
+        ocean, profiler_type, institution, parameters, parameter_data_mode, date_update).
+        n_other profiles (default 4x) are outside of the region and periods
+
+        OUTPUTS
+        - dataframe sorted by date
+    """
+    cfg = SIZES[size] if isinstance(size, str) else size
+    latN, latS, lonW, lonE = REGION
+    rng = np.random.default_rng(seed)
+    n_in = cfg['n_profiles']
+    n_other = 4*n_in if n_other is None else n_other
+    n = n_in + n_other
+
+    inside = np.zeros(n, dtype=bool)
+    inside[:n_in] = True
+    lat = np.where(inside, rng.uniform(latS, latN, n), rng.uniform(-60, 70, n))
+    lon = np.where(inside, rng.uniform(lonW, lonE, n), rng.uniform(-180, 180, n))
+    days = np.where(inside, rng.integers(0, 8*cfg['n_periods'], n), rng.integers(-3000, 0, n))
+    dates = np.datetime64(FIRST_PERIOD, 'ns') + days*np.timedelta64(1, 'D')
+
+    wmo = 1900000 + rng.integers(0, max(n//50, 1), n)
+    cycle = rng.integers(1, 400, n)
+    params = []
+    for pi in range(n):
+        extra = [p for p in ARGO_PARAMETERS[3:] if rng.uniform() < 0.6]
+        params.append(' '.join(ARGO_PARAMETERS[:3] + extra))
+
+    idx = pd.DataFrame({'file': ['aoml/{}/profiles/BR{}_{:03d}.nc'.format(w, w, c) for w, c in zip(wmo, cycle)],
+                        'date': dates, 'latitude': lat, 'longitude': lon, 'ocean': 'A',
+                        'profiler_type': 846, 'institution': 'AO', 'parameters': params,
+                        'parameter_data_mode': ['R'*len(p.split()) for p in params],
+                        'date_update': dates + np.timedelta64(30, 'D')})
+    idx = idx.drop_duplicates(subset='file')
+    return idx.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def MakeProfile(wmo, cycle, n_levels=100, max_pres=1000., parameters=ARGO_PARAMETERS):
+
+    """
+        One profile table like the argopy dataframe used by argo_profiles.ProfileColumns
+        (PRES and <PARAM>_ADJUSTED / <PARAM>_ADJUSTED_QC columns). Usable as the fetch_fn of
+        GetProfileColumns: fetch_fn=lambda wmo, cycle: MakeProfile(wmo, cycle)
+    """
+    rng = np.random.default_rng(wmo*1000 + cycle)
+    pres = np.sort(rng.uniform(0, max_pres, n_levels)).astype(np.float32)
+    table = {'PRES': pres}
+    shapes = {'TEMP': 25*np.exp(-pres/300) + 4, 'PSAL': 35 + 0.002*pres, 'DOXY': 220 - 0.05*pres,
+              'BBP700': 1e-3*np.exp(-pres/100), 'CHLA': 0.8*np.exp(-((pres - 40)/25)**2),
+              'NITRATE': 30*(1 - np.exp(-pres/400))}
+    for name in parameters:
+        if name == 'PRES':
+            continue
+        table[name + '_ADJUSTED'] = (shapes[name]*(1 + 0.02*rng.standard_normal(n_levels))).astype(np.float32)
+        table[name + '_ADJUSTED_QC'] = rng.choice([1, 1, 1, 2, 3, 4], size=n_levels).astype(float)
+    return pd.DataFrame(table)
@@ -1,15 +1,14 @@
-import earthaccess
 import xarray as xr
-from xarray.backends.api import open_datatree
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import numpy as np
 from datetime import datetime
 from datetime import timezone
-auth = earthaccess.login(persist=True)
 
 def getCHL():
     
+    # Imported and logged in on the first call, not at import (earthaccess keeps the session)
+    import earthaccess
+    earthaccess.login(persist=True)
+
     # Grab 8-day data @ 0.01 degree (1 km)
     tspan = ("2024-07-19", "2024-08-03")
     results = earthaccess.search_data(
@@ -2,11 +2,7 @@
 # Created by Kitty Kam
 
 # Import library
-import earthaccess
 import xarray as xr
-from xarray.backends.api import open_datatree
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import numpy as np
 import os
 from datetime import datetime, timezone
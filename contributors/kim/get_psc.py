@@ -1,64 +1,17 @@
-import xarray as xr
-import pandas
-import numpy as np
-from datetime import datetime
-from datetime import date
-from getSST8day import SST8day
-from get_L3_8Day import get_L3_8Day
-
-def run_psc(start_date,end_date=date.today()-timedelta(days=8),latmin=20,latmax=50,lonmin=-80,lonmax=-45,):
-    """
-    PURPOSE: To get the CHL and SST data and run the PHYTO_SIZE_TURNER model to calculate phytoplankton size classes using the Northeast U.S. regionally tuned phytoplankton size class algorithm based on Turner et al. (2021).
-    
-    REQUIRED INPUTS: 
-      START_DATE.... The start date for getting the file
-      
-    OPTIONAL INPUTS
-      END_DATE...... The end date for getting the files
-      LATMIN......... Minimum latitude of the boundingn box
-      LATMAX......... Maximum latidue of the boundingn box
-      LONMIN......... Minimum longitude of the boundingn box
-      LONMAX......... Maximum longitude of the boundingn box
-
-    KEYWORDS:
-      TODO - EIGHTDAY... Set to use 8-day mean data (default=1)
-      TODO - NETCDF..... Set to output a netcdf of the data
-
-    OUTPUTS
-      Phytoplankton size class (micro,nano, and picoplankton fractions and input chlorophyll data.
-    
-    EXAMPLES:
-
-    NOTES:
-      To calculate phytoplankton size class chlorophyll contribution, multiply total chlorophyll with each size class fraction.
-
-    COPYRIGHT: 
-        Copyright (C) 2024, Department of Commerce, National Oceanic and Atmospheric Administration, National Marine Fisheries Service,
-        Northeast Fisheries Science Center, Narragansett Laboratory.
-        This software may be used, copied, or redistributed as long as it is not sold and this copyright notice is reproduced on each copy made.
-This routine is provided AS IS without any express or implied warranties whatsoever.
-
-    AUTHOR:
-      This program was written on August 08, 2024 by Kimberly J. W. Hyde, Northeast Fisheries Science Center | NOAA Fisheries | U.S. Department of Commerce, 28 Tarzwell Dr, Narragansett, RI 02882
-  
-    MODIFICATION HISTORY:
-        Aug 08, 2024 - KJWH: Initial code written
-    """
-    
-    # ===> Get the chlorohyll data and extract the array
-    chl = get_L3_8Day(CHL,start_date,end_date,lonW=lonmin,lonE=lonmax,latN=latmax,latS=latmin)
-    chlarr = chl['chlor_a']
-
-    # ===> Get the SST data, regrid to the chlorophyll and extract the array
-    sst = SST8day(start_date,end_date,latmin=latmin,latmax=latmax,lonmin=lonmin,lonmax=lonmax)
-    sstarr = sst.interp(latitude=chlarr["lat"],longitude=chlarr["lon"],method='nearest')
-    # ===> Run the phytoplankton size class model
-    psize = psc(chlarr,sstarr)
-
-    # TODO If keyword is set to save as netcdf then psize.to_netcdf("psize_output.nc")
-
-    return psize
-
-    
-
-    
\ No newline at end of file
+# run_psc now lives in functions/get_psc.py (tiled, with NetCDF or Zarr output). Importing
+# this module from here gives that module, so the notebooks in this folder keep working
+# with the one implementation
+
+import importlib.util
+import os
+import sys
+
+_FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'functions')
+# Ahead of this folder, so its imports (get_L3_8Day, getSST8day, ...) are the functions/ versions too
+if _FUNCTIONS_DIR not in sys.path:
+    sys.path.insert(0, _FUNCTIONS_DIR)
+
+_spec = importlib.util.spec_from_file_location(__name__, os.path.join(_FUNCTIONS_DIR, 'get_psc.py'))
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)
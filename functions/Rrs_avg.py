@@ -1,12 +1,9 @@
-import earthaccess
 import xarray as xr
-from xarray.backends.api import open_datatree
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import numpy as np
 from datetime import datetime, timezone
 from random import randint
-auth = earthaccess.login(persist=True)
+from grouped_stats import GroupedMoments, EmptyMoments, CombineMoments, FinalizeMoments
+from instrument import Instrument
 
 
 # What this does:
@@ -16,6 +13,7 @@ auth = earthaccess.login(persist=True)
 
 # *** make sure dataset and flag have the same dimension of lat and lon
 
+@Instrument
 def Rrs_avg(dataset,flag, n, plot_flag = False):
     # dataset = 3D dataset (not nested)
     # flag = 2D array flag
@@ -34,6 +32,7 @@ def Rrs_avg(dataset,flag, n, plot_flag = False):
 
     # plot
     if plot_flag == True:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(1)
         ax.plot(wv, mean, lw=2, color='blue')
         ax.fill_between(wv, mean+sd, mean-sd, facecolor='blue', alpha=0.5)
@@ -51,6 +50,43 @@ def Rrs_avg(dataset,flag, n, plot_flag = False):
     return mean, sd, wv
 
 
+@Instrument
+def Rrs_cluster_stats(dataset, total_labels, n_clusters, chunk_rows=64):
+    # dataset = dataset with Rrs (time, lat, lon, wavelength), e.g. from GetData
+    # total_labels = cluster labels (time, lat, lon)
+    # n_clusters = number of clusters
+    #
+    # Mean, sd and count of every band for every cluster and period, in one pass over the
+    # Rrs cube (chunk_rows latitude rows at a time, accumulated in float64 and merged per
+    # period) instead of one masked copy of the cube per cluster and period.
+    # Returns a dataset with mean, sd, count (time, cluster, wavelength) and n_pixels (time, cluster).
+    # It is not cached here: the pipeline checkpoints it with the labels it was computed from
 
+    rrs = dataset.Rrs.transpose('time', 'lat', 'lon', 'wavelength')
+    n_time, n_lat, n_lon, n_wv = rrs.shape
+    total_labels = np.asarray(total_labels)
 
+    moments = []
+    for ti in range(n_time):
+        period = EmptyMoments(n_clusters, n_wv)
+        for r0 in range(0, n_lat, chunk_rows):
+            block = rrs[ti, r0:r0+chunk_rows].values.reshape(-1, n_wv)
+            lab = total_labels[ti, r0:r0+chunk_rows].ravel()
+            period = CombineMoments(period, GroupedMoments(lab, block, n_clusters))
+        moments.append(period)
+    moments = [np.concatenate(m) for m in zip(*moments)]
 
+    count, mean, variance = FinalizeMoments(moments, ddof=0)
+    labels = total_labels.reshape(n_time, -1)
+    n_pixels = np.stack([np.bincount(lab[(lab >= 0) & (lab < n_clusters)].astype(int), minlength=n_clusters)
+                         for lab in labels])
+
+    shape = (n_time, n_clusters, n_wv)
+    stats = xr.Dataset({'mean': (('time', 'cluster', 'wavelength'), mean.reshape(shape).astype(np.float32)),
+                        'sd': (('time', 'cluster', 'wavelength'), np.sqrt(variance).reshape(shape).astype(np.float32)),
+                        'count': (('time', 'cluster', 'wavelength'), count.reshape(shape).astype(np.int64)),
+                        'n_pixels': (('time', 'cluster'), n_pixels)},
+                       coords={'time': rrs.time.values, 'cluster': np.arange(n_clusters),
+                               'wavelength': rrs.wavelength.values})
+
+    return stats
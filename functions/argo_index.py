@@ -0,0 +1,163 @@
+# Local cache of the BGC-Argo profile index with a parameter -> profile bitmap
+# so the index can be filtered by parameters, region and time with array operations
+# The GDAC publishes the index as a single file, so a refresh downloads all of it again:
+# the cache saves the download and parsing between refreshes, not within one
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+def _CachePaths(cache_dir, index_file):
+
+    base = os.path.join(cache_dir, 'argo_index_' + index_file)
+    return base + '.parquet', base + '.pkl', base + '_params.npz'
+
+
+def _ReadCache(parquet_file, pickle_file):
+
+    if os.path.exists(parquet_file):
+        return pd.read_parquet(parquet_file), parquet_file
+    if os.path.exists(pickle_file):
+        return pd.read_pickle(pickle_file), pickle_file
+    return None, None
+
+
+def _WriteCache(idx, parquet_file, pickle_file):
+
+    # Parquet needs pyarrow or fastparquet, fall back to a pickle without them
+    try:
+        idx.to_parquet(parquet_file, index=False)
+        return parquet_file
+    except ImportError:
+        idx.to_pickle(pickle_file)
+        return pickle_file
+
+
+def _DownloadIndex(index_file):
+
+    import argopy
+    from argopy import ArgoIndex  #  This is the class to work with Argo index
+    argopy.set_options(src='erddap', mode='expert')
+    return ArgoIndex(index_file=index_file).load().to_dataframe()
+
+
+def MergeArgoIndex(cached, fresh):
+
+    """
+        Update a cached index with a newly downloaded copy of the full index. Rows are
+        matched on 'file'; new profiles are added and profiles with a newer 'date_update'
+        replace the cached row (cached rows missing from the download are kept)
+    """
+    if cached is None:
+        return fresh.reset_index(drop=True)
+
+    merged = pd.concat([cached, fresh], ignore_index=True)
+    if 'date_update' in merged.columns:
+        merged = merged.sort_values('date_update', kind='stable')
+    merged = merged.drop_duplicates(subset='file', keep='last')
+    return merged.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def BuildParameterIndex(idx):
+
+    """
+        Parameter -> profile bitmap of an Argo index
+
+        INPUTS
+        - idx: Argo index dataframe with a space separated 'parameters' column
+
+        OUTPUTS
+        - params: list of parameter names
+        - bitmap: boolean array (n_profiles, n_params), True if the profile has the parameter
+    """
+    tokens = idx['parameters'].fillna('').astype(str).str.split()
+    lengths = tokens.str.len().values
+    flat = np.concatenate([np.asarray(t, dtype=object) for t in tokens.values]) \
+        if lengths.sum() > 0 else np.array([], dtype=object)
+
+    codes, params = pd.factorize(flat)
+    bitmap = np.zeros((idx.shape[0], params.shape[0]), dtype=bool)
+    bitmap[np.repeat(np.arange(idx.shape[0]), lengths), codes] = True
+    return list(params), bitmap
+
+
+def LoadArgoIndex(cache_dir='data/cache', index_file='bgc-s', max_age_days=7, refresh=False):
+
+    """
+        Load the Argo index from a local cache, downloading the full index from the GDAC
+        again when the cache is older than max_age_days (or when refresh=True). The
+        parameter bitmap is cached with it.
+
+        INPUTS
+        - cache_dir: directory of the local cache
+        - index_file: Argo index to use (default 'bgc-s')
+        - max_age_days: age of the cache after which the index is downloaded again (None = never)
+        - refresh: force a refresh
+
+        OUTPUTS
+        - idx: index dataframe
+        - params, bitmap: see BuildParameterIndex
+    """
+    parquet_file, pickle_file, params_file = _CachePaths(cache_dir, index_file)
+    idx, cache_file = _ReadCache(parquet_file, pickle_file)
+
+    stale = idx is None or refresh
+    if not stale and max_age_days is not None:
+        stale = (time.time() - os.path.getmtime(cache_file)) > max_age_days*86400
+
+    if stale:
+        idx = MergeArgoIndex(idx, _DownloadIndex(index_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        _WriteCache(idx, parquet_file, pickle_file)
+        if os.path.exists(params_file):
+            os.remove(params_file)
+
+    if os.path.exists(params_file):
+        saved = np.load(params_file, allow_pickle=False)
+        params = list(saved['params'])
+        bitmap = np.unpackbits(saved['bitmap'], axis=0, count=idx.shape[0]).astype(bool)
+    else:
+        params, bitmap = BuildParameterIndex(idx)
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(params_file, params=np.array(params, dtype=str), bitmap=np.packbits(bitmap, axis=0))
+
+    return idx, params, bitmap
+
+
+def FilterArgoIndex(idx, params, bitmap, target_parameters, want_all=True, region=None, date_range=None):
+
+    """
+        Boolean mask of the index rows that match the parameters, region and time
+
+        INPUTS
+        - idx, params, bitmap: output of LoadArgoIndex
+        - target_parameters: list of BGC-Argo parameters ['DOXY','BBP700',..]
+        - want_all: if True rows need ALL of the parameters, if False ANY of them
+        - region: [latN, latS, lonW, lonE] (the two longitudes can be in either order)
+        - date_range: [start_date, end_date]
+
+        OUTPUTS
+        - mask: boolean array (n_profiles,)
+    """
+    columns = np.zeros((idx.shape[0], len(target_parameters)), dtype=bool)
+    for ti, param in enumerate(target_parameters):
+        if param in params:
+            columns[:, ti] = bitmap[:, params.index(param)]
+
+    mask = columns.all(axis=1) if want_all else columns.any(axis=1)
+
+    if date_range is not None:
+        dates = idx['date'].values
+        mask &= (dates >= np.datetime64(pd.Timestamp(date_range[0]))) & \
+                (dates <= np.datetime64(pd.Timestamp(date_range[1])))
+
+    if region is not None:
+        latN, latS = max(region[0], region[1]), min(region[0], region[1])
+        lonW, lonE = min(region[2], region[3]), max(region[2], region[3])
+        lat = idx['latitude'].values
+        lon = idx['longitude'].values
+        mask &= (lat <= latN) & (lat >= latS) & (lon <= lonE) & (lon >= lonW)
+
+    return mask
@@ -0,0 +1,246 @@
+# Concurrent, resumable download of BGC-Argo profiles with an on-disk cache,
+# and batched QC and depth-layer statistics over many profiles at once
+
+import hashlib
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from grouped_stats import GroupedMoments, FinalizeMoments
+
+
+def ParseProfileFile(fname):
+
+    """
+        Get the WMO and cycle number from an Argo index file name
+        (e.g. 'aoml/1902303/profiles/BR1902303_012.nc' -> 1902303, 12)
+    """
+    wmo = int(fname.split('/')[1])
+    cycle = int(fname.split('_')[-1].split('.')[0][:3])
+    return wmo, cycle
+
+
+def ProfileKey(wmo, cycle, target_parameters, max_depth):
+
+    """
+        Cache key of the (depth limited) data of one profile
+    """
+    settings = json.dumps([list(target_parameters), float(max_depth)])
+    return '{}_{:03d}_{}'.format(wmo, cycle, hashlib.sha1(settings.encode()).hexdigest()[:12])
+
+
+def FetchProfile(wmo, cycle, gdac=None):
+
+    """
+        Load one profile from the GDAC as a dataframe. gdac can be a local
+        directory (or mirror url) laid out like the GDAC, e.g. for tests
+    """
+    from argopy import DataFetcher  # This is the class to work with Argo data
+    kwargs = {} if gdac is None else {'gdac': gdac}
+    fetcher = DataFetcher(ds='bgc', src='gdac', mode='expert', **kwargs)
+    return fetcher.profile(wmo, cycle).load().data.to_dataframe()
+
+
+def ProfileColumns(float_data, target_parameters, profile_parameters, max_depth):
+
+    """
+        Reduce a profile dataframe to plain arrays down to max_depth
+
+        OUTPUTS
+        - dict with 'PRES' (n,), 'VALUE' (n, P) adjusted values and 'QC' (n, P) adjusted
+          QC flags (0 where the profile does not have the parameter)
+    """
+    float_data = float_data.loc[float_data.loc[:,'PRES']<=max_depth,:]
+    n = float_data.shape[0]
+
+    values = np.full((n, len(target_parameters)), np.nan, dtype=np.float32)
+    qc = np.zeros((n, len(target_parameters)), dtype=np.int8)
+    for ti, param in enumerate(target_parameters):
+        if param in profile_parameters and param+'_ADJUSTED' in float_data.columns:
+            values[:, ti] = float_data.loc[:, param+'_ADJUSTED'].values
+            flags = np.asarray(float_data.loc[:, param+'_ADJUSTED_QC'].values, dtype=float)
+            qc[:, ti] = np.nan_to_num(flags, nan=0)
+
+    return {'PRES': float_data.loc[:,'PRES'].values.astype(np.float32), 'VALUE': values, 'QC': qc}
+
+
+class ProfileCache:
+
+    """
+        One small file per processed profile, so a run that is interrupted can be
+        resumed and reruns only fetch profiles they have not seen before
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _Path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        try:
+            with np.load(self._Path(key)) as saved:
+                return {name: saved[name] for name in saved.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    def put(self, key, columns):
+        # Write then rename so an interrupted write never leaves a broken entry
+        tmp = self._Path(key)[:-4] + '.tmp' + str(os.getpid()) + '.npz'
+        np.savez(tmp, **columns)
+        os.replace(tmp, self._Path(key))
+
+
+def _IsTransient(err):
+
+    """
+        True for the download errors worth retrying: connection errors, timeouts and
+        server side (5xx, 408, 429) HTTP statuses. A missing (404) or unparsable profile is not
+    """
+    status = getattr(err, 'status', None)
+    if status is None:
+        status = getattr(err, 'code', None)
+    if status is None:
+        status = getattr(getattr(err, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status >= 500 or status in (408, 429)
+    if isinstance(err, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)):
+        return False
+    # Connection errors and timeouts are OSErrors
+    return isinstance(err, OSError)
+
+
+def GetProfileColumns(files, parameters, target_parameters, max_depth=50,
+                      cache_dir='data/cache/argo_profiles', max_workers=8,
+                      retries=3, backoff=2., gdac=None, fetch_fn=None):
+
+    """
+        Fetch many Argo profiles concurrently (cached per profile) and stack them into
+        one columnar array set
+
+        INPUTS
+        - files: Argo index file names of the profiles
+        - parameters: space separated parameter string of each profile (index 'parameters')
+        - target_parameters: list of BGC-Argo parameters ['DOXY','BBP700',..]
+        - max_depth: deepest pressure (dbar) that is kept
+        - cache_dir: directory for the per-profile cache (None = no cache)
+        - max_workers: number of profiles downloaded at the same time
+        - retries: number of retries of a download that failed with a transient error (connection,
+                   timeout, 5xx), waiting backoff*2**attempt seconds. Other errors are not retried
+        - gdac: optional local GDAC directory or mirror passed to argopy
+        - fetch_fn: optional function (wmo, cycle) -> dataframe used instead of argopy
+
+        OUTPUTS
+        - columns: dict with 'PROFILE' (index into files), 'PRES', 'VALUE' (n, P) and 'QC' (n, P),
+          and 'FAILED' (n_failed, 2): the (wmo, cycle) of the profiles that could not be
+          downloaded. These have no rows and are retried on the next run (a single warning reports them)
+    """
+    cache = None if cache_dir is None else ProfileCache(cache_dir)
+    if fetch_fn is None:
+        fetch_fn = lambda wmo, cycle: FetchProfile(wmo, cycle, gdac=gdac)
+
+    def process(fi):
+        wmo, cycle = ParseProfileFile(files[fi])
+        key = ProfileKey(wmo, cycle, target_parameters, max_depth)
+
+        if cache is not None:
+            columns = cache.get(key)
+            if columns is not None:
+                return columns
+
+        for attempt in range(retries + 1):
+            try:
+                float_data = fetch_fn(wmo, cycle)
+                break
+            except Exception as err:
+                if attempt == retries or not _IsTransient(err):
+                    return err
+                time.sleep(backoff*2**attempt)
+
+        columns = ProfileColumns(float_data, target_parameters, parameters[fi].split(' '), max_depth)
+        if cache is not None:
+            cache.put(key, columns)
+        return columns
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(process, range(len(files))))
+
+    failed = [(fi, err) for fi, err in enumerate(results) if isinstance(err, Exception)]
+    if failed:
+        fi, err = failed[0]
+        warnings.warn('Could not get {} of {} Argo profiles (e.g. {}: {}), they are left out'.format(
+            len(failed), len(files), files[fi], err), RuntimeWarning, stacklevel=2)
+
+    n_params = len(target_parameters)
+    results = [(fi, c) for fi, c in enumerate(results) if not isinstance(c, Exception)]
+    sizes = [c['PRES'].shape[0] for fi, c in results]
+    return {'PROFILE': np.repeat([fi for fi, c in results], sizes).astype(np.intp),
+            'PRES': np.concatenate([c['PRES'] for fi, c in results] + [np.zeros(0, np.float32)]),
+            'VALUE': np.concatenate([c['VALUE'] for fi, c in results] + [np.zeros((0, n_params), np.float32)]),
+            'QC': np.concatenate([c['QC'] for fi, c in results] + [np.zeros((0, n_params), np.int8)]),
+            'FAILED': np.array([ParseProfileFile(files[fi]) for fi, err in failed], dtype=np.intp).reshape(-1, 2)}
+
+
+def GetLayerStats(columns, n_profiles, layers, qc_flags=(1, 2)):
+
+    """
+        Per-profile statistics of QC'd values in one or more depth layers, computed for all
+        profiles and layers in a single grouped pass
+
+        INPUTS
+        - columns: output of GetProfileColumns
+        - n_profiles: number of profiles
+        - layers: dict of name -> (top, bottom) pressures. bottom can also be an array with
+                  one depth per profile (e.g. the mixed layer depth)
+        - qc_flags: QC flags that are kept
+
+        OUTPUTS
+        - dict of name -> {'mean', 'std', 'count'}, each (n_profiles, n_parameters)
+    """
+    values = columns['VALUE'].astype(float)
+    values[~np.isin(columns['QC'], qc_flags)] = np.nan
+
+    pres = columns['PRES']
+    profile = columns['PROFILE']
+
+    # Rows can fall in more than one layer: stack the (layer, profile) group of every match
+    groups = []
+    rows = []
+    for li, (top, bottom) in enumerate(layers.values()):
+        bottom = np.asarray(bottom, dtype=float)
+        if bottom.ndim > 0:
+            bottom = bottom[profile]
+        inside = np.where((pres >= top) & (pres <= bottom))[0]
+        groups.append(li*n_profiles + profile[inside])
+        rows.append(inside)
+    groups = np.concatenate(groups)
+    rows = np.concatenate(rows)
+
+    count, mean, variance = FinalizeMoments(GroupedMoments(groups, values[rows], len(layers)*n_profiles), ddof=0)
+
+    stats = {}
+    for li, name in enumerate(layers):
+        sl = slice(li*n_profiles, (li+1)*n_profiles)
+        stats[name] = {'mean': mean[sl], 'std': np.sqrt(variance[sl]), 'count': count[sl]}
+    return stats
+
+
+def GetSurfaceProfileValues(files, parameters, target_parameters, surf_depth=50, **kwargs):
+
+    """
+        Mean QC'd (flags 1 and 2) adjusted values in the upper surf_depth m of many profiles
+
+        INPUTS
+        - see GetProfileColumns
+
+        OUTPUTS
+        - float_values: (n_profiles, n_parameters), NaN for parameters that are missing
+          or profiles that could not be downloaded
+    """
+    columns = GetProfileColumns(files, parameters, target_parameters, max_depth=surf_depth, **kwargs)
+    stats = GetLayerStats(columns, len(files), {'surface': (-np.inf, surf_depth)})
+    return stats['surface']['mean']
@@ -0,0 +1,139 @@
+# Band arithmetic on Rrs cubes: fluorescence / line heights and band ratios
+# The F0 spectrum is read once per session, the bands needed by all the requested products
+# are looked up once (nearest OCI band) and every product is computed in the same chunked
+# pass over the cube, reading only those bands
+# Description  : https://oceancolor.gsfc.nasa.gov/resources/atbd/nflh/
+# Solar irradiance spectrum [F0] uses TSIS-1 version : https://oceancolor.gsfc.nasa.gov/resources/docs/rsr_tables/
+
+import functools
+import os
+import numpy as np
+import xarray as xr
+
+F0_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'f0_tsis.txt')
+
+
+@functools.lru_cache(maxsize=None)
+def LoadF0(fname=F0_FILE):
+
+    """
+        Solar irradiance spectrum (wavelength in nm, F0 in mW cm^-2 um^-1), read once per file
+    """
+    table = np.loadtxt(fname, comments=('/', '!'))
+    wv, f0 = table[:, 0], table[:, 1]
+    wv.flags.writeable = False
+    f0.flags.writeable = False
+    return wv, f0
+
+
+def F0(wavelengths, fname=F0_FILE):
+
+    """
+        F0 interpolated to the given wavelengths
+    """
+    wv, f0 = LoadF0(fname)
+    return np.interp(np.asarray(wavelengths, dtype=float), wv, f0)
+
+
+def NearestBand(wavelengths, target, max_offset=5.):
+
+    """
+        Index of the band closest to target (nm), e.g. 706 nm -> the 705 or 706 nm OCI band
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    index = int(np.abs(wavelengths - target).argmin())
+    if abs(wavelengths[index] - target) > max_offset:
+        raise ValueError('No band within ' + str(max_offset) + ' nm of ' + str(target) + ' nm')
+    return index
+
+
+def LineHeight(peak, low, high, nlw=False):
+
+    """
+        Height of the peak band above the line between the low and high bands
+        (on Rrs, or on nLw = Rrs x F0 with nlw=True)
+    """
+    return {'kind': 'line_height', 'bands': (peak, low, high), 'nlw': nlw}
+
+
+def BandRatio(numerator, denominator):
+
+    """
+        Rrs(numerator) / Rrs(denominator)
+    """
+    return {'kind': 'ratio', 'bands': (numerator, denominator), 'nlw': False}
+
+
+PRODUCTS = {
+    # Normalized fluorescence line height, Behrenfeld et al. (2009), mW cm^-2 um^-1 sr^-1
+    'nFLH': LineHeight(678, 660, 706, nlw=True),
+    # Color index, Hu et al. (2012), sr^-1
+    'CI': LineHeight(555, 443, 670),
+    'BR_443_555': BandRatio(443, 555),
+    'BR_490_555': BandRatio(490, 555),
+}
+
+
+def BandMath(Rrs, products=('nFLH',), chunk_rows=64, max_offset=5., dtype=np.float32):
+
+    """
+        Compute several band arithmetic products in one chunked pass over an Rrs cube
+
+        INPUTS
+        - Rrs: DataArray with a wavelength dimension (e.g. data.Rrs from GetData), or a
+               dataset with an Rrs variable
+        - products: names in PRODUCTS, or dict of name -> LineHeight / BandRatio spec
+        - chunk_rows: number of latitude rows per chunk
+        - max_offset: largest distance (nm) between a requested and the nearest band
+        - dtype: output type
+
+        OUTPUTS
+        - dict of name -> DataArray with the dimensions of Rrs except wavelength
+
+        EXAMPLE
+            out = BandMath(data.Rrs, ['nFLH', 'CI', 'BR_443_555'])
+            FLH = out['nFLH'].values
+    """
+    if isinstance(Rrs, xr.Dataset):
+        Rrs = Rrs.Rrs
+    if not isinstance(products, dict):
+        products = {name: PRODUCTS[name] for name in products}
+
+    # Every band needed by any product is looked up and read once
+    wavelengths = Rrs.wavelength.values
+    band_index = {}
+    for spec in products.values():
+        for target in spec['bands']:
+            band_index[target] = NearestBand(wavelengths, target, max_offset)
+    bands = sorted(set(band_index.values()))
+    column = {target: bands.index(bi) for target, bi in band_index.items()}
+    band_wv = {target: float(wavelengths[bi]) for target, bi in band_index.items()}
+    f0 = {target: float(F0(band_wv[target])) for target in band_index}
+
+    rrs = Rrs.transpose(..., 'wavelength')
+    template = rrs.isel(wavelength=0, drop=True)
+    outputs = {name: np.empty(template.shape, dtype=dtype) for name in products}
+
+    # Chunks of latitude rows (or of the first dimension when there is no lat)
+    axis = template.dims.index('lat') if 'lat' in template.dims else 0
+    n_rows = template.shape[axis] if template.ndim > 0 else 1
+    for r0 in range(0, n_rows, chunk_rows):
+        index = (slice(None),)*axis + (slice(r0, r0 + chunk_rows),) if template.ndim > 0 else ()
+        chunk = rrs.isel({template.dims[axis]: index[axis]}) if template.ndim > 0 else rrs
+        block = np.asarray(chunk.isel(wavelength=bands).values, dtype=dtype)
+        band = lambda target, nlw: block[..., column[target]]*f0[target] if nlw else block[..., column[target]]
+
+        for name, spec in products.items():
+            if spec['kind'] == 'ratio':
+                num, den = spec['bands']
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = band(num, False)/band(den, False)
+            else:
+                peak, low, high = spec['bands']
+                wp, wl, wh = band_wv[peak], band_wv[low], band_wv[high]
+                value = band(peak, spec['nlw']) - (wh - wp)/(wh - wl)*band(low, spec['nlw']) \
+                        - (wp - wl)/(wh - wl)*band(high, spec['nlw'])
+            outputs[name][index] = value
+
+    return {name: xr.DataArray(outputs[name], coords=template.coords, dims=template.dims, name=name)
+            for name in products}
@@ -1,260 +1,339 @@
-from gapstatistics.gapstatistics import GapStatistics
-import argopy
-from argopy import DataFetcher  # This is the class to work with Argo data
-from argopy import ArgoIndex  #  This is the class to work with Argo index
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from scipy.interpolate import griddata
-from scipy.spatial import KDTree
-from xarray.backends.api import open_datatree
 import xarray as xr
 
 from get_L3_8Day import get_L3_8Day
 from get_avw import get_avw
 from getSST8day import SST8day
+from matchup import GridMatcher, GetPeriodIndex, MatchLabels
+from regridder import Regridder
+from argo_index import LoadArgoIndex, FilterArgoIndex
+from argo_profiles import GetSurfaceProfileValues
+from grouped_stats import GroupedMoments, EmptyMoments, CombineMoments, FinalizeMoments
+from instrument import Instrument, Stage
 from datetime import datetime
 
-# Make sure to pip install before
-def GetOptimalK(max_K, data):
+@Instrument
+def GetOptimalK(max_K, data, n_refs=10, early_stop=True, max_workers=None, random_state=None):
 
     """
-        use gapstatistics package to determine optimal number of clusters
+        use the gap statistic to determine optimal number of clusters
         for K-means clusterting
 
         INPUTS:
-        - max_K: max # of clusters to evaluate 0...max_K
+        - max_K: max # of clusters to evaluate 1...max_K
         - data: input data used to train cluster
+        - n_refs: number of uniform reference datasets
+        - early_stop: stop at the first K that meets the gap criterion
+        - max_workers: number of worker processes (None = number of cpus, 1 = no pool)
+        - random_state: seed
 
         OUTPUT:
-        - gs: gapstatistics object
+        - gs: dict of gap statistic curves ('K', 'log_W', 'ref_log_W', 'gap', 's'), see GapStatistic
         - optimum: determined optimum number of clusters from gap statistics
     """
-    gs = GapStatistics(distance_metric='minkowski')
-    
-    optimum = gs.fit_predict(K=10, X=data)
-    
-    return gs, optimum
+    from gap_statistic import GapStatistic
+    gs = GapStatistic(data, max_K=max_K, n_refs=n_refs, early_stop=early_stop,
+                      max_workers=max_workers, random_state=random_state)
 
+    return gs, gs['optimum']
 
-def GetSurfaceFloatValues(region, date_range, target_parameters, want_all=True):
+
+@Instrument
+def GetSurfaceFloatValues(region, date_range, target_parameters, want_all=True, cache_dir='data/cache',
+                          max_workers=8, gdac=None):
 
     """
         Get surface values (defined as upper 50m) for all profiles in a given region and 
         data range. QC flags 1 and 2 are used
 
         INPUTS
-        - region: bounding region given in the floowing order [latN, latS, lonE, lonE]
+        - region: bounding region given in the floowing order [latN, latS, lonW, lonE]
         - date range: date limits [start_date, end_date]
         - target_parameters: list of BGC-Argo parameters ['DOXY','BBP700',..]
         - want_all:
             - if True, will return floats that have only ALL of the listed parameters
             - if False, will return floats that have any parameters
+        - cache_dir: directory of the local Argo index and profile caches
+        - max_workers: number of profiles downloaded at the same time
+        - gdac: optional local GDAC directory or mirror (see argo_profiles.GetSurfaceProfileValues)
 
         OUTPUTS
         - idx file with mean float values appended as 'PARAM_FLOAT'
     """
     
     # Initial set up
-    argopy.set_options(src='erddap', mode='expert');
-    idx = ArgoIndex(index_file='bgc-s').load().to_dataframe()
-    
-    latN = region[0]; latS = region[1]; lonW = region[2]; lonE = region[3]
-    good_inds = []
+    idx, params, bitmap = LoadArgoIndex(cache_dir=cache_dir)
     surf_depth = 50
-    
-    for pi in np.arange(idx.shape[0]):
-    
-        param_count = 0
-        for ti in np.arange(len(target_parameters)):
-            
-            if target_parameters[ti] in idx.loc[:, 'parameters'].values[pi].split(' '):
-                param_count = param_count +1
-
-        if want_all == True:
-            if param_count == len(target_parameters):
-                good_inds.append(pi)
-        else:
-            if param_count > 0:
-                good_inds.append(pi)
-    
-    good_idx = idx.iloc[good_inds,:]
-    
-    # Crop to target region and time
-    # Crop to target time period and region
-    good_idx = good_idx.loc[(good_idx.loc[:,'date']>=pd.Timestamp(date_range[0])) & \
-    (good_idx.loc[:,'date']<=pd.Timestamp(date_range[1])), :]
-    
-    latN = 50; latS = 20; lonW = -80; lonE = -45
-    
-    good_idx = good_idx.loc[(good_idx.loc[:,'latitude']<=latN) & (good_idx.loc[:,'latitude']>=latS) & \
-    (good_idx.loc[:,'longitude']<=lonE) & (good_idx.loc[:,'longitude']>=lonW), :]
-
-    ## 
-    float_values = np.zeros((good_idx.shape[0], len(target_parameters)))*np.NaN
-
-    # Download float data
-    for fi in np.arange(float_values.shape[0]):
-    #for fi in np.arange(10):
-        fname = good_idx.loc[:,'file'].values[fi]
-        
-        wmo = int(fname.split('/')[1])
-        profnum = int(fname.split('_')[-1].split('.')[0][:3])
-    
-        print(wmo, profnum)
-        
-        float_data = DataFetcher(ds='bgc', src = 'gdac').profile(wmo, profnum).load().data.to_dataframe()
-        # Get surface data
-        float_data = float_data.loc[float_data.loc[:,'PRES']<=surf_depth,:]
-        
-        
-        # QC
-        for ti in np.arange(len(target_parameters)):
-
-            if target_parameters[ti] in good_idx.loc[:, 'parameters'].values[fi].split(' '):
-                
-                float_data.loc[(float_data.loc[:,target_parameters[ti]+'_ADJUSTED_QC']!=1) & \
-                (float_data.loc[:,target_parameters[ti]+'_ADJUSTED_QC']!=2), target_parameters[ti]+'_ADJUSTED']=np.NaN
-        
-                float_values[fi, ti] = float_data.loc[:,target_parameters[ti]+'_ADJUSTED'].mean()
-    # Append data
-    # Temporarily save data because it takes awhile to get this
+
+    # Crop to target parameters, time period and region
+    good_inds = FilterArgoIndex(idx, params, bitmap, target_parameters, want_all=want_all,
+                                region=region, date_range=date_range)
+    good_idx = idx.loc[good_inds, :]
+
+    # Download float data (concurrently, skipping profiles that are already cached)
+    float_values = GetSurfaceProfileValues(good_idx.loc[:,'file'].values, good_idx.loc[:,'parameters'].values,
+                                           target_parameters, surf_depth=surf_depth,
+                                           cache_dir=os.path.join(cache_dir, 'argo_profiles'),
+                                           max_workers=max_workers, gdac=gdac)
+
     # Append to index file
     for pi in np.arange(len(target_parameters)):
         good_idx = good_idx.assign(**{target_parameters[pi]+'_FLOAT': float_values[:,pi]})
     return good_idx
 
-def Regrid(high_res_data, high_res_grid, target_grid):
+@Instrument
+def Regrid(high_res_data, high_res_grid, target_grid, method='nearest', cache_dir=None):
 
     """
-        Regridding function used to subsample a higher res. grid to a lower one
-        using griddata
+        Regridding function used to subsample a higher res. grid to a lower one.
+        The grid mapping is computed once and reused (see regridder.Regridder)
 
         INPUTS
         - high_res_data: data to be mapped
         - high_res_grid: [high_res_lon, high_res_lat]
         - target_grid: [target_lon, target_lat]
+        - method: 'nearest' (same as griddata nearest) or 'mean' (block average of
+                  all high res cells in each target cell)
+        - cache_dir: optional directory to save the grid mapping for later runs
 
         OUTPUTS
         - data: high_res_data regridded to target
     """
 
-    data = np.zeros((high_res_data.shape[0], target_grid[0].shape[0], target_grid[0].shape[1]))*np.NaN
-
-    LO, LA = np.meshgrid(high_res_grid[0],high_res_grid[1])
-    points = (LO.flatten(), LA.flatten())
-    
-    for i in np.arange(data.shape[0]):
-        data[i, :,:] = griddata(points, high_res_data[i].flatten(), target_grid, method ='nearest')
+    regridder = Regridder(high_res_grid, target_grid, method=method, cache_dir=cache_dir)
+    data = regridder(high_res_data)
 
     return data
 
-def GetData(latN, latS, lonW, lonE, date_range):
+# Variable(s) kept from each product
+L3_VARIABLES = {'CHL': ['chlor_a'], 'POC': ['poc'], 'KD': ['Kd'], 'RRS': ['Rrs']}
+PRODUCTS = ('SST', 'AVW') + tuple(L3_VARIABLES)
+
+def _AlignPeriods(data, dim, periods):
+    # Pick the composite of each period (composites start within a day of the period date)
+    data = data.sortby(dim)
+    return data.reindex({dim: periods}, method='nearest', tolerance=np.timedelta64(4, 'D')).rename({dim: 'time'})
+
+@Instrument
+def GetData(latN, latS, lonW, lonE, date_range=None, periods=None,
+            products=('SST', 'AVW', 'CHL', 'POC', 'KD', 'RRS'), max_workers=4, cache_dir=None):
 
     
     """
-        Get PACE data for in specific region and time period. This function calls other functions to get data
-        for two 8 day periods. Note: THERE ARE HARDCODED DATES. Def. can be further improved
+        Get PACE (and ACSPO SST) data for a specific region and list of 8-day composite periods.
+        The products are downloaded at the same time and returned in one dataset on the grid
+        of the L3 products (SST is regridded with Regrid to the nearest cell, and the higher
+        resolution AVW to the mean of the cells in each grid cell)
 
         INPUTS
         - bounding regions (latN, latS, lonW, lonE)
-        - date range: date limits [start_date, end_date]
+        - date range: date limits [start_date, end_date] (default: the first period start to 8 days
+                      after the last)
+        - periods: list of 8-day period start dates (default: all L3 composites in date_range).
+                   At least one of date_range and periods is needed
+        - products: any of 'SST', 'AVW', 'CHL', 'POC', 'KD', 'RRS' (at least one L3 product)
+        - max_workers: number of products downloaded at the same time
+        - cache_dir: optional granule cache for the L3 products (see get_L3_8Day)
 
         OUTPUTS
-        - SST: sea surface temperature)
-        - AVW: apparent visible wavelength
-        - CHL: chlrorophyll a
-        - POC: particulate organic carbon
-        - KD: diffuse attenuation 
-        - RRS: remote sensing reflectance
+        - dataset with dimensions (time, lat, lon) and a variable per product:
+            - sst: sea surface temperature
+            - avw: apparent visible wavelength
+            - chlor_a: chlrorophyll a
+            - poc: particulate organic carbon
+            - Kd: diffuse attenuation (kd_wavelength)
+            - Rrs: remote sensing reflectance (wavelength)
+          The download time of each product is kept in the attributes as fetch_seconds_<PRODUCT>,
+          and its processing version (when the files have one) as version_<PRODUCT>
     """
 
-    SST = SST8day(date_range[0],date_range[1])
-    AVW = get_avw() # Notes: AVW is at higher resolution grid...need to down size
-    CHL = get_L3_8Day('CHL',datetime.strptime(date_range[0],'%Y-%m-%d'),
-                      datetime.strptime(date_range[1],'%Y-%m-%d'),lonE,lonW,latN,latS)
-    POC = get_L3_8Day('POC',datetime.strptime(date_range[0],'%Y-%m-%d'),
-                      datetime.strptime(date_range[1],'%Y-%m-%d'),lonE,lonW,latN,latS)
-    KD = get_L3_8Day('KD',datetime.strptime(date_range[0],'%Y-%m-%d'),
-                      datetime.strptime(date_range[1],'%Y-%m-%d'),lonE,lonW,latN,latS)
-
-    # Download Rrs
-    # NOTE: HARDCODED DATE
-    RRS1 = get_L3_8Day('RRS',datetime.strptime(date_range[0],'%Y-%m-%d'),
-                      datetime.strptime(date_range[1],'%Y-%m-%d'),lonE,lonW,latN,latS)
-    RRS2 = get_L3_8Day('RRS',datetime.strptime('2024-07-27','%Y-%m-%d'),
-                      datetime.strptime(date_range[1],'%Y-%m-%d'),lonE,lonW,latN,latS)
-
-    RRS = [RRS1, RRS2]
-    return SST, AVW, CHL, POC, KD, RRS
+    unknown = [p for p in products if p not in PRODUCTS]
+    if unknown:
+        raise ValueError('Unknown product(s) {}, GetData supports {}'.format(', '.join(map(str, unknown)),
+                                                                          ', '.join(PRODUCTS)))
+    l3_products = [p for p in products if p in L3_VARIABLES]
+    if len(l3_products) == 0:
+        raise ValueError('GetData needs at least one L3 product (CHL, POC, KD or RRS) for the grid')
+    if date_range is None and periods is None:
+        raise ValueError('GetData needs a date_range or a list of periods')
+
+    if date_range is None:
+        date_range = [str(np.datetime64(periods[0], 'D')),
+                      str(np.datetime64(periods[-1], 'D') + np.timedelta64(7, 'D'))]
+    t1 = datetime.strptime(date_range[0],'%Y-%m-%d')
+    t2 = datetime.strptime(date_range[1],'%Y-%m-%d')
+
+    # The SST windows start on the periods (read when SST is fetched, see below)
+    fetchers = {'SST': lambda: SST8day(date_range[0],date_range[1],latmin=latS,latmax=latN,lonmin=lonW,lonmax=lonE,
+                                       periods=periods),
+                'AVW': lambda: get_avw(periods=periods)}
+    for product in l3_products:
+        fetchers[product] = lambda product=product: get_L3_8Day(product,t1,t2,lonE,lonW,latN,latS,cache_dir=cache_dir)
+
+    def Fetch(product):
+        with Stage('fetch', product=product):
+            t0 = time.time()
+            data = fetchers[product]()
+            return data, time.time() - t0
+
+    # Download all products at the same time. Without periods, SST waits for the L3 composite dates
+    first = [p for p in products if p != 'SST' or periods is not None]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {product: pool.submit(Fetch, product) for product in first}
+        results = {product: futures[product].result() for product in first}
+
+    # Use the periods and grid of the first L3 product
+    grid = results[l3_products[0]][0]
+    if periods is None:
+        periods = grid.date.values
+    periods = np.array(periods, dtype='datetime64[ns]')
+    if 'SST' in products and 'SST' not in results:
+        results['SST'] = Fetch('SST')
+    LO, LA = np.meshgrid(grid.lon.values, grid.lat.values)
+
+    data = xr.Dataset(coords={'time': periods, 'lat': grid.lat.values, 'lon': grid.lon.values})
+    for product in products:
+        product_data, seconds = results[product]
+        data.attrs['fetch_seconds_'+product] = seconds
+        version = product_data.attrs.get('processing_version', product_data.attrs.get('product_version'))
+        if version is not None:
+            data.attrs['version_'+product] = str(version)
+
+        if product in L3_VARIABLES:
+            product_data = _AlignPeriods(product_data[L3_VARIABLES[product]], 'date', periods)
+            if product == 'KD':
+                product_data = product_data.rename({'wavelength': 'kd_wavelength'})
+            for name in product_data.data_vars:
+                data[name] = product_data[name].reset_coords(drop=True)
+        elif product == 'SST':
+            sst = _AlignPeriods(product_data, 'time', periods)
+            data['sst'] = (('time', 'lat', 'lon'),
+                           Regrid(sst.values, (sst.longitude.values, sst.latitude.values), (LO, LA)))
+        elif product == 'AVW':
+            avw = _AlignPeriods(product_data.avw, 'date', periods)
+            data['avw'] = (('time', 'lat', 'lon'),
+                           Regrid(avw.values, (avw.lon.values, avw.lat.values), (LO, LA), method='mean'))
+
+    return data
 
 # Get cluster labels
-def GetClosestCluster(LO,LA, total_labels, target_lat, target_lon, dates):
+@Instrument
+def GetClosestCluster(LO,LA, total_labels, target_lat, target_lon, dates, periods=None):
 
-    tree = KDTree(np.c_[LO.ravel(),LA.ravel()])
-    labels = np.zeros(target_lon.shape[0])*np.NaN
-    
-    for ti in np.arange(target_lat.shape[0]):
-        dd, ii = tree.query([target_lon[ti],target_lat[ti]])
-    
-        # Get data period 
-        if dates[ti] < np.datetime64('2024-07-27'):
-            si = 0
-        else:
-            si = 1
-    
-        inds = np.unravel_index(ii,LO.shape)
-        labels[ti] = total_labels[si,inds[0], inds[1]]
+    """
+        Get the cluster label of the nearest grid cell for each target point. All
+        points are matched at once (see matchup.GridMatcher)
+
+        INPUTS
+        - LO, LA: longitude and latitude mesh of the cluster labels
+        - total_labels: cluster labels (time, lat, lon)
+        - target_lat, target_lon: coordinates of the points to label
+        - dates: date of each point
+        - periods: list of composite period start dates (or [start, end] pairs), one
+                   per time step of total_labels. If None, the two hackweek periods
+                   split at 2024-07-27 are used
+
+        OUTPUTS
+        - labels: cluster label of each point (NaN if the date is outside the periods)
+    """
+
+    matcher = GridMatcher(LO, LA)
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+
+    # Get data period
+    if periods is None:
+        period_index = np.where(dates < np.datetime64('2024-07-27'), 0, 1)
+    else:
+        period_index = GetPeriodIndex(dates, periods)
+
+    labels = MatchLabels(matcher, total_labels, np.asarray(target_lon).ravel(),
+                         np.asarray(target_lat).ravel(), period_index.ravel())
     return labels
 
-def GetMOANAMeans(flist, optimum_k, LO, LA, total_labels):
-    pcc_list =[ 'picoeuk_moana','prococcus_moana','syncoccus_moana']
+# Set in each worker process by _InitMOANAWorker so the grids are only sent once
+_MOANA_WORKER = {}
 
-    # Calculate averages 
-    moana_results = np.zeros((optimum_k, len(pcc_list),3))
-
-    for fname in flist:
-    #for fname in [flist[0]]:
-        datatree = open_datatree(fname)
-        dataset = xr.merge(datatree.to_dict().values())
-        
-        all_labels = np.zeros(dataset.longitude.values.shape)*np.NaN
-        good_inds = np.where(np.isnan(dataset.picoeuk_moana.values)==False)
-        
-        # Get nearest lat-lon then group and average
-        fdate = flist[0].split('/')[-1].split('.')[1]
-        fdate = np.datetime64(fdate[:4]+'-'+fdate[4:6]+'-'+fdate[6:8])
-        fdate = np.array([fdate]*good_inds[0].shape[0])
-        labels = GetClosestCluster(LO,LA, total_labels, dataset.latitude.values[good_inds].flatten(), 
-                                   dataset.longitude.values[good_inds].flatten(), fdate)
-        # Assing labels
-        all_labels[good_inds] = labels
-    
-        # Compute statistics
-        for ci in np.arange(optimum_k):
-            # For each cluster..find points that have that flag
-            inds = np.where(all_labels==ci)
-    
-            # If this cluster is present
-            if inds[0].shape[0]> 0:
-    
-                # Get cell counts 
-                for pi in np.arange(len(pcc_list)):
-                    
-                    slice_sum = np.nansum(dataset[pcc_list[pi]].values[inds])
-                    slice_sum2 = np.nansum(dataset[pcc_list[pi]].values[inds]**2)
-                    slice_size = inds[0].shape[0]
-    
-                    # running sum
-                    moana_results[ci,pi, 0] = moana_results[ci,pi, 0] + slice_sum
-    
-                    # running count
-                    moana_results[ci,pi, 1] = moana_results[ci,pi, 1] + slice_size
-    
-                    # variance
-                    moana_results[ci,pi, 2] = moana_results[ci,pi, 2] + slice_sum2
-    
-    n = moana_results[:,:,1]
-    moana_mean = moana_results[:,:,0]/n
-    moana_variance = ((moana_results[:,:,2] / n - moana_mean ** 2) * n / (n - 1))**(1/2)
+def _InitMOANAWorker(LO, LA, total_labels, periods, optimum_k, pcc_list):
+    _MOANA_WORKER.update(LO=LO, LA=LA, total_labels=total_labels, periods=periods,
+                         optimum_k=optimum_k, pcc_list=pcc_list)
+
+def GetMOANAFileDate(fname):
+
+    """
+        Get the date of a MOANA L2 file from its name (e.g. PACE_OCI.20240729T173723.L2_MOANA.V2.nc)
+    """
+    fdate = os.path.basename(fname).split('.')[1]
+    return np.datetime64(fdate[:4]+'-'+fdate[4:6]+'-'+fdate[6:8])
+
+def _MOANAFileMoments(fname):
+
+    """
+        Per-cluster (count, mean, M2) of the MOANA products in one L2 file
+    """
+    pcc_list = _MOANA_WORKER['pcc_list']
+    total_labels = _MOANA_WORKER['total_labels']
+    optimum_k = _MOANA_WORKER['optimum_k']
+
+    # Only read the products and the navigation we need
+    with xr.open_dataset(fname, group='geophysical_data') as prod, \
+         xr.open_dataset(fname, group='navigation_data') as nav:
+        values = np.stack([prod[p].values.ravel() for p in pcc_list], axis=1)
+        lon = nav.longitude.values.ravel()
+        lat = nav.latitude.values.ravel()
+
+    good_inds = np.where(np.isnan(values[:,0])==False)[0]
+
+    # Get nearest lat-lon for the period of this file
+    fdate = np.array([GetMOANAFileDate(fname)]*good_inds.shape[0])
+    labels = GetClosestCluster(_MOANA_WORKER['LO'], _MOANA_WORKER['LA'], total_labels,
+                               lat[good_inds], lon[good_inds], fdate, periods=_MOANA_WORKER['periods'])
+
+    return GroupedMoments(labels, values[good_inds], optimum_k)
+
+@Instrument
+def GetMOANAMeans(flist, optimum_k, LO, LA, total_labels, periods=None, max_workers=None):
+
+    """
+        Mean and standard deviation of the MOANA cell abundances in each cluster.
+        Each file is reduced in one grouped pass, files are processed in parallel and
+        the partial results are merged with a numerically stable combine
+
+        INPUTS
+        - flist: list of MOANA L2 files
+        - optimum_k: number of clusters
+        - LO, LA: longitude and latitude mesh of the cluster labels
+        - total_labels: cluster labels (time, lat, lon)
+        - periods: composite periods of total_labels (see GetClosestCluster)
+        - max_workers: number of worker processes (None = number of cpus, 1 = no pool)
+
+        OUTPUTS
+        - moana_mean: (optimum_k, 3) mean of picoeuk, prococcus and syncoccus
+        - moana_variance: (optimum_k, 3) standard deviation of the same
+    """
+    pcc_list =[ 'picoeuk_moana','prococcus_moana','syncoccus_moana']
+    initargs = (LO, LA, total_labels, periods, optimum_k, pcc_list)
+
+    moana_results = EmptyMoments(optimum_k, len(pcc_list))
+
+    if max_workers == 1 or len(flist) < 2:
+        # The grids are only held for this call, not for the rest of the session
+        _InitMOANAWorker(*initargs)
+        try:
+            for fname in flist:
+                moana_results = CombineMoments(moana_results, _MOANAFileMoments(fname))
+        finally:
+            _MOANA_WORKER.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_InitMOANAWorker,
+                                 initargs=initargs) as pool:
+            for file_results in pool.map(_MOANAFileMoments, flist):
+                moana_results = CombineMoments(moana_results, file_results)
+
+    n, moana_mean, moana_variance = FinalizeMoments(moana_results)
+    moana_variance = moana_variance**(1/2)
 
     return moana_mean, moana_variance
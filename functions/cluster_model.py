@@ -0,0 +1,146 @@
+# Saved cluster model: scaler, centroids and the features they were fitted on
+# New composite periods can be labelled with the saved model in one chunked
+# nearest-centroid pass, without refitting the scaler or K-means
+
+import json
+import numpy as np
+
+from feature_cube import FeatureCube
+from model_selection import NearestCenters
+from band_math import BandMath
+from instrument import Instrument
+
+MODEL_VERSION = 1
+
+
+@Instrument
+def BuildFeatures(data, features=('CHL', 'AVW', 'SST', 'POC', 'KD', 'FLH'), desired_wavelength=475):
+
+    """
+        Clustering features of a GetData dataset
+
+        INPUTS
+        - data: dataset from GetData (time, lat, lon)
+        - features: names of the features
+        - desired_wavelength: Kd wavelength (nm)
+
+        OUTPUTS
+        - dict of name -> array (time, lat, lon), in the order of features
+    """
+    builders = {'CHL': lambda: data.chlor_a.values,
+                'AVW': lambda: data.avw.values,
+                'SST': lambda: data.sst.values,
+                'POC': lambda: data.poc.values,
+                'KD': lambda: data.Kd.sel(kd_wavelength=desired_wavelength).values,
+                'FLH': lambda: BandMath(data.Rrs, ['nFLH'])['nFLH'].values}
+    for name in features:
+        if name not in builders:
+            raise ValueError('Unknown feature ' + name + ', expected one of ' + str(list(builders)))
+    return {name: builders[name]() for name in features}
+
+
+class ClusterModel:
+
+    """
+        Fitted scaler and K-means centroids that can be saved and used to label new periods
+
+        INPUTS
+        - features: feature names, in the column order of the fit
+        - mean, scale: StandardScaler parameters (n_features,)
+        - centers: K-means centroids in scaled units (n_clusters, n_features)
+        - desired_wavelength: Kd wavelength of the KD feature
+        - product_versions: dict of product -> version of the data used for the fit
+
+        EXAMPLE
+            model = ClusterModel.FromFit(scaler, kmeans_fit, cube.names, data=data)
+            model.Save('data/cluster_model.json')
+            ...
+            model = ClusterModel.Load('data/cluster_model.json')
+            new_labels = model.Predict(GetData(latN, latS, lonW, lonE, periods=['2024-08-04']))
+    """
+
+    def __init__(self, features, mean, scale, centers, desired_wavelength=475, product_versions=None):
+
+        self.features = list(features)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.centers = np.asarray(centers, dtype=float)
+        self.desired_wavelength = desired_wavelength
+        self.product_versions = dict(product_versions or {})
+
+        if self.centers.shape[1] != len(self.features) or self.mean.shape[0] != len(self.features):
+            raise ValueError('centers and scaler have ' + str(self.centers.shape[1]) + ' features, expected '
+                             + str(len(self.features)))
+
+    @property
+    def n_clusters(self):
+        return self.centers.shape[0]
+
+    @classmethod
+    def FromFit(cls, scaler, kmeans, features, data=None, desired_wavelength=475):
+
+        """
+            Model from a fitted StandardScaler and KMeans (or MiniBatchKMeans). If the GetData
+            dataset is given, the product versions in its attributes are kept with the model
+        """
+        versions = {}
+        if data is not None:
+            versions = {name[len('version_'):]: str(value) for name, value in data.attrs.items()
+                        if name.startswith('version_')}
+        return cls(features, scaler.mean_, scaler.scale_, kmeans.cluster_centers_,
+                   desired_wavelength=desired_wavelength, product_versions=versions)
+
+    def Save(self, path):
+
+        """
+            Save the model as a small JSON file
+        """
+        model = {'model_version': MODEL_VERSION, 'features': self.features,
+                 'mean': self.mean.tolist(), 'scale': self.scale.tolist(),
+                 'centers': self.centers.tolist(), 'desired_wavelength': self.desired_wavelength,
+                 'product_versions': self.product_versions}
+        with open(path, 'w') as f:
+            json.dump(model, f, indent=1)
+
+    @classmethod
+    def Load(cls, path):
+
+        """
+            Load a model saved with Save
+        """
+        with open(path) as f:
+            model = json.load(f)
+        if model.get('model_version') != MODEL_VERSION:
+            raise ValueError(path + ' has model version ' + str(model.get('model_version'))
+                             + ', expected ' + str(MODEL_VERSION))
+        return cls(model['features'], model['mean'], model['scale'], model['centers'],
+                   desired_wavelength=model['desired_wavelength'],
+                   product_versions=model['product_versions'])
+
+    def Predict(self, data, chunk_size=1000000, out=None):
+
+        """
+            Label every pixel of new data with the nearest centroid
+
+            INPUTS
+            - data: GetData dataset, dict of feature name -> array (time, lat, lon), or FeatureCube
+            - chunk_size: number of pixels scaled and labelled at a time
+            - out: optional output array (time, lat, lon)
+
+            OUTPUTS
+            - labels: float32 (time, lat, lon), NaN where a feature is missing
+        """
+        if isinstance(data, FeatureCube):
+            cube = data
+        elif isinstance(data, dict):
+            cube = FeatureCube({name: data[name] for name in self.features})
+        else:
+            cube = FeatureCube(BuildFeatures(data, self.features, self.desired_wavelength))
+
+        if cube.names != self.features:
+            raise ValueError('The data has features ' + str(cube.names) + ', the model ' + str(self.features))
+
+        labels = np.empty(cube.n_valid, dtype=np.float32)
+        for i0, X in zip(range(0, cube.n_valid, chunk_size), cube.Chunks(chunk_size)):
+            labels[i0:i0+X.shape[0]], _ = NearestCenters((X - self.mean)/self.scale, self.centers)
+        return cube.Scatter(labels, out=out)
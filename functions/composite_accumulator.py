@@ -0,0 +1,258 @@
+# Incremental N-day composites (e.g. 8-day SST or CHL) kept up to date one day at a time
+# Per-pixel count, mean and sum of squared deviations (M2) are saved on disk for each product
+# so a new day only costs that day's download and a few array operations, instead of a full reload
+
+import json
+import os
+import numpy as np
+
+from matchup import GridHash
+from grouped_stats import CombineMoments, FinalizeMoments
+
+
+def _Save(fname, **arrays):
+
+    # Write then rename so an interrupted run never leaves a broken state file
+    tmp = fname[:-4] + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, fname)
+
+
+def _Load(fname):
+
+    with np.load(fname) as saved:
+        return {name: saved[name] for name in saved.files}
+
+
+def _DayMoments(data):
+
+    # (count, mean, M2) of a single day
+    good = ~np.isnan(data)
+    return good.astype(float), np.where(good, data, 0), np.zeros(data.shape)
+
+
+class CompositeAccumulator:
+
+    """
+        On-disk running composites of one product
+
+        INPUTS
+        - store_dir: directory of the saved state
+        - product: product name (e.g. 'SST', 'CHL'), one sub directory per product
+        - window_days: length of the composites in days
+        - origin: first day of the first period (fixed mode), e.g. '2024-01-01'
+                  (PACE 8-day composites start on Jan 1 each year)
+        - mode:
+            - 'fixed': consecutive periods [origin, origin+N), [origin+N, origin+2N), ...
+                       each new day updates only its own period
+            - 'rolling': one window of the last window_days days, updated as days are added
+        - keep_days: the data of each day are kept on disk so the day can be replaced, only for
+                     the last keep_days days (default window_days; in fixed mode for the whole
+                     periods they overlap). Older days can no longer be replaced
+
+        EXAMPLES
+            acc = CompositeAccumulator('data/composites', 'SST', origin='2024-07-19')
+            for day in acc.MissingDays('2024-07-19', '2024-08-03'):
+                sst = SST8day(day, day).isel(time=0)
+                acc.AddDay(day, sst.values, sst.latitude.values, sst.longitude.values)
+            mean, std, count = acc.Composite('2024-07-27')
+
+        NOTES
+            Daily L3 fields can be added the same way with
+            get_L3_8Day(var, day, day, ..., granule_name='*.DAY.*.0p1deg.*')
+    """
+
+    def __init__(self, store_dir, product, window_days=8, origin=None, mode='fixed', keep_days=None):
+
+        if mode not in ('fixed', 'rolling'):
+            raise ValueError("mode must be 'fixed' or 'rolling', not " + repr(mode))
+        if mode == 'fixed' and origin is None:
+            raise ValueError("origin is needed for mode='fixed'")
+        keep_days = window_days if keep_days is None else keep_days
+        if keep_days < window_days:
+            raise ValueError('keep_days (' + str(keep_days) + ') must be at least window_days (' + str(window_days) + ')')
+
+        self.window_days = window_days
+        self.keep_days = keep_days
+        self.mode = mode
+        self.origin = None if origin is None else np.datetime64(origin, 'D')
+        self.path = os.path.join(store_dir, product)
+        os.makedirs(os.path.join(self.path, 'days'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'periods'), exist_ok=True)
+
+        self.meta_file = os.path.join(self.path, 'meta.json')
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as f:
+                self.meta = json.load(f)
+            if self.meta['window_days'] != window_days or self.meta['mode'] != mode or \
+               self.meta['origin'] != (None if origin is None else str(self.origin)):
+                raise ValueError('The saved composites of ' + product + ' use different settings: '
+                                 + str(self.meta))
+        else:
+            self.meta = {'window_days': window_days, 'mode': mode,
+                         'origin': None if origin is None else str(self.origin),
+                         'grid': None, 'days': []}
+
+    def _WriteMeta(self):
+
+        tmp = self.meta_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_file)
+
+    def _DayFile(self, day):
+        return os.path.join(self.path, 'days', str(day) + '.npz')
+
+    def _PeriodFile(self, start):
+        return os.path.join(self.path, 'periods', str(start) + '.npz')
+
+    def PeriodStart(self, day):
+
+        """
+            First day of the fixed period that day falls in
+        """
+        day = np.datetime64(day, 'D')
+        n = (day - self.origin) // np.timedelta64(self.window_days, 'D')
+        return self.origin + n*np.timedelta64(self.window_days, 'D')
+
+    def _KeptFrom(self, newest):
+
+        # First day whose data are kept: the last keep_days days, or the periods they overlap
+        first = np.datetime64(newest, 'D') - np.timedelta64(self.keep_days - 1, 'D')
+        return self.PeriodStart(first) if self.mode == 'fixed' else first
+
+    def _Prune(self):
+
+        # Remove the data of the days that are outside of every window that can still change
+        first = self._KeptFrom(self.meta['days'][-1])
+        for day in self.meta['days']:
+            if np.datetime64(day, 'D') >= first:
+                break
+            if os.path.exists(self._DayFile(day)):
+                os.remove(self._DayFile(day))
+
+    def MissingDays(self, start_date, end_date):
+
+        """
+            Days between start_date and end_date (inclusive) that have not been added yet
+        """
+        days = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1)
+        done = set(self.meta['days'])
+        return [str(day) for day in days if str(day) not in done]
+
+    def AddDay(self, day, data, lat, lon):
+
+        """
+            Add one day of data (NaN = no data) to the composites.
+            Adding a day again replaces its earlier contribution (e.g. reprocessed NRT data)
+
+            INPUTS
+            - day: date of the data
+            - data: (lat, lon) field, or (..., lat, lon)
+            - lat, lon: 1D coordinates of the data, or 2D meshes of the same shape as the field
+        """
+        day = np.datetime64(day, 'D')
+        data = np.asarray(data, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+
+        shape = lat.shape if lat.ndim == 2 else (lat.shape[0], lon.shape[0])
+        if data.shape[-2:] != shape:
+            raise ValueError('data shape ' + str(data.shape) + ' does not match the lat/lon grid ' + str(shape))
+        grid = GridHash(lat, lon, np.array(data.shape))
+        if self.meta['grid'] is None:
+            self.meta['grid'] = grid
+        elif self.meta['grid'] != grid:
+            raise ValueError('The lat/lon grid of ' + str(day) + ' does not match the saved composites')
+
+        # The data of this day are kept so its contribution can be replaced or removed later
+        replace = str(day) in self.meta['days']
+        if replace and self.mode == 'fixed' and self.PeriodStart(day) < self._KeptFrom(self.meta['days'][-1]):
+            raise ValueError('The data of the period of ' + str(day) + ' have been pruned (keep_days='
+                             + str(self.keep_days) + '), its days can no longer be replaced')
+        _Save(self._DayFile(day), data=data)
+        if not replace:
+            self.meta['days'] = sorted(self.meta['days'] + [str(day)])
+
+        if self.mode == 'fixed':
+            start = self.PeriodStart(day)
+            fname = self._PeriodFile(start)
+            if replace:
+                days = [d for d in self.meta['days'] if self.PeriodStart(d) == start]
+                self._Rebuild(fname, days)
+            else:
+                self._Add(fname, _DayMoments(data))
+        else:
+            self._UpdateRolling(day, data, replace)
+        self._WriteMeta()
+        self._Prune()
+
+    def _Add(self, fname, moments, extra=None):
+
+        # Combine the moments of new data with the saved ones
+        if os.path.exists(fname):
+            state = _Load(fname)
+            moments = CombineMoments((state['count'], state['mean'], state['M2']), moments)
+        else:
+            state = {}
+        state.update(count=moments[0], mean=moments[1], M2=moments[2])
+        if extra is not None:
+            state.update(extra)
+        _Save(fname, **state)
+
+    def _Rebuild(self, fname, days, extra=None):
+
+        # Moments of a list of days from their saved data (replacing or removing a day)
+        moments = None
+        for day in days:
+            day_moments = _DayMoments(_Load(self._DayFile(day))['data'])
+            moments = day_moments if moments is None else CombineMoments(moments, day_moments)
+        state = {'count': moments[0], 'mean': moments[1], 'M2': moments[2]}
+        if extra is not None:
+            state.update(extra)
+        _Save(fname, **state)
+
+    def _UpdateRolling(self, day, data, replace):
+
+        fname = os.path.join(self.path, 'rolling.npz')
+        state = _Load(fname) if os.path.exists(fname) else None
+        end = day if state is None else max(day, np.datetime64(str(state['end']), 'D'))
+        window_start = end - np.timedelta64(self.window_days - 1, 'D')
+        window = [] if state is None else [np.datetime64(str(d), 'D') for d in state['days']]
+        if day < window_start:
+            return
+
+        # Days leaving the window (or a replaced day) are removed by combining the saved days again
+        kept = [d for d in window if d >= window_start]
+        days = sorted(set(kept + [day]))
+        extra = {'end': np.array(str(end)), 'days': np.array([str(d) for d in days])}
+        if len(kept) < len(window) or (replace and day in window):
+            self._Rebuild(fname, days, extra=extra)
+        else:
+            self._Add(fname, _DayMoments(data), extra=extra)
+
+    def Composite(self, start=None):
+
+        """
+            OUTPUTS
+            - mean, std, count of the fixed period starting on (or containing) start,
+              or of the current rolling window
+        """
+        if self.mode == 'fixed':
+            fname = self._PeriodFile(self.PeriodStart(start))
+        else:
+            fname = os.path.join(self.path, 'rolling.npz')
+        if not os.path.exists(fname):
+            raise ValueError('No data has been added for ' + str(start))
+
+        state = _Load(fname)
+        count, mean, variance = FinalizeMoments((state['count'], state['mean'], state['M2']), ddof=1)
+        return mean, np.sqrt(variance), count.astype(np.int32)
+
+    def Periods(self):
+
+        """
+            Start dates of the fixed periods that have data
+        """
+        return sorted(f[:-4] for f in os.listdir(os.path.join(self.path, 'periods')) if f.endswith('.npz')
+                      and not f.endswith('.tmp.npz'))
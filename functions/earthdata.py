@@ -0,0 +1,27 @@
+# NASA Earthdata login on the first remote call instead of at import
+# Importing the workflow modules does not need a network connection or credentials,
+# so offline jobs, cached runs and worker processes start without logging in
+
+import threading
+
+_LOGIN_LOCK = threading.Lock()
+_SESSION = {}
+
+
+def Earthaccess(persist=True):
+
+    """
+        The earthaccess module, logged in to Earthdata the first time it is needed in this
+        session (credentials from ~/.netrc, the environment or a prompt). Product downloads
+        running in parallel threads share the one login
+
+        EXAMPLE
+            earthaccess = Earthaccess()
+            sources = earthaccess.open(earthaccess.search_data(**query))
+    """
+    with _LOGIN_LOCK:
+        if 'earthaccess' not in _SESSION:
+            import earthaccess
+            _SESSION['auth'] = earthaccess.login(persist=persist)
+            _SESSION['earthaccess'] = earthaccess
+    return _SESSION['earthaccess']
@@ -0,0 +1,153 @@
+# Compact feature matrix for clustering
+# All products are packed into one contiguous float32 (n_valid, n_features) matrix,
+# optionally memory-mapped, with a bit-packed mask of the valid (time, lat, lon) pixels
+# so labels can be put back on the grid without intermediate DataFrames
+
+import json
+import numpy as np
+
+
+class FeatureCube:
+
+    """
+        Feature matrix of the pixels where every product has data
+
+        INPUTS
+        - products: dict of name -> array (time, lat, lon) (numpy, memmap or xarray);
+                    the arrays are read one chunk at a time
+        - path: optional file name; the matrix is then a np.memmap on disk (with the
+                mask and names saved next to it, see FeatureCube.Open)
+        - chunk_rows: number of latitude rows read at a time
+
+        EXAMPLE
+            cube = FeatureCube({'CHL': data.chlor_a.values, 'SST': sst, ...})
+            scaler = StandardScaler().fit(cube.X)
+            labels = KMeans(n_clusters=6).fit_predict(scaler.transform(cube.X))
+            total_labels = cube.Scatter(labels)
+    """
+
+    def __init__(self, products, path=None, chunk_rows=64):
+
+        if products is None:
+            return
+
+        self.names = list(products.keys())
+        arrays = [products[name] for name in self.names]
+        self.shape = tuple(arrays[0].shape)
+        for name, arr in zip(self.names, arrays):
+            if tuple(arr.shape) != self.shape:
+                raise ValueError(name + ' has shape ' + str(tuple(arr.shape)) + ', expected ' + str(self.shape))
+
+        n_time, n_lat, n_lon = self.shape
+        chunks = [(ti, r0, min(r0+chunk_rows, n_lat)) for ti in range(n_time) for r0 in range(0, n_lat, chunk_rows)]
+
+        # Pass 1: validity mask
+        valid = np.ones(self.shape, dtype=bool)
+        for ti, r0, r1 in chunks:
+            for arr in arrays:
+                valid[ti, r0:r1, :] &= ~np.isnan(np.asarray(arr[ti, r0:r1, :], dtype=np.float32))
+        self.mask_bits = np.packbits(valid.ravel())
+        self.n_valid = int(valid.sum())
+
+        # Pass 2: fill the matrix chunk by chunk
+        self.path = path
+        size = (self.n_valid, len(self.names))
+        if path is None:
+            self.X = np.empty(size, dtype=np.float32)
+        else:
+            self.X = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=size)
+
+        i0 = 0
+        for ti, r0, r1 in chunks:
+            chunk_valid = valid[ti, r0:r1, :]
+            n = int(chunk_valid.sum())
+            for fi, arr in enumerate(arrays):
+                self.X[i0:i0+n, fi] = np.asarray(arr[ti, r0:r1, :], dtype=np.float32)[chunk_valid]
+            i0 += n
+
+        if path is not None:
+            self.X.flush()
+            np.save(path + '.mask.npy', self.mask_bits)
+            with open(path + '.json', 'w') as f:
+                json.dump({'names': self.names, 'shape': self.shape, 'n_valid': self.n_valid}, f)
+
+    @classmethod
+    def Open(cls, path, mode='r'):
+
+        """
+            Reopen a memory-mapped FeatureCube saved with path
+        """
+        cube = cls(None)
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        cube.names = meta['names']
+        cube.shape = tuple(meta['shape'])
+        cube.n_valid = meta['n_valid']
+        cube.path = path
+        cube.mask_bits = np.load(path + '.mask.npy')
+        cube.X = np.load(path, mmap_mode=mode)
+        return cube
+
+    @property
+    def valid(self):
+
+        """
+            Boolean mask (time, lat, lon) of the pixels in X
+        """
+        n = int(np.prod(self.shape))
+        return np.unpackbits(self.mask_bits, count=n).view(bool).reshape(self.shape)
+
+    def Chunks(self, chunk_size=1000000):
+
+        """
+            Yield views (no copy) of consecutive row blocks of X
+        """
+        for i0 in range(0, self.n_valid, chunk_size):
+            yield self.X[i0:i0+chunk_size]
+
+    def TimeSlices(self):
+
+        """
+            Yield (ti, valid, X_t) for every time step: the mask (lat, lon) of the valid pixels
+            and the rows of X (a view) that belong to them, in the same order
+        """
+        n_time, n_lat, n_lon = self.shape
+        n = n_lat*n_lon
+        i0 = 0
+        for ti in range(n_time):
+            # Only the bits of this time step are unpacked
+            b0, b1 = (ti*n)//8, (ti*n + n + 7)//8
+            bits = np.unpackbits(self.mask_bits[b0:b1])
+            offset = ti*n - 8*b0
+            valid = bits[offset:offset+n].view(bool).reshape(n_lat, n_lon)
+            n_valid = int(valid.sum())
+            yield ti, valid, self.X[i0:i0+n_valid]
+            i0 += n_valid
+
+    def Scatter(self, values, fill=np.nan, dtype=np.float32, out=None):
+
+        """
+            Put one value per row of X (e.g. cluster labels) back on the (time, lat, lon) grid
+
+            INPUTS
+            - values: array (n_valid,)
+            - fill: value of the pixels that are not in X
+            - out: optional output array (time, lat, lon), e.g. a np.memmap or a view of a
+                   larger array
+        """
+        if values.shape[0] != self.n_valid:
+            raise ValueError('Expected ' + str(self.n_valid) + ' values, got ' + str(values.shape[0]))
+
+        if out is None:
+            out = np.full(self.shape, fill, dtype=dtype)
+        elif tuple(out.shape) != self.shape:
+            raise ValueError('out has shape ' + str(tuple(out.shape)) + ', expected ' + str(self.shape))
+        else:
+            out[...] = fill
+
+        # Written one time step at a time into out itself, so views and memmap slices work too
+        i0 = 0
+        for ti, valid, X in self.TimeSlices():
+            out[ti][valid] = values[i0:i0+X.shape[0]]
+            i0 += X.shape[0]
+        return out
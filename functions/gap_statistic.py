@@ -0,0 +1,158 @@
+# Gap statistic (Tibshirani, Walther & Hastie 2001) for choosing the number of K-means clusters
+# The uniform reference datasets are drawn in one vectorized call and every (K, reference)
+# K-means fit runs in a process pool that reads the data from shared memory, K values are
+# evaluated in rounds so the search can stop as soon as the gap criterion is met
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from sklearn.cluster import KMeans
+from threadpoolctl import threadpool_limits
+
+
+_GAP_WORKER = {}
+
+def _InitGapWorker(data_name, refs_name, data_shape, refs_shape, dtype, n_init):
+
+    # One BLAS/OpenMP thread per process, the pool provides the parallelism
+    threadpool_limits(1)
+    data_shm = shared_memory.SharedMemory(name=data_name)
+    refs_shm = shared_memory.SharedMemory(name=refs_name)
+    _GAP_WORKER.update(data_shm=data_shm, refs_shm=refs_shm, n_init=n_init,
+                       data=np.ndarray(data_shape, dtype=dtype, buffer=data_shm.buf),
+                       refs=np.ndarray(refs_shape, dtype=dtype, buffer=refs_shm.buf))
+
+def _LogDispersion(task):
+
+    # log(W_k) of the data (ref = -1) or of one reference dataset
+    k, ref, seed = task
+    X = _GAP_WORKER['data'] if ref < 0 else _GAP_WORKER['refs'][ref]
+    kmeans = KMeans(n_clusters=k, n_init=_GAP_WORKER['n_init'], random_state=seed).fit(X)
+    return k, ref, np.log(kmeans.inertia_)
+
+
+def ReferenceDatasets(data, n_refs=10, method='uniform', random_state=None, dtype=np.float32):
+
+    """
+        Reference datasets with no cluster structure
+
+        INPUTS
+        - data: array (n_samples, n_features)
+        - n_refs: number of reference datasets
+        - method:
+            - 'uniform': uniform over the bounding box of the features
+            - 'pca': uniform over the box aligned with the principal components of the data
+        - random_state: seed
+
+        OUTPUTS
+        - refs: array (n_refs, n_samples, n_features)
+    """
+    rng = np.random.default_rng(random_state)
+    data = np.asarray(data, dtype=float)
+
+    if method == 'uniform':
+        low, high = data.min(axis=0), data.max(axis=0)
+        return rng.uniform(low, high, size=(n_refs,) + data.shape).astype(dtype)
+
+    if method == 'pca':
+        center = data.mean(axis=0)
+        _, _, vt = np.linalg.svd(data - center, full_matrices=False)
+        rotated = (data - center) @ vt.T
+        low, high = rotated.min(axis=0), rotated.max(axis=0)
+        refs = rng.uniform(low, high, size=(n_refs,) + data.shape) @ vt + center
+        return refs.astype(dtype)
+
+    raise ValueError("method must be 'uniform' or 'pca', not " + repr(method))
+
+
+def GapStatistic(data, max_K=10, n_refs=10, method='uniform', early_stop=True, n_init=3,
+                 max_workers=None, k_per_round=None, random_state=None):
+
+    """
+        Optimal number of K-means clusters from the gap statistic
+
+        INPUTS
+        - data: array (n_samples, n_features), e.g. scaled features
+        - max_K: largest number of clusters evaluated (K = 1...max_K)
+        - n_refs: number of reference datasets (B)
+        - method: reference distribution, see ReferenceDatasets
+        - early_stop: stop at the first K with gap(K) >= gap(K+1) - s(K+1)
+        - n_init: K-means initialisations per fit
+        - max_workers: number of worker processes (None = number of cpus, 1 = no pool)
+        - k_per_round: number of K values submitted together (default: enough to keep
+                       all workers busy); with early_stop only the rounds needed are run
+        - random_state: seed
+
+        OUTPUTS
+        - dict of arrays, NaN for the K values that were not evaluated:
+            - 'K': 1...max_K
+            - 'log_W': log within-cluster dispersion of the data
+            - 'ref_log_W': mean log dispersion of the reference datasets
+            - 'gap': ref_log_W - log_W
+            - 's': standard error sd*sqrt(1 + 1/n_refs)
+            - 'optimum': first K that meets the criterion (max_K if none does)
+    """
+    rng = np.random.default_rng(random_state)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    refs = ReferenceDatasets(data, n_refs, method, random_state=rng)
+
+    n_workers = max_workers if max_workers is not None else os.cpu_count()
+    if k_per_round is None:
+        k_per_round = max(1, int(np.ceil(n_workers/(n_refs + 1))))
+
+    K = np.arange(1, max_K + 1)
+    log_w = np.full((max_K, n_refs + 1), np.nan)
+    seeds = rng.integers(2**31, size=(max_K, n_refs + 1))
+
+    def criterion():
+        # First K (with K+1 evaluated) where gap(K) >= gap(K+1) - s(K+1)
+        gap, s = _GapCurves(log_w, n_refs)
+        met = np.where(gap[:-1] >= gap[1:] - s[1:])[0]
+        return K[met[0]] if met.shape[0] > 0 else None
+
+    def rounds(run):
+        for k0 in range(1, max_K + 1, k_per_round):
+            tasks = [(k, ref, int(seeds[k-1, ref+1])) for k in range(k0, min(k0 + k_per_round, max_K + 1))
+                     for ref in range(-1, n_refs)]
+            for k, ref, value in run(tasks):
+                log_w[k-1, ref+1] = value
+            if early_stop and criterion() is not None:
+                break
+
+    if max_workers == 1:
+        # The arrays are only held for this call, not for the rest of the session
+        _GAP_WORKER.update(data=data, refs=refs, n_init=n_init)
+        try:
+            rounds(lambda tasks: map(_LogDispersion, tasks))
+        finally:
+            _GAP_WORKER.clear()
+    else:
+        shms = []
+        try:
+            for arr in (data, refs):
+                shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                shms.append(shm)
+            initargs = (shms[0].name, shms[1].name, data.shape, refs.shape, data.dtype, n_init)
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_InitGapWorker,
+                                     initargs=initargs) as pool:
+                rounds(lambda tasks: pool.map(_LogDispersion, tasks))
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    gap, s = _GapCurves(log_w, n_refs)
+    optimum = criterion()
+    return {'K': K, 'log_W': log_w[:, 0], 'ref_log_W': log_w[:, 1:].mean(axis=1), 'gap': gap, 's': s,
+            'optimum': int(optimum) if optimum is not None else int(max_K)}
+
+
+def _GapCurves(log_w, n_refs):
+
+    ref = log_w[:, 1:]
+    with np.errstate(invalid='ignore'):
+        gap = ref.mean(axis=1) - log_w[:, 0]
+        s = ref.std(axis=1)*np.sqrt(1 + 1/n_refs)
+    return gap, s
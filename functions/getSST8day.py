@@ -1,12 +1,61 @@
 
+import io
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import xarray as xr
 from datetime import datetime
 from datetime import date
 from datetime import timedelta
+from instrument import Instrument
 
+ERDDAP_URL = '/'.join(['https://comet.nefsc.noaa.gov',
+                       'erddap',
+                       'griddap',
+                       'noaa_coastwatch_acspo_v2_nrt'
+                       ])
+
+def _GriddapRequest(erddap_url, variable, index_slices):
+    """
+    ERDDAP griddap url for an index hyperslab ([start:stride:stop], stop inclusive) returned as NetCDF
+    """
+    constraint = ''.join('[{}:{}:{}]'.format(sl.start, sl.step, sl.stop - 1) for sl in index_slices)
+    return erddap_url + '.nc?' + variable + constraint
+
+def _FetchGriddap(url, retries=3):
+    """
+    Download one griddap request (with retries) and return it as an in-memory dataset
+    """
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(url) as response:
+                content = response.read()
+            break
+        except OSError:
+            if attempt == retries:
+                raise
+            time.sleep(2**attempt)
+    return xr.load_dataset(io.BytesIO(content))
+
+def _PeriodIndex(days, periods):
+    """
+    Period of each day for a list of period start dates: a period runs 8 days, or up to the next start
+    (e.g. the short last composite of a year). Returns the sorted starts, the period index of each day
+    and the mask of the days that fall in a period
+    """
+    starts = np.unique(np.array(periods, dtype='datetime64[D]'))
+    ends = np.minimum(starts + 8, np.append(starts[1:], starts[-1] + 8))
+    days = days.astype('datetime64[D]')
+    period = np.searchsorted(starts, days, side='right') - 1
+    inside = (period >= 0) & (days < ends[np.maximum(period, 0)])
+    return starts, period, inside
+
+@Instrument
 def SST8day(start_date,end_date=date.today()-timedelta(days=8),
             latmin=20,latmax=50,lonmin=-80,lonmax=-45,
-            variable='sea_surface_temperature'):
+            variable='sea_surface_temperature',erddap_url=ERDDAP_URL,
+            chunked=True,chunk_days=8,tile_rows=None,stride=1,max_workers=4,periods=None):
     """
     PURPOSE: Function to download SST data and return 8-day means
     REQUIRED INPUTS: 
@@ -18,14 +67,33 @@ def SST8day(start_date,end_date=date.today()-timedelta(days=8),
       LATMAX......... Maximum latidue of the boundingn box
       LONMIN......... Minimum longitude of the boundingn box
       LONMAX......... Maximum longitude of the boundingn box
+      ERDDAP_URL..... ERDDAP griddap dataset url (default is the ACSPO NRT dataset on the NEFSC ERDDAP)
+      CHUNK_DAYS..... Number of days requested at a time (chunked mode)
+      TILE_ROWS...... Number of latitude rows requested at a time (chunked mode, default all)
+      STRIDE......... Server-side stride in latitude and longitude, e.g. 5 for a 0.1 degree grid from 0.02 degree data
+      MAX_WORKERS.... Number of requests running at the same time (chunked mode)
+      PERIODS........ Start dates of the 8-day periods, e.g. the PACE composite dates (default: 8-day periods
+                      from the first day with data)
 
     KEYWORDS
+      CHUNKED........ Split the request into time/space chunks that are downloaded in parallel and
+                      reduced to 8-day sums as soon as they arrive, so the daily data are never all in
+                      memory (default). If False, the whole daily cube is loaded over OPeNDAP and resampled
 
     OUTPUTS
+      8-day mean SST (time, latitude, longitude), time is the first day of each 8-day period
+      (with PERIODS, one time per period, NaN where a period has no data)
 
     EXAMPLES
+      sst = SST8day('2024-07-19','2024-08-03')
+      sst = SST8day('2024-07-19','2024-08-03',erddap_url='http://localhost:8080/erddap/griddap/test_sst')
+      sst = SST8day('2024-07-15','2024-08-03',periods=['2024-07-19','2024-07-27'])
 
     NOTES
+      Without PERIODS, the 8-day periods start on the first day with data, the same as resample(time='8d').
+      With PERIODS, each period runs 8 days (or up to the next start) and days outside every period are left out
+      The default dataset is the ACSPO NRT product; for dates before it starts, pass the erddap_url of a
+      reanalysis SST dataset on the same ERDDAP
 
     COPYRIGHT: 
         Copyright (C) 2024, Department of Commerce, National Oceanic and Atmospheric Administration, National Marine Fisheries Service,
@@ -41,21 +109,95 @@ This routine is provided AS IS without any express or implied warranties whatsoe
     """
     
     # Get the data
-    # TODO: make the erddap url an input variable that defaults to this url. Should use the NRT for recent data, but the reanalysis product for later dates
-    erddap_url = '/'.join(['https://comet.nefsc.noaa.gov',
-                       'erddap',
-                       'griddap',
-                       'noaa_coastwatch_acspo_v2_nrt'
-                       ])
-    ds = xr.open_dataset(erddap_url)
-    ds_subset = ds[variable].sel(time=slice(start_date, end_date),
-                                                  latitude=slice(latmax,latmin),
-                                                  longitude=slice(lonmin,lonmax), 
-                                                )
+    if not chunked:
+        ds = xr.open_dataset(erddap_url)
+        ds_subset = ds[variable].sel(time=slice(start_date, end_date),
+                                                      latitude=slice(latmax,latmin),
+                                                      longitude=slice(lonmin,lonmax), 
+                                                    )
+        ds_subset = ds_subset.isel(latitude=slice(None,None,stride),longitude=slice(None,None,stride))
+        ds_subset.load()
+        if periods is None:
+            ds_8day = ds_subset.resample(time='8d').mean(dim='time')
+        else:
+            starts, period, inside = _PeriodIndex(ds_subset.time.values, periods)
+            ds_8day = xr.concat([ds_subset.isel(time=np.where(inside & (period == pi))[0]).mean(dim='time')
+                                 for pi in range(starts.shape[0])],
+                                dim=xr.DataArray(starts.astype('datetime64[ns]'), dims='time', name='time'))
+        return ds_8day
 
-    
-    ds_subset.load()
-    ds_8day = ds_subset.resample(time='8d').mean(dim='time')
+    # Get the axes and the index range of the subset (ERDDAP latitudes can be in either order)
+    axes = _FetchGriddap(erddap_url + '.nc?time,latitude,longitude')
+    times = axes.time.values
+    lats = axes.latitude.values
+    lons = axes.longitude.values
+    tinds = np.where((times >= np.datetime64(str(start_date))) &
+                     (times < np.datetime64(str(end_date)) + np.timedelta64(1, 'D')))[0]
+    latinds = np.where((lats >= latmin) & (lats <= latmax))[0]
+    loninds = np.where((lons >= lonmin) & (lons <= lonmax))[0]
+    if lats[0] < lats[-1]:
+        latinds = latinds[::-1]
+    latinds = latinds[::stride]
+    loninds = loninds[::stride]
+    if periods is not None:
+        starts, period, inside = _PeriodIndex(times[tinds], periods)
+        tinds = tinds[inside]
+        period = period[inside]
+    if tinds.shape[0] == 0:
+        raise ValueError('No SST data between {} and {} in {}'.format(start_date, end_date, erddap_url))
+    if latinds.shape[0] == 0 or loninds.shape[0] == 0:
+        raise ValueError('No SST data in latitudes {} to {}, longitudes {} to {}'.format(latmin, latmax, lonmin, lonmax))
+
+    # Assign each day to its 8-day period
+    times = times[tinds]
+    if periods is None:
+        origin = times[0].astype('datetime64[D]')
+        period = ((times - origin) // np.timedelta64(8, 'D')).astype(int)
+        n_period = period[-1] + 1
+        period_times = origin.astype('datetime64[ns]') + np.arange(n_period)*np.timedelta64(8, 'D')
+    else:
+        n_period = starts.shape[0]
+        period_times = starts.astype('datetime64[ns]')
+
+    # Time chunks never cross periods, so each chunk adds to a single period
+    time_chunks = []
+    for pi in np.arange(n_period):
+        inds = np.where(period == pi)[0]
+        for i0 in range(0, inds.shape[0], chunk_days):
+            time_chunks.append((pi, tinds[inds[i0:i0+chunk_days]]))
+
+    nlat = latinds.shape[0]
+    nlon = loninds.shape[0]
+    tile_rows = nlat if tile_rows is None else tile_rows
+    lat_tiles = [(r0, min(r0+tile_rows, nlat)) for r0 in range(0, nlat, tile_rows)]
+
+    def Request(pi, chunk_tinds, r0, r1):
+        rows = latinds[r0:r1]
+        slices = [slice(chunk_tinds[0], chunk_tinds[-1]+1, 1),
+                  slice(min(rows[0], rows[-1]), max(rows[0], rows[-1])+1, stride),
+                  slice(loninds[0], loninds[-1]+1, stride)]
+        chunk = _FetchGriddap(_GriddapRequest(erddap_url, variable, slices))
+        chunk = chunk[variable].sortby('latitude', ascending=False).values.reshape(len(chunk_tinds), r1-r0, nlon)
+        return pi, r0, r1, np.nansum(chunk, axis=0), np.sum(~np.isnan(chunk), axis=0)
+
+    # Download the chunks in parallel and add them to the 8-day sums as they arrive
+    sums = np.zeros((n_period, nlat, nlon))
+    counts = np.zeros((n_period, nlat, nlon))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(Request, pi, chunk_tinds, r0, r1)
+                   for pi, chunk_tinds in time_chunks for r0, r1 in lat_tiles]
+        for future in as_completed(futures):
+            pi, r0, r1, chunk_sum, chunk_count = future.result()
+            sums[pi, r0:r1, :] += chunk_sum
+            counts[pi, r0:r1, :] += chunk_count
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums / counts).astype(np.float32)
+
+    ds_8day = xr.DataArray(mean, dims=('time', 'latitude', 'longitude'),
+                           coords={'time': period_times,
+                                   'latitude': np.sort(lats[latinds])[::-1],
+                                   'longitude': lons[loninds]},
+                           name=variable)
     
     return ds_8day
-
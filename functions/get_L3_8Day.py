@@ -1,58 +1,78 @@
-import earthaccess
+import os
 import xarray as xr
-from xarray.backends.api import open_datatree
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import numpy as np
+from contextlib import nullcontext
 from datetime import datetime
 from datetime import timezone
-auth = earthaccess.login(persist=True)
+from concurrent.futures import ThreadPoolExecutor
+from granule_cache import GranuleCache, SubsetROI, NETCDF_LOCK
+from earthdata import Earthaccess
+from instrument import Instrument, Stage
 
-def get_L3_8Day(var,starttime,endtime,lonE,lonW,latN,latS):
+def _OpenGranule(source, var, lonE, lonW, latN, latS, cache, chunks):
+
+    """
+        Open one granule, cut the ROI and add its date. The ROI is read here (in the
+        worker thread) unless chunks asks for dask arrays
+    """
+    if cache is not None:
+        dataset = cache.subset(source, var, lonE, lonW, latN, latS, chunks=chunks)
+    else:
+        # Extract ROI (lazy, only the ROI is read). Local files are read one at a time
+        # (netCDF-C is not thread safe), remote files in parallel
+        with NETCDF_LOCK if isinstance(source, (str, os.PathLike)) else nullcontext():
+            dataset = SubsetROI(xr.open_dataset(source, chunks=chunks), lonE, lonW, latN, latS)
+            if chunks is None:
+                dataset = dataset.load()
+
+    # Save the composite start date (UTC) as the date coordinate
+    d = np.datetime64(dataset.attrs['time_coverage_start'][:-1], 'ns')
+    dataset = dataset.expand_dims(date=[d])
+    return dataset.assign_coords(time_coverage_start=('date', [dataset.attrs['time_coverage_start']]),
+                                 time_coverage_end=('date', [dataset.attrs['time_coverage_end']]))
+
+@Instrument
+def get_L3_8Day(var,starttime,endtime,lonE,lonW,latN,latS,cache_dir=None,max_cache_bytes=20e9,
+                chunks=None,max_workers=8,granule_name="*.8D.*.0p1deg.*"):
     """
         Grab mapped L3 8-day composites at 0.01 deg resolution
         start and end dates are datetime objects
         var input as string 
-        IF VAR = RRS: only grabs data for starttime
+        All products (including RRS) are returned with one slice per 8-day period
+        along the date dimension
+        If cache_dir is set, granules and ROI subsets are kept on local disk
+        (see granule_cache.GranuleCache) and repeat requests are read from there
+        Granules are opened and their ROI read by max_workers threads; pass chunks
+        (e.g. chunks={}) to keep them lazy as dask arrays instead
+        granule_name can select other composites, e.g. "*.DAY.*.0p1deg.*" for daily files
     """
     # Input datetime objects are converted to strings
     t1 = starttime.strftime('%Y-%m-%d')
     t2 = endtime.strftime('%Y-%m-%d')
-
-    if var == "RRS":
-        tspan = (t1, t1)
-    else:
-        tspan = (t1, t2)
+    tspan = (t1, t2)
     
     # Grab 8-day data @ 0.01 degree (1 km)
-    results = earthaccess.search_data(
-        short_name="PACE_OCI_L3M_" + var + "_NRT",
-        temporal=tspan,
-        granule_name="*.8D.*.0p1deg.*",
-    )
-    paths = earthaccess.open(results)
+    query = dict(short_name="PACE_OCI_L3M_" + var + "_NRT",
+                 temporal=tspan,
+                 granule_name=granule_name)
+    with Stage('search_granules', product=var):
+        if cache_dir is None:
+            cache = None
+            earthaccess = Earthaccess()
+            sources = earthaccess.open(earthaccess.search_data(**query))
+        else:
+            cache = GranuleCache(cache_dir, max_bytes=max_cache_bytes)
+            sources = cache.search(**query)
+    if len(sources) == 0:
+        raise ValueError('No {} granules ({}) between {} and {}'.format(query['short_name'], granule_name, t1, t2))
 
-    # Set blank list to save paths to
-    ds_grid = []
-    
-    # For each path/file: extract ROI. if non-Rrs fields, nest by date
-    for idx in range(len(paths)):
-        dataset = xr.open_dataset(paths[idx])
-        
-        # Extract ROI
-        dataset = dataset.isel(lon=np.where((dataset.lon.values>=lonW) & (dataset.lon.values<=lonE))[0],
-        lat=np.where((dataset.lat.values>=latS) & (dataset.lat.values<=latN))[0])
+    # For each path/file: extract ROI and date, in parallel
+    with Stage('open_granules', product=var, n_granules=len(sources)), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        ds_grid = list(pool.map(lambda source: _OpenGranule(source, var, lonE, lonW, latN, latS, cache, chunks),
+                                sources))
 
-        # When grabbing non-Rrs fields, nest files as day "slices"
-        if var != "RRS":
-            # Save date as coord (why not as variable?)
-            d = datetime.fromisoformat(dataset.attrs['time_coverage_start'][:-1]).astimezone(timezone.utc)
-            ds_grid.append(dataset.assign(date = d).set_coords("date"))
-            
-            # convert list to nested dataset
-            dataset = xr.combine_nested(ds_grid,concat_dim="date")
+    # Nest files as date "slices" with a single concatenation
+    ds_grid = sorted(ds_grid, key=lambda ds: ds.date.values[0])
+    dataset = xr.concat(ds_grid, dim="date", data_vars="minimal", coords="minimal",
+                        combine_attrs="override")
     return dataset
-
-
-
-
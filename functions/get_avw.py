@@ -2,44 +2,67 @@
 # Created by Kitty Kam
 
 # Import library
-import earthaccess
 import xarray as xr
-from xarray.backends.api import open_datatree
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import numpy as np
 import os
+import glob
+import re
 from datetime import datetime, timezone
+from instrument import Instrument
+
+
+def _FileStart(path):
+
+    # Start date in the file name (PACE_OCI.20240719_20240726...), None if it has none
+    match = re.search(r'\.(\d{8})_\d{8}\.', os.path.basename(path))
+    return None if match is None else np.datetime64(datetime.strptime(match.group(1), '%Y%m%d').date(), 'D')
 
 
 # function
-def get_avw():
+@Instrument
+def get_avw(periods=None, data_dir='data/AVW data/'):
+    """
+        Read the 8-day AVW files in data_dir
+        (e.g. PACE_OCI.20240719_20240726.L3m.8D.AVW.V2_0.NRT.x_avw.nc)
+
+        - periods: optional list of 8-day period start dates to keep (default all files)
+        - data_dir: folder with the AVW files downloaded from the NASA Ocean Colour Browser
+    """
 
-    python_dir = 'data/'
     # get paths of the nc files in "AVW data" folder
-    paths = [python_dir+"AVW data/PACE_OCI.20240719_20240726.L3m.8D.AVW.V2_0.NRT.x_avw.nc", 
-             python_dir+"AVW data/PACE_OCI.20240727_20240803.L3m.8D.AVW.V2_0.NRT.x_avw.nc"]
+    paths = sorted(glob.glob(os.path.join(data_dir, '*.L3m.8D.AVW.*.nc')))
+    if periods is not None:
+        periods = np.array(periods, dtype='datetime64[D]')
     
     # open an empty list to save each dataset 
     ds_grid = []
 
     # for loop
     for i in range(len(paths)):
+        # skip the other periods by file name, without opening them
+        start = _FileStart(paths[i])
+        if periods is not None and start is not None and start not in periods:
+            continue
+
         #open dataset
-        #print(paths[i])
         dataset = xr.open_dataset(paths[i])
 
-        # pull out the start date of 8-days average, convert it into datetime format
-        d = datetime.fromisoformat(dataset.attrs['time_coverage_start'][:-1]).astimezone(timezone.utc)
-        # (1) add date as new varible, 
-        # (2) set date as part of coordinates, 
-        # (3) save it into the dataset, 
-        # (4) add the modified dataset into the list 
-        ds_grid.append(dataset.assign(date = d).set_coords('date'))
+        # pull out the start date of 8-days average (UTC), convert it into datetime64 format
+        d = np.datetime64(dataset.attrs['time_coverage_start'][:-1], 'ns')
+        if periods is not None and d.astype('datetime64[D]') not in periods:
+            dataset.close()
+            continue
+
+        # (1) add date as new dimension,
+        # (2) add the modified dataset into the list
+        ds_grid.append(dataset.expand_dims(date=[d]))
 
-    # create a nested dataset (3D)
-    ds_all = xr.combine_nested(ds_grid, concat_dim ="date") # set date as the identifing index
+    if len(ds_grid) == 0:
+        raise ValueError('No AVW files in ' + data_dir +
+                         ('' if periods is None else ' for the periods ' + ', '.join(str(p) for p in periods)))
+
+    # create a nested dataset (3D), concatenated once
+    ds_all = xr.concat(ds_grid, dim='date') # set date as the identifing index
 
     # return the nested dataset
     return ds_all
-
@@ -0,0 +1,184 @@
+import os
+import shutil
+import numpy as np
+import xarray as xr
+from datetime import datetime
+from datetime import date, timedelta
+from getSST8day import SST8day
+from get_L3_8Day import get_L3_8Day
+from regridder import Regridder
+from phyto_size_turner import psc_fractions
+from instrument import Instrument, Stage
+
+PSC_VARIABLES = ('fmicro', 'fnano', 'fpico', 'chlor_a')
+
+
+class _NetCDFWriter:
+
+    # NetCDF4 file written one tile at a time (zlib compressed, chunked like the tiles)
+    def __init__(self, path, times, lat, lon, tile_rows, complevel):
+        import netCDF4
+        self.path = path
+        self.tmp = path + '.tmp'
+        self.nc = netCDF4.Dataset(self.tmp, 'w')
+        self.nc.createDimension('time', len(times))
+        self.nc.createDimension('lat', lat.shape[0])
+        self.nc.createDimension('lon', lon.shape[0])
+
+        t = self.nc.createVariable('time', 'f8', ('time',))
+        t.units = 'days since 1970-01-01'
+        t[:] = (times - np.datetime64('1970-01-01', 'ns'))/np.timedelta64(1, 'D')
+        for name, values in (('lat', lat), ('lon', lon)):
+            self.nc.createVariable(name, 'f4', (name,))[:] = values
+
+        chunks = (1, min(tile_rows, lat.shape[0]), lon.shape[0])
+        for name in PSC_VARIABLES:
+            self.nc.createVariable(name, 'f4', ('time', 'lat', 'lon'), zlib=True, complevel=complevel,
+                                   chunksizes=chunks, fill_value=np.float32(np.nan))
+        self.nc.fractions_reference = 'Turner et al. (2021), https://doi.org/10.1016/j.rse.2021.112729'
+
+    def write(self, ti, rows, tile):
+        for name in PSC_VARIABLES:
+            self.nc[name][ti, rows, :] = tile[name]
+
+    def close(self, complete=True):
+        self.nc.close()
+        if complete:
+            os.replace(self.tmp, self.path)
+        else:
+            os.remove(self.tmp)
+
+
+class _ZarrWriter:
+
+    # Zarr store: the (lazy) layout is written first, then each tile into its region. The store
+    # is written next to path and only moved there when complete
+    def __init__(self, path, times, lat, lon, tile_rows, complevel):
+        import dask.array as da
+        self.path = path
+        self.tmp = path.rstrip('/') + '.tmp'
+        chunks = (1, min(tile_rows, lat.shape[0]), lon.shape[0])
+        shape = (len(times), lat.shape[0], lon.shape[0])
+        template = xr.Dataset({name: (('time', 'lat', 'lon'), da.full(shape, np.nan, dtype=np.float32, chunks=chunks))
+                               for name in PSC_VARIABLES},
+                              coords={'time': times, 'lat': lat, 'lon': lon})
+        template.to_zarr(self.tmp, mode='w', compute=False)
+
+    def write(self, ti, rows, tile):
+        region = xr.Dataset({name: (('time', 'lat', 'lon'), tile[name][None]) for name in PSC_VARIABLES})
+        region.to_zarr(self.tmp, region={'time': slice(ti, ti+1), 'lat': rows, 'lon': slice(None)})
+
+    def close(self, complete=True):
+        if complete:
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.replace(self.tmp, self.path)
+        else:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+@Instrument
+def run_psc(start_date,end_date=date.today()-timedelta(days=8),latmin=20,latmax=50,lonmin=-80,lonmax=-45,
+            output=None,tile_rows=256,version='v1.0',cache_dir=None,complevel=4):
+    """
+    PURPOSE: To get the CHL and SST data and run the PHYTO_SIZE_TURNER model to calculate phytoplankton size classes using the Northeast U.S. regionally tuned phytoplankton size class algorithm based on Turner et al. (2021).
+
+    REQUIRED INPUTS:
+      START_DATE.... The start date for getting the file
+
+    OPTIONAL INPUTS
+      END_DATE...... The end date for getting the files
+      LATMIN......... Minimum latitude of the boundingn box
+      LATMAX......... Maximum latidue of the boundingn box
+      LONMIN......... Minimum longitude of the boundingn box
+      LONMAX......... Maximum longitude of the boundingn box
+      OUTPUT......... Output file: .nc for a compressed NetCDF4 file, .zarr for a Zarr store (needs zarr and dask).
+                      Default is no file, the output is returned in memory
+      TILE_ROWS...... Number of latitude rows processed (and written) at a time
+      VERSION........ Version of the SST look up table
+      CACHE_DIR...... Local cache directory for the CHL granules (see get_L3_8Day)
+      COMPLEVEL...... zlib compression level of the NetCDF output
+
+    KEYWORDS:
+      None
+
+    OUTPUTS
+      Phytoplankton size class (micro,nano, and picoplankton fractions and input chlorophyll data (time, lat, lon).
+      With OUTPUT the dataset is opened lazily from the file.
+
+    EXAMPLES:
+      psize = run_psc('2024-07-19','2024-08-03',output='data/psize_output.nc')
+
+    NOTES:
+      To calculate phytoplankton size class chlorophyll contribution, multiply total chlorophyll with each size class fraction.
+      The CHL composites are read one tile of TILE_ROWS rows at a time, the SST of the same 8-day period is
+      regridded to the tile with a nearest neighbour mapping that is computed once, and the size classes of
+      the tile are written straight to the output, so memory does not grow with the region or the number of periods.
+
+    COPYRIGHT:
+        Copyright (C) 2024, Department of Commerce, National Oceanic and Atmospheric Administration, National Marine Fisheries Service,
+        Northeast Fisheries Science Center, Narragansett Laboratory.
+        This software may be used, copied, or redistributed as long as it is not sold and this copyright notice is reproduced on each copy made.
+This routine is provided AS IS without any express or implied warranties whatsoever.
+
+    AUTHOR:
+      This program was written on August 08, 2024 by Kimberly J. W. Hyde, Northeast Fisheries Science Center | NOAA Fisheries | U.S. Department of Commerce, 28 Tarzwell Dr, Narragansett, RI 02882
+
+    MODIFICATION HISTORY:
+        Aug 08, 2024 - KJWH: Initial code written
+    """
+    start_date = str(start_date)[:10]
+    end_date = str(end_date)[:10]
+
+    # ===> Get the chlorophyll composites (lazy dask arrays, read one tile at a time below)
+    chl = get_L3_8Day('CHL',datetime.strptime(start_date,'%Y-%m-%d'),datetime.strptime(end_date,'%Y-%m-%d'),
+                      lonE=lonmax,lonW=lonmin,latN=latmax,latS=latmin,cache_dir=cache_dir,chunks={})
+    chlarr = chl['chlor_a'].sortby('date')
+    times = chlarr.date.values
+    lat = chlarr.lat.values
+    lon = chlarr.lon.values
+
+    # ===> Get the 8-day SST and the mapping from the SST grid to the chlorophyll grid
+    sst = SST8day(start_date,end_date,latmin=latmin,latmax=latmax,lonmin=lonmin,lonmax=lonmax,periods=times).sortby('time')
+    regrid = Regridder((sst.longitude.values, sst.latitude.values), (lon, lat), method='nearest')
+    sst_index = regrid.index.reshape(lat.shape[0], lon.shape[0])
+    sst_periods = sst.reindex(time=times, method='nearest', tolerance=np.timedelta64(4, 'D'))
+
+    # ===> Output store
+    if output is None:
+        shape = (len(times), lat.shape[0], lon.shape[0])
+        psize = {name: np.empty(shape, dtype=np.float32) for name in PSC_VARIABLES}
+        writer = None
+    elif output.endswith('.zarr'):
+        writer = _ZarrWriter(output, times, lat, lon, tile_rows, complevel)
+    else:
+        writer = _NetCDFWriter(output, times, lat, lon, tile_rows, complevel)
+
+    # ===> Run the phytoplankton size class model tile by tile
+    complete = False
+    try:
+        with Stage('psc_tiles', n_periods=len(times), tile_rows=tile_rows):
+            for ti in range(len(times)):
+                sst_flat = np.asarray(sst_periods.isel(time=ti).values, dtype=np.float32).ravel()
+                for r0 in range(0, lat.shape[0], tile_rows):
+                    rows = slice(r0, min(r0 + tile_rows, lat.shape[0]))
+                    chl_tile = np.asarray(chlarr.isel(date=ti, lat=rows).values, dtype=np.float32)
+                    tile = psc_fractions(chl_tile, sst_flat[sst_index[rows]], version=version)
+                    tile['chlor_a'] = chl_tile
+
+                    if writer is None:
+                        for name in PSC_VARIABLES:
+                            psize[name][ti, rows, :] = tile[name]
+                    else:
+                        writer.write(ti, rows, tile)
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close(complete)
+
+    if output is None:
+        return xr.Dataset({name: (('time', 'lat', 'lon'), psize[name]) for name in PSC_VARIABLES},
+                          coords={'time': times, 'lat': lat, 'lon': lon})
+    if output.endswith('.zarr'):
+        return xr.open_zarr(output)
+    return xr.open_dataset(output)
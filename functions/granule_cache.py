@@ -0,0 +1,221 @@
+# Local disk cache for earthaccess granules and for the ROI subsets cut from them
+# Granules are kept by granule ID and checksum with a size limit (least recently
+# used files are removed first), ROI subsets are saved as compressed NetCDF
+#
+# The caches of one process share a lock, so the get_L3_8Day threads can use the same
+# cache directory: a granule is downloaded once, and granules being read are not evicted.
+# netCDF-C is not thread safe, so local NetCDF files are opened and read under NETCDF_LOCK
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+import xarray as xr
+
+from earthdata import Earthaccess
+
+_LOCK = threading.Lock()
+NETCDF_LOCK = threading.Lock()
+_DOWNLOAD_LOCKS = {}
+_IN_USE = Counter()
+
+
+def SubsetROI(dataset, lonE, lonW, latN, latS):
+
+    """
+        Lazily subset a lat/lon gridded dataset to a bounding box with index slices,
+        so only the ROI is read from disk when the data are loaded
+    """
+    lon = dataset.lon.values
+    lat = dataset.lat.values
+    lon_inds = np.where((lon>=lonW) & (lon<=lonE))[0]
+    lat_inds = np.where((lat>=latS) & (lat<=latN))[0]
+
+    lon_slice = slice(lon_inds[0], lon_inds[-1]+1) if lon_inds.shape[0] > 0 else slice(0, 0)
+    lat_slice = slice(lat_inds[0], lat_inds[-1]+1) if lat_inds.shape[0] > 0 else slice(0, 0)
+    return dataset.isel(lon=lon_slice, lat=lat_slice)
+
+
+def GranuleID(granule):
+
+    """
+        Granule UR and checksum (None if the CMR record has none) of an earthaccess result
+    """
+    umm = granule['umm']
+    checksum = None
+    for info in umm.get('DataGranule', {}).get('ArchiveAndDistributionInformation', []):
+        if 'Checksum' in info:
+            checksum = (info['Checksum'].get('Algorithm', 'MD5'), info['Checksum']['Value'])
+            break
+    return umm['GranuleUR'], checksum
+
+
+def _FileChecksum(fname, algorithm):
+
+    h = hashlib.new(algorithm.replace('-', '').lower())
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class GranuleCache:
+
+    """
+        Granules and ROI subsets cached on local disk
+
+        INPUTS
+        - cache_dir: cache directory
+        - max_bytes: size limit of the cached granules (ROI subsets are small and not counted)
+        - search_max_age: hours a saved earthaccess search stays valid (0 = always search)
+    """
+
+    def __init__(self, cache_dir='data/cache/granules', max_bytes=20e9, search_max_age=24):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.search_max_age = search_max_age
+        for sub in ('files', 'subsets', 'searches'):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+
+    def search(self, **query):
+
+        """
+            earthaccess.search_data, reusing the results of the same search for search_max_age hours
+        """
+        key = hashlib.sha1(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()
+        fname = os.path.join(self.cache_dir, 'searches', key + '.json')
+
+        if os.path.exists(fname) and time.time() - os.path.getmtime(fname) < self.search_max_age*3600:
+            from earthaccess.results import DataGranule
+            with open(fname) as f:
+                return [DataGranule(g, cloud_hosted=True) for g in json.load(f)]
+
+        results = Earthaccess().search_data(**query)
+        with open(fname, 'w') as f:
+            json.dump([dict(g) for g in results], f)
+        return results
+
+    def granule(self, granule):
+
+        """
+            Local path of a granule, downloaded (and checksum verified) if it is not cached.
+            Use the using() context to keep it from being evicted while it is read
+        """
+        folder, fname = self._Acquire(granule)
+        self._Release(folder)
+        return fname
+
+    @contextmanager
+    def using(self, granule):
+
+        """
+            Local path of a granule (see granule) that is not evicted until the block ends
+
+            EXAMPLE
+                with cache.using(granule) as fname, xr.open_dataset(fname) as dataset:
+                    roi = SubsetROI(dataset, lonE, lonW, latN, latS).load()
+        """
+        folder, fname = self._Acquire(granule)
+        try:
+            yield fname
+        finally:
+            self._Release(folder)
+
+    def _Acquire(self, granule):
+
+        # Find or download the granule and mark it in use (one download per granule at a time)
+        granule_id, checksum = GranuleID(granule)
+        key = checksum[1] if checksum is not None else hashlib.sha1(granule_id.encode()).hexdigest()
+        folder = os.path.join(self.cache_dir, 'files', key)
+        with _LOCK:
+            download_lock = _DOWNLOAD_LOCKS.setdefault(folder, threading.Lock())
+
+        with download_lock:
+            with _LOCK:
+                if os.path.isdir(folder) and os.listdir(folder):
+                    fname = os.path.join(folder, os.listdir(folder)[0])
+                    os.utime(fname)
+                    _IN_USE[folder] += 1
+                    return folder, fname
+
+            tmp = tempfile.mkdtemp(dir=self.cache_dir)
+            try:
+                fname = Earthaccess().download([granule], local_path=tmp)[0]
+                if checksum is not None and _FileChecksum(fname, checksum[0]) != checksum[1].lower():
+                    raise IOError('Checksum mismatch for ' + granule_id)
+                with _LOCK:
+                    os.makedirs(folder, exist_ok=True)
+                    final = os.path.join(folder, os.path.basename(fname))
+                    os.replace(fname, final)
+                    _IN_USE[folder] += 1
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+        return folder, final
+
+    def _Release(self, folder):
+
+        with _LOCK:
+            _IN_USE[folder] -= 1
+            if _IN_USE[folder] <= 0:
+                del _IN_USE[folder]
+
+    def evict(self):
+
+        """
+            Remove the least recently used granules until the cache is under max_bytes
+            (granules in use are kept)
+        """
+        with _LOCK:
+            files = []
+            for root, dirs, names in os.walk(os.path.join(self.cache_dir, 'files')):
+                for name in names:
+                    fname = os.path.join(root, name)
+                    stat = os.stat(fname)
+                    files.append((stat.st_mtime, stat.st_size, fname))
+
+            total = sum(f[1] for f in files)
+            for mtime, size, fname in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if os.path.dirname(fname) in _IN_USE:
+                    continue
+                shutil.rmtree(os.path.dirname(fname), ignore_errors=True)
+                total -= size
+
+    def subset(self, granule, product, lonE, lonW, latN, latS, chunks=None):
+
+        """
+            ROI subset of a granule, cut once and then served from a compressed NetCDF file
+            (loaded, or lazy dask arrays when chunks is given)
+        """
+        granule_id, checksum = GranuleID(granule)
+        key = hashlib.sha1(json.dumps([product, granule_id, checksum, lonE, lonW, latN, latS], default=str).encode()).hexdigest()
+        fname = os.path.join(self.cache_dir, 'subsets', key + '.nc')
+
+        if not os.path.exists(fname):
+            with self.using(granule) as granule_file, NETCDF_LOCK:
+                with xr.open_dataset(granule_file) as dataset:
+                    roi = SubsetROI(dataset, lonE, lonW, latN, latS).load()
+                encoding = {}
+                for name in roi.data_vars:
+                    for setting in ('chunksizes', 'contiguous', 'original_shape'):
+                        roi[name].encoding.pop(setting, None)
+                    if roi[name].ndim > 0:
+                        encoding[name] = {'zlib': True, 'complevel': 4,
+                                          'chunksizes': tuple(max(1, min(s, 256)) for s in roi[name].shape)}
+                tmp = '{}.{}-{}.tmp'.format(fname, os.getpid(), threading.get_ident())
+                roi.to_netcdf(tmp, encoding=encoding)
+                os.replace(tmp, fname)
+
+        with NETCDF_LOCK:
+            dataset = xr.open_dataset(fname, chunks=chunks)
+            return dataset.load() if chunks is None else dataset
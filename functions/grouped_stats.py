@@ -0,0 +1,114 @@
+# Grouped (per cluster) statistics computed in a single pass
+# Partial results are kept as (count, mean, M2) so they can be merged between
+# files, chunks or workers without losing precision
+
+import numpy as np
+
+
+def GroupedMoments(labels, values, n_groups):
+
+    """
+        Count, mean and sum of squared deviations (M2) of every column of values
+        for every group, from sums over the samples sorted by group (the group means
+        first, then the squared deviations from them)
+
+        INPUTS
+        - labels: group label of each sample (N,), NaN or negative for no group
+        - values: data (N,) or (N, P); NaNs are ignored per column
+        - n_groups: number of groups (labels 0...n_groups-1)
+
+        OUTPUTS
+        - moments: (count, mean, M2), each (n_groups, P)
+    """
+    labels = np.asarray(labels).ravel()
+    values = np.asarray(values)
+    values = values.reshape(labels.shape[0], -1)
+    n_cols = values.shape[1]
+
+    count = np.zeros((n_groups, n_cols))
+    mean = np.zeros((n_groups, n_cols))
+    M2 = np.zeros((n_groups, n_cols))
+
+    # Samples sorted by group, so every group is one run of rows
+    keep = np.flatnonzero(np.isfinite(labels) & (labels >= 0) & (labels < n_groups))
+    if keep.size == 0:
+        return count, mean, M2
+    groups = labels[keep].astype(np.intp)
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    values = values[keep[order]]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    lengths = np.diff(np.r_[starts, groups.size])
+    present = groups[starts]
+
+    # Two passes: the group means, then the squared deviations from them (in float64), so M2
+    # does not lose precision when the spread is small compared to the mean
+    if lengths.mean() >= 64:
+        # Few large groups (e.g. clusters): one float64 copy of each group's rows
+        for gi, s, n_rows in zip(present, starts, lengths):
+            x = values[s:s+n_rows].astype(float)
+            bad = np.isnan(x)
+            if bad.any():
+                x[bad] = 0
+                n = n_rows - bad.sum(axis=0)
+            else:
+                n = np.full(n_cols, float(n_rows))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                m = np.where(n > 0, x.sum(axis=0)/n, 0)
+            x -= m
+            x[bad] = 0
+            count[gi], mean[gi], M2[gi] = n, m, np.einsum('ij,ij->j', x, x)
+        return count, mean, M2
+
+    # Many small groups (e.g. profile layers): all groups at once
+    good = ~np.isnan(values)
+    values = np.where(good, values, 0)
+    n = np.add.reduceat(good, starts, axis=0, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m = np.where(n > 0, np.add.reduceat(values, starts, axis=0, dtype=float)/n, 0)
+    deviation = np.where(good, values - np.repeat(m, lengths, axis=0), 0)
+
+    count[present] = n
+    mean[present] = m
+    M2[present] = np.add.reduceat(deviation*deviation, starts, axis=0)
+
+    return count, mean, M2
+
+
+def EmptyMoments(n_groups, n_cols):
+
+    """
+        Moments with no data, to start a running combine
+    """
+    return np.zeros((n_groups, n_cols)), np.zeros((n_groups, n_cols)), np.zeros((n_groups, n_cols))
+
+
+def CombineMoments(a, b):
+
+    """
+        Merge two sets of (count, mean, M2) with the Chan et al. parallel algorithm
+    """
+    na, ma, M2a = a
+    nb, mb, M2b = b
+
+    n = na + nb
+    delta = mb - ma
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(n > 0, nb/n, 0)
+    mean = ma + delta*frac
+    M2 = M2a + M2b + delta**2*na*frac
+
+    return n, mean, M2
+
+
+def FinalizeMoments(moments, ddof=1):
+
+    """
+        OUTPUTS
+        - count, mean, variance (NaN where there are not enough samples)
+    """
+    count, mean, M2 = moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, mean, np.nan)
+        variance = np.where(count > ddof, M2/(count - ddof), np.nan)
+    return count, mean, variance
@@ -0,0 +1,280 @@
+# Stage-level timing and memory instrumentation of the workflow
+# Off by default: the decorated functions then only check one module flag before calling
+# through. When enabled (Enable(), or the KAEMEANS_INSTRUMENT environment variable set to the
+# report file) every stage records its wall time, the bytes read by the process
+# (/proc/self/io), the size of its array inputs and outputs and the peak RSS while it ran.
+#
+# Reads and peak RSS are process wide: stages running at the same time in threads (e.g. the
+# product downloads of GetData) see each other's reads, and work done in worker processes
+# (GetMOANAMeans, GapStatistic pools) is not included.
+
+import atexit
+import csv
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+_enabled = False
+_records = []
+_local = threading.local()
+_origin = [time.perf_counter()]
+_report = [None]
+
+REPORT_FIELDS = ['stage', 'path', 'thread', 'start_s', 'wall_s', 'read_bytes', 'rchar_bytes',
+                 'input_bytes', 'output_bytes', 'rss_start_mb', 'peak_rss_mb', 'error', 'info']
+
+
+def _ProcIO():
+
+    # (storage bytes read, all bytes read incl. network and page cache) of this process
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f.read().splitlines() if ':' in line)
+        return int(fields['read_bytes']), int(fields['rchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _RSS():
+
+    # (current, peak) resident size in bytes. The peak is VmHWM, which _ResetPeak can lower
+    # to the current size; ru_maxrss (peak of the whole run) where /proc is not available
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+        return int(fields['VmRSS'].split()[0])*1024, int(fields['VmHWM'].split()[0])*1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+        return peak, peak
+
+
+def _ResetPeak():
+
+    # Start a new peak RSS measurement (Linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def ArrayBytes(obj):
+
+    """
+        Size in bytes of the arrays in obj: numpy arrays, xarray DataArrays / Datasets (without
+        loading lazy data), pandas objects, and tuples, lists or dicts of them
+    """
+    if obj is None or isinstance(obj, (str, bytes, int, float, bool)):
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (tuple, list)):
+        return sum(ArrayBytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(ArrayBytes(o) for o in obj.values())
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    nbytes = getattr(obj, 'nbytes', None)
+    return int(nbytes) if isinstance(nbytes, (int, np.integer)) else 0
+
+
+def Enable(report=None):
+
+    """
+        Start recording stages. With report (a .json or .csv file), the run report is
+        written there when the session ends (see WriteReport)
+    """
+    global _enabled
+    if not _enabled:
+        _origin[0] = time.perf_counter()
+    _enabled = True
+    if report is not None:
+        if _report[0] is None:
+            atexit.register(lambda: _report[0] is not None and WriteReport(_report[0]))
+        _report[0] = report
+
+
+def Disable():
+
+    """
+        Stop recording (the records are kept until Reset)
+    """
+    global _enabled
+    _enabled = False
+
+
+def Enabled():
+    return _enabled
+
+
+def Reset():
+
+    """
+        Remove all records
+    """
+    del _records[:]
+    _origin[0] = time.perf_counter()
+
+
+def Records():
+
+    """
+        List of the stage records (dicts with REPORT_FIELDS), in the order the stages finished
+    """
+    return list(_records)
+
+
+class _Stage:
+
+    # One running stage: the measurements taken when it starts and the peak of its children
+    def __init__(self, name, info):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.stack = stack
+        self.name = name
+        self.info = info
+        self.path = '/'.join([s.name for s in stack] + [name])
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.child_peak = 0
+
+    def start(self):
+        rss, peak = _RSS()
+        if self.stack:
+            parent = self.stack[-1]
+            parent.child_peak = max(parent.child_peak, peak)
+        _ResetPeak()
+        self.rss_start = rss
+        self.io_start = _ProcIO()
+        self.t0 = time.perf_counter()
+        self.stack.append(self)
+
+    def stop(self, error=None):
+        wall = time.perf_counter() - self.t0
+        io = _ProcIO()
+        peak = max(_RSS()[1], self.child_peak)
+        self.stack.pop()
+        if self.stack:
+            parent = self.stack[-1]
+            parent.child_peak = max(parent.child_peak, peak)
+
+        _records.append({'stage': self.name, 'path': self.path, 'thread': threading.current_thread().name,
+                         'start_s': self.t0 - _origin[0], 'wall_s': wall,
+                         'read_bytes': io[0] - self.io_start[0], 'rchar_bytes': io[1] - self.io_start[1],
+                         'input_bytes': self.input_bytes, 'output_bytes': self.output_bytes,
+                         'rss_start_mb': self.rss_start/2**20, 'peak_rss_mb': peak/2**20,
+                         'error': error, 'info': self.info})
+
+
+@contextmanager
+def Stage(name, **info):
+
+    """
+        Record a block of code as a stage (nothing is done when instrumentation is off)
+
+        INPUTS
+        - name: stage name
+        - info: extra values saved with the record (e.g. product='CHL')
+
+        OUTPUTS
+        - the stage, or None when off. stage.output_bytes can be set to the size of the result
+
+        EXAMPLE
+            with Stage('KMeans', n_clusters=6) as stage:
+                kmeans_fit = KMeans(n_clusters=6).fit(X_scaled)
+    """
+    if not _enabled:
+        yield None
+        return
+    stage = _Stage(name, info)
+    stage.start()
+    try:
+        yield stage
+    except BaseException as err:
+        stage.stop(error=type(err).__name__)
+        raise
+    stage.stop()
+
+
+def Instrument(func=None, name=None):
+
+    """
+        Decorator recording every call of func as a stage, with the size of the array
+        arguments and of the result. When instrumentation is off, the call goes straight
+        through to func
+
+        EXAMPLE
+            @Instrument
+            def Regrid(high_res_data, high_res_grid, target_grid, method='nearest', cache_dir=None):
+    """
+    if func is None:
+        return lambda f: Instrument(f, name=name)
+    stage_name = func.__name__ if name is None else name
+
+    @functools.wraps(func)
+    def Wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        stage = _Stage(stage_name, {})
+        stage.input_bytes = ArrayBytes(args) + ArrayBytes(kwargs)
+        stage.start()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as err:
+            stage.stop(error=type(err).__name__)
+            raise
+        stage.output_bytes = ArrayBytes(result)
+        stage.stop()
+        return result
+
+    return Wrapper
+
+
+def Summary(records=None):
+
+    """
+        Totals per stage: number of calls, wall time, bytes read and largest peak RSS
+
+        OUTPUTS
+        - list of dicts sorted by total wall time (longest first)
+    """
+    totals = {}
+    for r in (_records if records is None else records):
+        t = totals.setdefault(r['stage'], {'stage': r['stage'], 'calls': 0, 'wall_s': 0., 'read_bytes': 0,
+                                           'rchar_bytes': 0, 'peak_rss_mb': 0.})
+        t['calls'] += 1
+        t['wall_s'] += r['wall_s']
+        t['read_bytes'] += r['read_bytes']
+        t['rchar_bytes'] += r['rchar_bytes']
+        t['peak_rss_mb'] = max(t['peak_rss_mb'], r['peak_rss_mb'])
+    return sorted(totals.values(), key=lambda t: -t['wall_s'])
+
+
+def WriteReport(path, records=None):
+
+    """
+        Write the run report: JSON with the records and the per-stage summary, or one CSV
+        row per record when path ends with .csv
+    """
+    records = _records if records is None else records
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for r in records:
+                writer.writerow(dict(r, info=json.dumps(r['info'], default=str)))
+    else:
+        with open(path, 'w') as f:
+            json.dump({'records': records, 'summary': Summary(records)}, f, indent=1, default=str)
+
+
+# Instrumentation can be switched on without code changes: KAEMEANS_INSTRUMENT=run_report.json
+if os.environ.get('KAEMEANS_INSTRUMENT'):
+    Enable(report=os.environ['KAEMEANS_INSTRUMENT'])
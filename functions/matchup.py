@@ -0,0 +1,180 @@
+# Vectorized matchups between point observations (lon, lat, time) and gridded products
+# Used to assign cluster labels to MOANA swath pixels and BGC-Argo profiles
+
+import hashlib
+import numpy as np
+
+# KDTrees for irregular grids, keyed by a hash of the grid coordinates
+_TREE_CACHE = {}
+
+
+def GridHash(*arrays):
+
+    """
+        Hash coordinate arrays so grids can be recognised between calls
+    """
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str(arr.shape).encode())
+        h.update(str(arr.dtype).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def AxisIndex(axis, values):
+
+    """
+        Nearest index along a 1D coordinate axis for every value
+
+        Uniformly spaced axes use index arithmetic, otherwise searchsorted.
+        Values outside of the axis are clipped to the edge cells.
+    """
+    n = axis.shape[0]
+    if n == 1:
+        return np.zeros(values.shape, dtype=np.intp)
+
+    # Uniform axis (allowing for float32 rounding of the coordinates)
+    step = (axis[-1] - axis[0]) / (n - 1)
+    if np.max(np.abs(axis - (axis[0] + step*np.arange(n)))) < 1e-3*abs(step):
+        ind = np.rint((values - axis[0]) / step)
+        return np.clip(np.nan_to_num(ind), 0, n-1).astype(np.intp)
+
+    # Non-uniform axis: searchsorted on an ascending copy
+    descending = axis[0] > axis[-1]
+    ax = axis[::-1] if descending else axis
+    right = np.clip(np.searchsorted(ax, values), 1, n-1)
+    left = right - 1
+    ind = np.where(np.abs(values - ax[left]) <= np.abs(ax[right] - values), left, right)
+    return (n - 1 - ind) if descending else ind
+
+
+def _RectilinearAxes(LO, LA):
+
+    """
+        Return the 1D (lon, lat) axes if the 2D mesh is rectilinear, else None
+    """
+    if LO.ndim == 1 and LA.ndim == 1:
+        return LO, LA
+    if np.array_equal(LO, np.broadcast_to(LO[0, :], LO.shape)) and \
+       np.array_equal(LA, np.broadcast_to(LA[:, [0]], LA.shape)):
+        return LO[0, :], LA[:, 0]
+    return None
+
+
+class GridMatcher:
+
+    """
+        Map arrays of lon/lat to the (row, col) of the nearest grid cell
+
+        Regular (rectilinear) grids, like the PACE L3m and ACSPO grids, are
+        matched with O(1) index arithmetic per point. Irregular grids fall back
+        to a KDTree that is built once per grid, cached, and queried in batches
+        with multiple workers.
+
+        INPUTS
+        - lon, lat: grid coordinates, either 1D axes or 2D meshes (e.g. LO, LA)
+        - workers: number of workers for KDTree queries (-1 = all cores)
+        - batch_size: number of points per KDTree query
+    """
+
+    def __init__(self, lon, lat, workers=-1, batch_size=1_000_000):
+
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+
+        self.workers = workers
+        self.batch_size = batch_size
+        self.axes = _RectilinearAxes(lon, lat)
+
+        if self.axes is not None:
+            self.shape = (self.axes[1].shape[0], self.axes[0].shape[0])
+            self.tree = None
+        else:
+            self.shape = lon.shape
+            key = GridHash(lon, lat)
+            if key not in _TREE_CACHE:
+                from scipy.spatial import KDTree
+                _TREE_CACHE[key] = KDTree(np.c_[lon.ravel(), lat.ravel()])
+            self.tree = _TREE_CACHE[key]
+
+    def query(self, lon, lat):
+
+        """
+            INPUTS
+            - lon, lat: arrays of target longitudes and latitudes (any shape)
+
+            OUTPUTS
+            - rows, cols: index arrays into the grid with the shape of lon
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+
+        if self.axes is not None:
+            cols = AxisIndex(self.axes[0], lon)
+            rows = AxisIndex(self.axes[1], lat)
+            return rows, cols
+
+        points = np.c_[lon.ravel(), lat.ravel()]
+        flat = np.empty(points.shape[0], dtype=np.intp)
+        for i0 in range(0, points.shape[0], self.batch_size):
+            _, flat[i0:i0+self.batch_size] = self.tree.query(points[i0:i0+self.batch_size],
+                                                             workers=self.workers)
+        rows, cols = np.unravel_index(flat, self.shape)
+        return rows.reshape(lon.shape), cols.reshape(lon.shape)
+
+
+def GetPeriodIndex(dates, periods):
+
+    """
+        Find the composite period that each date falls in
+
+        INPUTS
+        - dates: array of dates (anything np.datetime64 understands)
+        - periods: list of period start dates, or [start, end] pairs, in time order.
+                   With start dates only, each period lasts until the next one starts
+                   and the last period is open ended.
+
+        OUTPUTS
+        - period index for every date, -1 where the date is outside all periods
+    """
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+
+    periods = list(periods)
+    if np.ndim(periods[0]) == 0:
+        starts = np.array(periods, dtype='datetime64[ns]')
+        ends = np.append(starts[1:], np.datetime64('NaT', 'ns'))
+    else:
+        starts = np.array([p[0] for p in periods], dtype='datetime64[ns]')
+        # End dates are inclusive (e.g. '2024-07-26' covers that whole day)
+        ends = np.array([p[1] for p in periods], dtype='datetime64[D]').astype('datetime64[ns]') \
+            + np.timedelta64(1, 'D')
+
+    si = np.searchsorted(starts, dates, side='right') - 1
+    valid = (si >= 0) & ~np.isnat(dates)
+    si_safe = np.clip(si, 0, None)
+    end = ends[si_safe]
+    valid &= np.isnat(end) | (dates < end)
+    return np.where(valid, si, -1)
+
+
+def MatchLabels(matcher, total_labels, target_lon, target_lat, period_index):
+
+    """
+        Gather gridded labels (time, lat, lon) at the matched grid cells
+
+        INPUTS
+        - matcher: GridMatcher for the label grid
+        - total_labels: labels array (time, lat, lon)
+        - target_lon, target_lat: target coordinates
+        - period_index: period of each target, -1 for no period
+
+        OUTPUTS
+        - labels at each target point (NaN where there is no period)
+    """
+    rows, cols = matcher.query(target_lon, target_lat)
+    period_index = np.asarray(period_index)
+    labels = np.full(rows.shape, np.nan)
+    ok = period_index >= 0
+    labels[ok] = total_labels[period_index[ok], rows[ok], cols[ok]]
+    return labels
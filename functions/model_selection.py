@@ -0,0 +1,255 @@
+# Choosing the number of K-means clusters (elbow, Calinski-Harabasz, silhouette)
+# Each K is fitted once (warm started from the K-1 centroids) and every metric is computed
+# from that fit with chunked distance kernels, so no (n_samples, K) or (n, n) distance
+# matrix is ever built. Fits are cached so the sweep can be re-plotted or extended
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from matchup import GridHash
+
+# Sweeps already computed in this session, keyed by data (name or hash) and settings
+_SWEEP_CACHE = {}
+
+
+def NearestCenters(X, centers, chunk_size=65536):
+
+    """
+        Nearest centroid of every row of X, computed in chunks
+
+        INPUTS
+        - X: array (n_samples, n_features)
+        - centers: array (n_clusters, n_features)
+        - chunk_size: number of rows per chunk
+
+        OUTPUTS
+        - labels: (n_samples,) index of the nearest centroid
+        - sq_dist: (n_samples,) squared euclidean distance to it
+    """
+    centers = np.asarray(centers, dtype=float)
+    c2 = (centers**2).sum(axis=1)
+    labels = np.empty(X.shape[0], dtype=np.intp)
+    sq_dist = np.empty(X.shape[0])
+
+    for i0 in range(0, X.shape[0], chunk_size):
+        x = np.asarray(X[i0:i0+chunk_size], dtype=float)
+        dist = c2 - 2*(x @ centers.T)
+        lab = dist.argmin(axis=1)
+        labels[i0:i0+chunk_size] = lab
+        sq_dist[i0:i0+chunk_size] = np.maximum(dist[np.arange(lab.shape[0]), lab] + (x**2).sum(axis=1), 0)
+
+    return labels, sq_dist
+
+
+def CalinskiHarabasz(X, labels, n_clusters, chunk_size=65536):
+
+    """
+        Calinski-Harabasz score (between / within cluster dispersion) from chunked sums
+    """
+    n = X.shape[0]
+    if n_clusters < 2 or n <= n_clusters:
+        return np.nan
+
+    count = np.bincount(labels, minlength=n_clusters).astype(float)
+    sums = np.zeros((n_clusters, X.shape[1]))
+    total = np.zeros(X.shape[1])
+    for i0 in range(0, n, chunk_size):
+        x = np.asarray(X[i0:i0+chunk_size], dtype=float)
+        lab = labels[i0:i0+chunk_size]
+        for fi in range(X.shape[1]):
+            sums[:, fi] += np.bincount(lab, weights=x[:, fi], minlength=n_clusters)
+        total += x.sum(axis=0)
+    mean = total/n
+
+    # Total dispersion about the mean, in a second pass for accuracy
+    dispersion = 0.
+    for i0 in range(0, n, chunk_size):
+        dispersion += ((np.asarray(X[i0:i0+chunk_size], dtype=float) - mean)**2).sum()
+
+    used = count > 0
+    between = (count[used][:, None]*(sums[used]/count[used][:, None] - mean)**2).sum()
+    within = dispersion - between
+    if within <= 0:
+        return np.nan
+    return (between/(n_clusters - 1))/(within/(n - n_clusters))
+
+
+def SampledSilhouette(X, labels, n_clusters, sample_size=10000, chunk_size=1024, random_state=None):
+
+    """
+        Mean silhouette coefficient of a random sample of rows (as sklearn silhouette_score
+        with sample_size), with the sample distance matrix computed one block of rows at a time
+    """
+    rng = np.random.default_rng(random_state)
+    n = X.shape[0]
+    idx = np.sort(rng.choice(n, min(sample_size, n), replace=False))
+    S = np.asarray(X[idx], dtype=float)
+    L = labels[idx]
+    m = S.shape[0]
+
+    count = np.bincount(L, minlength=n_clusters)
+    if (count > 0).sum() < 2:
+        return np.nan
+
+    onehot = np.zeros((m, n_clusters))
+    onehot[np.arange(m), L] = 1
+    s2 = (S**2).sum(axis=1)
+
+    silhouette = np.empty(m)
+    for i0 in range(0, m, chunk_size):
+        rows = np.arange(i0, min(i0 + chunk_size, m))
+        dist = np.sqrt(np.maximum(s2[rows][:, None] - 2*(S[rows] @ S.T) + s2[None, :], 0))
+        dist[np.arange(rows.shape[0]), rows] = 0
+        sums = dist @ onehot
+
+        own = L[rows]
+        n_own = count[own] - 1
+        a = sums[np.arange(rows.shape[0]), own]/np.maximum(n_own, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            other = np.where(count > 0, sums/count, np.inf)
+        other[np.arange(rows.shape[0]), own] = np.inf
+        b = other.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = (b - a)/np.maximum(a, b)
+        silhouette[rows] = np.where(n_own > 0, np.nan_to_num(s), 0)
+
+    return silhouette.mean()
+
+
+def _Metrics(X, k, centers, labels, sq_dist, silhouette_sample, seed):
+
+    return {'inertia': sq_dist.sum(),
+            'distortion': np.sqrt(sq_dist).mean(),
+            'calinski_harabasz': CalinskiHarabasz(X, labels, k),
+            'silhouette': SampledSilhouette(X, labels, k, silhouette_sample, random_state=seed)
+                          if k > 1 else np.nan}
+
+
+def _WarmInit(X, centers, sq_dist, rng, sample_size=100000):
+
+    # K-1 centroids plus one new centroid: greedy k-means++ step, the best of a few
+    # candidates drawn with probability ~ squared distance on a sample of rows
+    idx = rng.choice(X.shape[0], min(sample_size, X.shape[0]), replace=False)
+    sample = np.asarray(X[idx], dtype=float)
+    weights = sq_dist[idx]
+    if weights.sum() <= 0:
+        return np.vstack([centers, sample[0]])
+
+    n_trials = 2 + int(np.log(centers.shape[0] + 1))
+    candidates = sample[rng.choice(idx.shape[0], n_trials, p=weights/weights.sum())]
+    potential = [np.minimum(weights, ((sample - c)**2).sum(axis=1)).sum() for c in candidates]
+    return np.vstack([centers, candidates[np.argmin(potential)]])
+
+
+def _SweepKey(X, key, settings):
+
+    # The caller's name for the data and the settings, or a hash of X when there is no name
+    if key is None:
+        return 'sweep_' + GridHash(X, settings)
+    named = json.dumps([str(key), list(X.shape), settings.tolist()])
+    return 'sweep_' + hashlib.sha1(named.encode()).hexdigest()
+
+
+def SweepK(X, K=range(1, 10), warm_start=True, n_init=3, silhouette_sample=10000,
+           max_workers=None, cache_dir=None, key=None, random_state=0):
+
+    """
+        Fit K-means once per number of clusters and compute the model selection metrics
+
+        INPUTS
+        - X: array (n_samples, n_features) of scaled features (e.g. X_scaled, or cube.X scaled)
+        - K: numbers of clusters to evaluate
+        - warm_start: also start each K from the centroids of K-1 plus one k-means++ centroid,
+                      keeping whichever start converges to the lower inertia
+        - n_init: number of k-means++ initialisations per K (n_init - 1 when warm starting,
+                  which replaces one of them)
+        - silhouette_sample: number of rows used for the silhouette
+        - max_workers: threads used for the k-means++ fits of all K (only the warm starts
+                       are chained from K-1 to K) and the metrics
+        - cache_dir: if given, fits are also saved here and reloaded in later sessions.
+                     Calling again with more K values only fits the new ones
+        - key: name of the data, e.g. the FeatureCube path X was scaled from. The cache is
+               keyed on it, the shape of X and the settings, so X is not hashed on every call;
+               use a new key when the data change. Default: a hash of X
+        - random_state: seed
+
+        OUTPUTS
+        - dict of arrays over K: 'K', 'inertia' (sum of squared distances to the closest
+          centroid), 'distortion' (mean distance to the closest centroid), 'calinski_harabasz',
+          'silhouette', and 'centers' (list of centroid arrays)
+
+        EXAMPLE
+            sweep = SweepK(X_scaled, K=range(1, 10))
+            plt.plot(sweep['K'], sweep['inertia'])
+            sweep = SweepK(scaler.transform(cube.X), K=range(1, 10), key=cube.path + ':scaled')
+    """
+    K = [int(k) for k in K]
+    settings = np.array([warm_start, n_init, silhouette_sample, -1 if random_state is None else random_state])
+    key = _SweepKey(X, key, settings)
+    cache = _SWEEP_CACHE.setdefault(key, {})
+
+    folder = None if cache_dir is None else os.path.join(cache_dir, key)
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+        for fname in os.listdir(folder):
+            if fname.endswith('.npz') and '.tmp' not in fname and int(fname[1:-4]) not in cache:
+                with np.load(os.path.join(folder, fname)) as saved:
+                    cache[int(fname[1:-4])] = {name: saved[name] for name in saved.files}
+
+    def store(k, centers, metrics):
+        cache[k] = dict(metrics, centers=centers)
+        if folder is not None:
+            tmp = os.path.join(folder, 'k' + str(k) + '.tmp.npz')
+            np.savez(tmp, **cache[k])
+            os.replace(tmp, os.path.join(folder, 'k' + str(k) + '.npz'))
+
+    from sklearn.cluster import KMeans
+    todo = sorted(k for k in set(K) if k not in cache)
+    seed = lambda k: None if random_state is None else random_state + k
+
+    def metrics(k, centers):
+        labels, sq_dist = NearestCenters(X, centers)
+        return centers, _Metrics(X, k, centers, labels, sq_dist, silhouette_sample, seed(k))
+
+    def cold_fit(k, n_cold):
+        return None if n_cold < 1 else KMeans(n_clusters=k, n_init=n_cold, random_state=seed(k)).fit(X)
+
+    def best(k, kmeans, init=None):
+        if init is not None:
+            # The warm start, kept unless the k-means++ starts found a lower inertia
+            warm = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed(k)).fit(X)
+            if kmeans is None or warm.inertia_ <= kmeans.inertia_:
+                kmeans = warm
+        return kmeans.cluster_centers_.astype(float)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        if warm_start:
+            # The k-means++ fits of every K run in the pool, the warm starts are chained (each K
+            # starts from K-1) as those finish, and the metrics run alongside
+            chained = {k: k - 1 in cache or k - 1 in todo for k in todo}
+            cold = {k: pool.submit(cold_fit, k, n_init - 1 if chained[k] else n_init) for k in todo}
+            rng = np.random.default_rng(random_state)
+            fitted = {k: cache[k]['centers'] for k in cache}
+            for k in todo:
+                init = None
+                if chained[k]:
+                    _, prev_dist = NearestCenters(X, fitted[k-1])
+                    init = _WarmInit(X, fitted[k-1], prev_dist, rng)
+                fitted[k] = best(k, cold[k].result(), init)
+                futures[k] = pool.submit(metrics, k, fitted[k])
+        else:
+            for k in todo:
+                futures[k] = pool.submit(lambda k: metrics(k, best(k, cold_fit(k, n_init))), k)
+
+        for k, future in futures.items():
+            store(k, *future.result())
+
+    sweep = {'K': np.array(K)}
+    for name in ('inertia', 'distortion', 'calinski_harabasz', 'silhouette'):
+        sweep[name] = np.array([float(cache[k][name]) for k in K])
+    sweep['centers'] = [cache[k]['centers'] for k in K]
+    return sweep
@@ -0,0 +1,174 @@
+import functools
+import os
+import numpy as np
+import pandas
+import xarray as xr
+
+from instrument import Instrument
+
+# SST look-up files of each version (can be updated with new LUT versions)
+LUT_FILES = {'v1.0': 'TURNER_PSIZE_SST_LUT_VER1.csv'}
+
+
+@functools.lru_cache(maxsize=None)
+def read_lut(version='v1.0'):
+    """
+    PURPOSE: Read the SST look-up table once per session
+
+    OUTPUTS
+      sst.......... SST of each row of the LUT
+      coeffs....... float32 arrays of the LUT rows: COEFF1, COEFF3 and the exponent rates COEFF2/COEFF1, COEFF4/COEFF3
+    """
+    if version not in LUT_FILES:
+        raise ValueError('Version ' + version + ' not recognized, expected one of ' + str(list(LUT_FILES)))
+
+    sst_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), LUT_FILES[version])
+    sstlut = pandas.read_csv(sst_file, encoding='utf-8-sig').sort_values('SST')
+
+    coeffs = {'COEFF1': sstlut.COEFF1.values, 'COEFF3': sstlut.COEFF3.values,
+              'RATE12': sstlut.COEFF2.values/sstlut.COEFF1.values,
+              'RATE34': sstlut.COEFF4.values/sstlut.COEFF3.values}
+    coeffs = {name: value.astype(np.float32) for name, value in coeffs.items()}
+    for value in coeffs.values():
+        value.flags.writeable = False
+    sst = sstlut.SST.values.astype(float)
+    sst.flags.writeable = False
+    return sst, coeffs
+
+
+def _LUTRow(lut_sst, sst):
+
+    # Row of the nearest LUT SST (ascending), ties going to the higher SST as in the pandas
+    # method='nearest' lookup of the original psc. Outside of the LUT, the first or last row
+    n = lut_sst.shape[0]
+    sst = np.asarray(sst, dtype=float)
+    right = np.clip(np.searchsorted(lut_sst, sst), 1, n-1)
+    left = right - 1
+    return np.where(np.abs(lut_sst[left] - sst) < np.abs(lut_sst[right] - sst), left, right)
+
+
+def psc_fractions(chl, sst, version='v1.0', chunk_size=1048576, out=None):
+    """
+    PURPOSE: Phytoplankton size class fractions (Turner et al. 2021) of arrays of any shape, computed in
+             float32 chunks of chunk_size pixels so no full size temporary arrays are made
+
+    REQUIRED INPUTS:
+      CHL....... Chlorophyll array (numpy or memmap)
+      SST....... Sea surface temperature array on the same grid
+
+    OPTIONAL INPUTS
+      VERSION... Version of the look up file to use
+      OUT....... Dict of 'fpico', 'fnano', 'fmicro' arrays to write the fractions into (e.g. memmaps)
+
+    OUTPUTS
+      Dict of float32 arrays fpico, fnano and fmicro (NaN where CHL or SST is missing or CHL <= 0)
+
+    NOTES:
+      The coefficients of the nearest LUT SST are used (SST outside of the LUT uses the first or last row,
+      an SST halfway between two rows uses the higher one).
+      With a = COEFF2/COEFF1 and b = COEFF4/COEFF3:
+        fnanopico = COEFF1 * (1 - exp(-a*CHL)) / CHL
+        fpico = COEFF3 * (1 - exp(-b*CHL)) / CHL
+        fnano = fnanopico - fpico
+        fmicro = 1 - fnanopico
+    """
+    lut_sst, coeffs = read_lut(version)
+    chl = np.asarray(chl)
+    sst = np.asarray(sst)
+    if chl.shape != sst.shape:
+        raise ValueError('CHL ' + str(chl.shape) + ' and SST ' + str(sst.shape) + ' must have the same shape')
+
+    if out is None:
+        out = {name: np.empty(chl.shape, dtype=np.float32) for name in ('fpico', 'fnano', 'fmicro')}
+    chl_flat = chl.reshape(-1)
+    sst_flat = sst.reshape(-1)
+    flat = {name: out[name].reshape(-1) for name in ('fpico', 'fnano', 'fmicro')}
+
+    for i0 in range(0, chl_flat.shape[0], chunk_size):
+        s = slice(i0, i0 + chunk_size)
+        x = chl_flat[s].astype(np.float32)
+        t = sst_flat[s]
+        row = _LUTRow(lut_sst, t)
+
+        with np.errstate(divide='ignore'):
+            inv = np.reciprocal(x)
+        inv[~(x > 0) | np.isnan(t)] = np.nan
+
+        # 1 - exp(-a*CHL) = -expm1(-a*CHL), evaluated once for nanopico and once for pico
+        e = coeffs['RATE12'][row]
+        e *= x
+        np.negative(e, out=e)
+        np.expm1(e, out=e)
+        fnanopico = coeffs['COEFF1'][row]
+        fnanopico *= e
+        fnanopico *= inv
+        np.negative(fnanopico, out=fnanopico)
+
+        e = coeffs['RATE34'][row]
+        e *= x
+        np.negative(e, out=e)
+        np.expm1(e, out=e)
+        fpico = coeffs['COEFF3'][row]
+        fpico *= e
+        fpico *= inv
+        np.negative(fpico, out=fpico)
+
+        flat['fpico'][s] = fpico
+        np.subtract(fnanopico, fpico, out=fpico)
+        flat['fnano'][s] = fpico
+        np.subtract(1, fnanopico, out=fnanopico)
+        flat['fmicro'][s] = fnanopico
+
+    return out
+
+
+@Instrument
+def psc(chl, sst, version='v1.0'):
+    """
+    PURPOSE: Function to calculate phytoplankton size classes using the Northeast U.S. regionally tuned phytoplankton size class algorithm based on Turner et al. (2021)
+
+    REQUIRED INPUTS:
+      CHL....... Chlorophyll data (DataArray)
+      SST....... Sea surface temperature data on the same grid (DataArray or array)
+
+    OPTIONAL INPUTS
+      VERSION... Version of the look up file to use
+
+    KEYWORDS:
+      None
+
+    OUTPUTS
+      Phytoplankton size class (micro,nano, and picoplankton fractions and input chlorophyll.
+
+    REQUIRED FILES:
+      TURNER_PSIZE_SST_LUT_VER1.csv
+
+    EXAMPLES:
+      phyto = psc(data.chlor_a, data.sst)
+
+    NOTES:
+      To calculate phytoplankton size class chlorophyll contribution, multiply total chlorophyll with each size class fraction.
+      The fractions are computed by psc_fractions.
+
+    REFERENCE:
+      Turner, K. J., C. B. Mouw, K. J. W. Hyde, R. Morse, and A. B. Ciochetto (2021), Optimization and assessment of phytoplankton size class algorithms for ocean color data on the Northeast U.S. continental shelf, Remote Sensing of Environment, 267, 112729, [doi:https://doi.org/10.1016/j.rse.2021.112729]
+    COPYRIGHT:
+        Copyright (C) 2024, Department of Commerce, National Oceanic and Atmospheric Administration, National Marine Fisheries Service,
+        Northeast Fisheries Science Center, Narragansett Laboratory.
+        This software may be used, copied, or redistributed as long as it is not sold and this copyright notice is reproduced on each copy made.
+This routine is provided AS IS without any express or implied warranties whatsoever.
+
+    AUTHOR:
+      This program was written on August 06, 2024 by Kimberly J. W. Hyde, Northeast Fisheries Science Center | NOAA Fisheries | U.S. Department of Commerce, 28 Tarzwell Dr, Narragansett, RI 02882
+
+    MODIFICATION HISTORY:
+        Aug 06, 2024 - KJWH: Initial code written
+        Aug 08, 2024 - KJWH: Updated how the coefficients are extracted and the data are returned
+    """
+    fractions = psc_fractions(chl.values, np.asarray(sst), version=version)
+
+    phyto = xr.Dataset({name: xr.DataArray(fractions[name], coords=chl.coords, dims=chl.dims)
+                        for name in ('fmicro', 'fnano', 'fpico')})
+    phyto['chlor_a'] = chl
+
+    return phyto
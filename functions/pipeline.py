@@ -0,0 +1,490 @@
+# Command-line runner of the clustering workflow from a config file
+# The workflow is a DAG of stages (fetch -> regrid -> features -> select_k -> fit -> predict ->
+# matchups -> summaries, with argo_fetch feeding the matchups). The output of every stage is
+# saved under a hash of its parameters and of the hashes of the stages it depends on, so a
+# rerun only runs the stages whose inputs changed: changing K refits and relabels, but does
+# not download or regrid anything again.
+#
+# EXAMPLES
+#   python functions/pipeline.py pipeline_example.toml
+#   python functions/pipeline.py pipeline_example.toml --dry-run
+#   python functions/pipeline.py pipeline_example.toml --until features --force fetch
+
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from instrument import Stage
+
+# Bump a stage's version when its code changes, so its old checkpoints are not reused
+STAGE_VERSIONS = {'fetch': 1, 'regrid': 1, 'features': 1, 'select_k': 1, 'fit': 1, 'predict': 1,
+                  'argo_fetch': 1, 'matchups': 1, 'summaries': 1}
+
+DEFAULTS = {
+    'region': {'latN': 50, 'latS': 20, 'lonW': -80, 'lonE': -45},
+    'data': {'periods': ['2024-07-19', '2024-07-27'],
+             'products': ['SST', 'AVW', 'CHL', 'POC', 'KD', 'RRS'],
+             'avw_dir': 'data/AVW data/', 'cache_dir': None},
+    'regrid': {'method': 'nearest'},
+    'features': {'names': ['CHL', 'AVW', 'SST', 'POC', 'KD', 'FLH'], 'desired_wavelength': 475},
+    'clustering': {'n_clusters': 6, 'n_init': 10, 'random_state': 0,
+                   'max_K': 10, 'gap_fraction': 0.05, 'n_refs': 10},
+    'matchups': {'moana_files': None, 'argo_parameters': [], 'want_all': False},
+    'output': {'dir': 'output', 'checkpoint_dir': 'data/pipeline'},
+}
+
+
+def LoadConfig(path):
+
+    """
+        Read a TOML or JSON pipeline config and fill in the defaults (see pipeline_example.toml)
+
+        OUTPUTS
+        - dict of sections: region, data, regrid, features, clustering, matchups, output
+    """
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:  # python < 3.11
+            import tomli as tomllib
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+
+    merged = copy.deepcopy(DEFAULTS)
+    for section, values in config.items():
+        if section not in merged:
+            raise ValueError('Unknown config section [' + section + '], expected one of ' + str(list(merged)))
+        for name in values:
+            if name not in merged[section]:
+                raise ValueError('Unknown setting ' + section + '.' + name + ', expected one of '
+                                 + str(list(merged[section])))
+        merged[section].update(values)
+    return merged
+
+
+def _DateRange(config):
+
+    periods = config['data']['periods']
+    return [str(np.datetime64(periods[0], 'D')), str(np.datetime64(periods[-1], 'D') + np.timedelta64(7, 'D'))]
+
+
+def _Region(config):
+
+    r = config['region']
+    return r['latN'], r['latS'], r['lonW'], r['lonE']
+
+
+def _MOANAFiles(config):
+
+    pattern = config['matchups']['moana_files']
+    return [] if not pattern else sorted(glob.glob(pattern))
+
+
+# ===> Stages: params(config) -> what the output depends on besides the upstream stages,
+#      run(config, inputs, folder) writes the output files in folder,
+#      load(folder) reads them back for the stages downstream
+
+def _FetchParams(config):
+    return {'region': config['region'], 'periods': config['data']['periods'],
+            'products': config['data']['products'], 'avw_dir': config['data']['avw_dir']}
+
+
+def _FetchRun(config, inputs, folder):
+    from cluster_fxns import GetData, L3_VARIABLES
+    from getSST8day import SST8day
+    from get_avw import get_avw
+
+    latN, latS, lonW, lonE = _Region(config)
+    periods = config['data']['periods']
+    products = config['data']['products']
+    date_range = _DateRange(config)
+    l3 = [p for p in products if p in L3_VARIABLES]
+
+    # The L3 products (aligned to the periods by GetData), SST and AVW are downloaded at the same time
+    fetchers = {'l3': lambda: GetData(latN, latS, lonW, lonE, date_range, periods=periods, products=l3,
+                                      cache_dir=config['data']['cache_dir'])}
+    if 'SST' in products:
+        fetchers['sst'] = lambda: SST8day(date_range[0], date_range[1], latmin=latS, latmax=latN,
+                                          lonmin=lonW, lonmax=lonE, periods=periods)
+    if 'AVW' in products:
+        fetchers['avw'] = lambda: get_avw(periods=periods, data_dir=config['data']['avw_dir']).avw
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as pool:
+        futures = {name: pool.submit(fetch) for name, fetch in fetchers.items()}
+        for name, future in futures.items():
+            future.result().to_netcdf(os.path.join(folder, name + '.nc'))
+
+
+def _FetchLoad(folder):
+    return {name: os.path.join(folder, name + '.nc') for name in ('l3', 'sst', 'avw')
+            if os.path.exists(os.path.join(folder, name + '.nc'))}
+
+
+def _RegridParams(config):
+    return {'method': config['regrid']['method']}
+
+
+def _RegridRun(config, inputs, folder):
+    from cluster_fxns import Regrid, _AlignPeriods
+
+    files = inputs['fetch']
+    data = xr.load_dataset(files['l3'])
+    periods = data.time.values
+    LO, LA = np.meshgrid(data.lon.values, data.lat.values)
+    map_dir = os.path.join(config['output']['checkpoint_dir'], 'regrid_maps')
+
+    if 'sst' in files:
+        sst = _AlignPeriods(xr.load_dataarray(files['sst']), 'time', periods)
+        data['sst'] = (('time', 'lat', 'lon'), Regrid(sst.values, (sst.longitude.values, sst.latitude.values),
+                                                      (LO, LA), method=config['regrid']['method'], cache_dir=map_dir))
+    if 'avw' in files:
+        avw = _AlignPeriods(xr.load_dataarray(files['avw']), 'date', periods)
+        data['avw'] = (('time', 'lat', 'lon'), Regrid(avw.values, (avw.lon.values, avw.lat.values),
+                                                      (LO, LA), method=config['regrid']['method'], cache_dir=map_dir))
+    data.to_netcdf(os.path.join(folder, 'data.nc'))
+
+
+def _RegridLoad(folder):
+    return os.path.join(folder, 'data.nc')
+
+
+def _FeaturesParams(config):
+    return dict(config['features'])
+
+
+def _FeaturesRun(config, inputs, folder):
+    from cluster_model import BuildFeatures
+    from feature_cube import FeatureCube
+
+    with xr.open_dataset(inputs['regrid']) as data:
+        features = BuildFeatures(data, config['features']['names'], config['features']['desired_wavelength'])
+        FeatureCube(features, path=os.path.join(folder, 'features.npy'))
+
+
+def _FeaturesLoad(folder):
+    from feature_cube import FeatureCube
+    return FeatureCube.Open(os.path.join(folder, 'features.npy'))
+
+
+def _SelectKParams(config):
+    c = config['clustering']
+    if c['n_clusters'] != 'auto':
+        return {'n_clusters': c['n_clusters']}
+    return {'n_clusters': 'auto', 'max_K': c['max_K'], 'gap_fraction': c['gap_fraction'],
+            'n_refs': c['n_refs'], 'random_state': c['random_state']}
+
+
+def _SelectKRun(config, inputs, folder):
+    c = config['clustering']
+    result = {'n_clusters': c['n_clusters']}
+    if c['n_clusters'] == 'auto':
+        # Gap statistic on a random fraction of the scaled pixels, as in the notebook
+        from cluster_fxns import GetOptimalK
+        X = np.asarray(inputs['features'].X)
+        X = (X - X.mean(axis=0))/X.std(axis=0)
+        rng = np.random.default_rng(c['random_state'])
+        rows = rng.choice(X.shape[0], max(int(X.shape[0]*c['gap_fraction']), 2), replace=False)
+        gs, optimum = GetOptimalK(c['max_K'], X[np.sort(rows)], n_refs=c['n_refs'], random_state=c['random_state'])
+        result = {'n_clusters': int(optimum), 'gap': {name: np.asarray(gs[name]).tolist()
+                                                      for name in ('K', 'gap', 's')}}
+    with open(os.path.join(folder, 'k.json'), 'w') as f:
+        json.dump(result, f, indent=1)
+
+
+def _SelectKLoad(folder):
+    with open(os.path.join(folder, 'k.json')) as f:
+        return json.load(f)['n_clusters']
+
+
+def _FitParams(config):
+    c = config['clustering']
+    return {'n_init': c['n_init'], 'random_state': c['random_state']}
+
+
+def _FitRun(config, inputs, folder):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    from cluster_model import ClusterModel
+
+    cube = inputs['features']
+    c = config['clustering']
+    scaler = StandardScaler().fit(cube.X)
+    kmeans = KMeans(n_clusters=inputs['select_k'], n_init=c['n_init'],
+                    random_state=c['random_state']).fit(scaler.transform(cube.X))
+    with xr.open_dataset(inputs['regrid']) as data:
+        model = ClusterModel.FromFit(scaler, kmeans, cube.names, data=data,
+                                     desired_wavelength=config['features']['desired_wavelength'])
+    model.Save(os.path.join(folder, 'cluster_model.json'))
+
+
+def _FitLoad(folder):
+    from cluster_model import ClusterModel
+    return ClusterModel.Load(os.path.join(folder, 'cluster_model.json'))
+
+
+def _PredictParams(config):
+    return {}
+
+
+def _PredictRun(config, inputs, folder):
+    labels = inputs['fit'].Predict(inputs['features'])
+    with xr.open_dataset(inputs['regrid']) as data:
+        coords = {name: data[name].values for name in ('time', 'lat', 'lon')}
+    xr.Dataset({'labels': (('time', 'lat', 'lon'), labels)}, coords=coords,
+               attrs={'n_clusters': inputs['fit'].n_clusters}).to_netcdf(os.path.join(folder, 'labels.nc'))
+
+
+def _PredictLoad(folder):
+    return os.path.join(folder, 'labels.nc')
+
+
+def _ArgoFetchParams(config):
+    return {'region': config['region'], 'date_range': _DateRange(config),
+            'argo_parameters': config['matchups']['argo_parameters'], 'want_all': config['matchups']['want_all']}
+
+
+def _ArgoFetchRun(config, inputs, folder):
+    # Surface values of the BGC-Argo profiles in the region (replaces the hand-saved float_values.pkl)
+    parameters = config['matchups']['argo_parameters']
+    if len(parameters) == 0:
+        return
+    from cluster_fxns import GetSurfaceFloatValues
+    latN, latS, lonW, lonE = _Region(config)
+    cache_dir = config['data']['cache_dir'] or os.path.join(config['output']['checkpoint_dir'], 'argo_cache')
+    float_values = GetSurfaceFloatValues([latN, latS, lonW, lonE], _DateRange(config), parameters,
+                                         want_all=config['matchups']['want_all'], cache_dir=cache_dir)
+    float_values.to_pickle(os.path.join(folder, 'float_values.pkl'))
+
+
+def _ArgoFetchLoad(folder):
+    fname = os.path.join(folder, 'float_values.pkl')
+    return pd.read_pickle(fname) if os.path.exists(fname) else None
+
+
+def _MatchupsParams(config):
+    # The MOANA files are identified by name, size and modification time
+    files = [(os.path.basename(f), os.path.getsize(f), int(os.path.getmtime(f))) for f in _MOANAFiles(config)]
+    return {'moana_files': files}
+
+
+def _MatchupsRun(config, inputs, folder):
+    from cluster_fxns import GetClosestCluster, GetMOANAMeans
+
+    labels = xr.load_dataset(inputs['predict'])
+    total_labels = labels['labels'].values
+    n_clusters = int(labels.attrs['n_clusters'])
+    periods = labels.time.values
+    LO, LA = np.meshgrid(labels.lon.values, labels.lat.values)
+
+    flist = _MOANAFiles(config)
+    if len(flist) > 0:
+        moana_mean, moana_sd = GetMOANAMeans(flist, n_clusters, LO, LA, total_labels, periods=periods)
+        pcc_list = ['picoeuk_moana', 'prococcus_moana', 'syncoccus_moana']
+        table = pd.DataFrame({'cluster': np.arange(n_clusters)})
+        for pi, name in enumerate(pcc_list):
+            table[name + '_mean'] = moana_mean[:, pi]
+            table[name + '_sd'] = moana_sd[:, pi]
+        table.to_csv(os.path.join(folder, 'moana_means.csv'), index=False)
+
+    float_values = inputs['argo_fetch']
+    if float_values is not None:
+        float_values = float_values.copy()
+        float_values['FLAG'] = GetClosestCluster(LO, LA, total_labels, float_values['latitude'].values,
+                                                 float_values['longitude'].values, float_values['date'].values,
+                                                 periods=periods)
+        float_values.to_pickle(os.path.join(folder, 'float_matchups.pkl'))
+
+
+def _MatchupsLoad(folder):
+    return {name: os.path.join(folder, name) for name in ('moana_means.csv', 'float_matchups.pkl')
+            if os.path.exists(os.path.join(folder, name))}
+
+
+def _SummariesParams(config):
+    return {}
+
+
+def _SummariesRun(config, inputs, folder):
+    from Rrs_avg import Rrs_cluster_stats
+
+    labels = xr.load_dataset(inputs['predict'])
+    total_labels = labels['labels'].values
+    n_clusters = int(labels.attrs['n_clusters'])
+    shutil.copy(inputs['predict'], os.path.join(folder, 'labels.nc'))
+    inputs['fit'].Save(os.path.join(folder, 'cluster_model.json'))
+
+    # Number of pixels of each cluster in each period
+    counts = [(str(t)[:10], k, int((total_labels[ti] == k).sum()))
+              for ti, t in enumerate(labels.time.values) for k in range(n_clusters)]
+    pd.DataFrame(counts, columns=['period', 'cluster', 'n_pixels']).to_csv(
+        os.path.join(folder, 'cluster_counts.csv'), index=False)
+
+    # Per-cluster Rrs spectra
+    with xr.open_dataset(inputs['regrid']) as data:
+        if 'Rrs' in data:
+            Rrs_cluster_stats(data, total_labels, n_clusters).to_netcdf(os.path.join(folder, 'rrs_stats.nc'))
+
+    for name, fname in inputs['matchups'].items():
+        if name == 'float_matchups.pkl':
+            # Median surface value of each float parameter in each cluster
+            floats = pd.read_pickle(fname)
+            columns = [c for c in floats.columns if c.endswith('_FLOAT')]
+            floats.groupby('FLAG')[columns].median().to_csv(os.path.join(folder, 'float_medians.csv'))
+        else:
+            shutil.copy(fname, os.path.join(folder, name))
+
+
+def _SummariesLoad(folder):
+    return folder
+
+
+# name -> upstream stages, params, run, load (in a valid run order)
+STAGES = {
+    'fetch': ([], _FetchParams, _FetchRun, _FetchLoad),
+    'regrid': (['fetch'], _RegridParams, _RegridRun, _RegridLoad),
+    'features': (['regrid'], _FeaturesParams, _FeaturesRun, _FeaturesLoad),
+    'select_k': (['features'], _SelectKParams, _SelectKRun, _SelectKLoad),
+    'fit': (['features', 'select_k', 'regrid'], _FitParams, _FitRun, _FitLoad),
+    'predict': (['fit', 'features', 'regrid'], _PredictParams, _PredictRun, _PredictLoad),
+    'argo_fetch': ([], _ArgoFetchParams, _ArgoFetchRun, _ArgoFetchLoad),
+    'matchups': (['predict', 'argo_fetch'], _MatchupsParams, _MatchupsRun, _MatchupsLoad),
+    'summaries': (['predict', 'fit', 'regrid', 'matchups'], _SummariesParams, _SummariesRun, _SummariesLoad),
+}
+
+
+def StageKeys(config):
+
+    """
+        Checkpoint key of every stage: hash of the stage version, its parameters and the
+        keys of its upstream stages (so a change propagates downstream only)
+    """
+    keys = {}
+    for name, (deps, params, run, load) in STAGES.items():
+        content = json.dumps([name, STAGE_VERSIONS[name], params(config), [keys[d] for d in deps]],
+                             sort_keys=True, default=str)
+        keys[name] = hashlib.sha1(content.encode()).hexdigest()[:16]
+    return keys
+
+
+def _Needed(targets):
+
+    # The target stages and everything upstream of them
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(STAGES[name][0])
+    return [name for name in STAGES if name in needed]
+
+
+def RunPipeline(config, until='summaries', force=(), dry_run=False):
+
+    """
+        Run the stages needed for until, reusing the checkpoints of completed stages
+
+        INPUTS
+        - config: dict from LoadConfig
+        - until: last stage to run (with everything upstream of it)
+        - force: stages to run again even if their checkpoint exists
+        - dry_run: only report which stages would run
+
+        OUTPUTS
+        - dict of stage -> (key, 'cached' / 'run' / 'would run'). The outputs of summaries are
+          copied to config['output']['dir']
+    """
+    for name in [until] + list(force):
+        if name not in STAGES:
+            raise ValueError('Unknown stage ' + name + ', expected one of ' + str(list(STAGES)))
+
+    root = config['output']['checkpoint_dir']
+    keys = StageKeys(config)
+    needed = _Needed([until])
+    folder = {name: os.path.join(root, name, keys[name]) for name in STAGES}
+    done = {name: os.path.exists(os.path.join(folder[name], 'stage.json')) and name not in force
+            for name in STAGES}
+
+    # Only the stages with no checkpoint (and the ones downstream of them) run; inputs are
+    # loaded from upstream checkpoints only when something downstream of them runs
+    status = {}
+    loaded = {}
+    ran = set()
+
+    def Load(name):
+        if name not in loaded:
+            loaded[name] = STAGES[name][3](folder[name])
+        return loaded[name]
+
+    for name in needed:
+        deps, params, run, load = STAGES[name]
+        # Stages downstream of a stage that runs again (e.g. a forced fetch of newer data) also run
+        if done[name] and not any(d in ran for d in deps):
+            status[name] = (keys[name], 'cached')
+            continue
+        ran.add(name)
+        if dry_run:
+            status[name] = (keys[name], 'would run')
+            continue
+
+        print('Running', name, keys[name], flush=True)
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.' + keys[name] + '.', dir=os.path.join(root, name))
+        try:
+            with Stage('pipeline_' + name, key=keys[name]):
+                run(config, {d: Load(d) for d in deps}, tmp)
+            with open(os.path.join(tmp, 'stage.json'), 'w') as f:
+                json.dump({'stage': name, 'key': keys[name], 'version': STAGE_VERSIONS[name],
+                           'params': params(config), 'inputs': {d: keys[d] for d in deps}}, f,
+                          indent=1, default=str)
+            # A checkpoint is only visible once complete
+            if os.path.exists(folder[name]):
+                shutil.rmtree(folder[name])
+            os.replace(tmp, folder[name])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        loaded.pop(name, None)
+        status[name] = (keys[name], 'run')
+
+    if not dry_run and until == 'summaries':
+        out_dir = config['output']['dir']
+        os.makedirs(out_dir, exist_ok=True)
+        for fname in os.listdir(folder['summaries']):
+            if fname != 'stage.json':
+                shutil.copy(os.path.join(folder['summaries'], fname), os.path.join(out_dir, fname))
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the K-means clustering workflow from a config file')
+    parser.add_argument('config', help='TOML or JSON config (see pipeline_example.toml)')
+    parser.add_argument('--until', default='summaries', choices=list(STAGES), help='last stage to run')
+    parser.add_argument('--force', nargs='+', default=[], choices=list(STAGES), help='stages to run again')
+    parser.add_argument('--dry-run', action='store_true', help='only show which stages would run')
+    parser.add_argument('--report', default=None, help='save a timing and memory report (.json or .csv)')
+    args = parser.parse_args(argv)
+
+    config = LoadConfig(args.config)
+    if args.report is not None:
+        import instrument
+        instrument.Enable(report=args.report)
+
+    status = RunPipeline(config, until=args.until, force=args.force, dry_run=args.dry_run)
+    for name, (key, state) in status.items():
+        print('{:<12} {}  {}'.format(name, key, state))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Precomputed regridding between a pair of grids
+# The source -> target mapping is computed once per grid pair and reused for every
+# time slice and variable on those grids (e.g. AVW and SST onto the CHL grid)
+
+import os
+import numpy as np
+
+from matchup import GridMatcher, GridHash
+
+# Mappings already computed in this session, keyed by grid hash and method
+_MAPPING_CACHE = {}
+
+
+class Regridder:
+
+    """
+        Regrid data from a source grid to a target grid with a precomputed mapping
+
+        INPUTS
+        - source_grid: [source_lon, source_lat], 1D axes or 2D meshes
+        - target_grid: [target_lon, target_lat], 1D axes or 2D meshes (e.g. (LO, LA))
+        - method:
+            - 'nearest': value of the nearest source cell (same as griddata nearest)
+            - 'mean': average of all source cells falling in each target cell
+                      (block mean, for going from a finer to a coarser grid)
+        - cache_dir: if given, mappings are also saved here and reloaded in later sessions
+
+        EXAMPLE
+            rg = Regridder((AVW.lon.values, AVW.lat.values), (LO, LA), method='mean')
+            avw = rg(AVW.avw.values)
+    """
+
+    def __init__(self, source_grid, target_grid, method='nearest', cache_dir=None):
+
+        if method not in ('nearest', 'mean'):
+            raise ValueError("method must be 'nearest' or 'mean', not " + repr(method))
+
+        self.method = method
+        self.source_grid = [np.asarray(g, dtype=float) for g in source_grid]
+        self.target_grid = [np.asarray(g, dtype=float) for g in target_grid]
+        self.source_shape = _GridShape(*self.source_grid)
+        self.target_shape = _GridShape(*self.target_grid)
+        self.key = method + '_' + GridHash(*self.source_grid, *self.target_grid)
+
+        if self.key in _MAPPING_CACHE:
+            self.index = _MAPPING_CACHE[self.key]
+            return
+
+        fname = None if cache_dir is None else os.path.join(cache_dir, 'regrid_' + self.key + '.npy')
+        if fname is not None and os.path.exists(fname):
+            self.index = np.load(fname)
+        else:
+            self.index = self._ComputeIndex()
+            if fname is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(fname, self.index)
+
+        _MAPPING_CACHE[self.key] = self.index
+
+    def _ComputeIndex(self):
+
+        if self.method == 'nearest':
+            # For every target cell, the flat index of the nearest source cell
+            LO, LA = _Mesh(*self.target_grid)
+            rows, cols = GridMatcher(*self.source_grid).query(LO, LA)
+            return np.ravel_multi_index((rows.ravel(), cols.ravel()), self.source_shape)
+
+        # For every source cell, the flat index of the target cell it falls in (-1 if outside)
+        LO, LA = _Mesh(*self.source_grid)
+        matcher = GridMatcher(*self.target_grid)
+        rows, cols = matcher.query(LO, LA)
+        index = np.ravel_multi_index((rows.ravel(), cols.ravel()), self.target_shape)
+
+        if matcher.axes is not None:
+            inside = _InsideAxis(matcher.axes[0], LO.ravel()) & _InsideAxis(matcher.axes[1], LA.ravel())
+            index[~inside] = -1
+        return index
+
+    def __call__(self, data):
+
+        """
+            INPUTS
+            - data: array on the source grid, (lat, lon) or (n, lat, lon)
+
+            OUTPUTS
+            - data on the target grid, (target lat, target lon) or (n, target lat, target lon)
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.source_shape:
+            raise ValueError('data shape ' + str(data.shape) + ' does not match source grid '
+                             + str(self.source_shape))
+
+        single = data.ndim == 2
+        flat = data.reshape(-1, self.source_shape[0]*self.source_shape[1])
+        dtype = np.result_type(flat.dtype, np.float32)
+
+        if self.method == 'nearest':
+            out = flat[:, self.index].astype(dtype, copy=False)
+        else:
+            out = self._BlockMean(flat, dtype)
+
+        out = out.reshape((flat.shape[0],) + self.target_shape)
+        return out[0] if single else out
+
+    def _BlockMean(self, flat, dtype):
+
+        # One bincount over all slices: offset each slice's target indices
+        n_target = self.target_shape[0]*self.target_shape[1]
+        inside = np.where(self.index >= 0)[0]
+        index = (np.arange(flat.shape[0])[:, None]*n_target + self.index[inside]).ravel()
+        values = flat[:, inside].ravel()
+
+        good = ~np.isnan(values)
+        sums = np.bincount(index[good], weights=values[good], minlength=flat.shape[0]*n_target)
+        counts = np.bincount(index[good], minlength=flat.shape[0]*n_target)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = sums / counts
+        return out.reshape(flat.shape[0], n_target).astype(dtype, copy=False)
+
+
+def _GridShape(lon, lat):
+
+    if lon.ndim == 1:
+        return (lat.shape[0], lon.shape[0])
+    return lon.shape
+
+
+def _Mesh(lon, lat):
+
+    if lon.ndim == 1:
+        return np.meshgrid(lon, lat)
+    return lon, lat
+
+
+def _InsideAxis(axis, values):
+
+    # Inside the outer cell edges of a 1D axis (half a cell beyond the end centres)
+    half = 0.5*abs(axis[-1] - axis[0])/max(axis.shape[0] - 1, 1)
+    return (values >= axis.min() - half) & (values <= axis.max() + half)
@@ -0,0 +1,186 @@
+# Out-of-core K-means over the full feature cube
+# The features are read in (time, row block) chunks: one pass fits the scaler, the next
+# passes fit mini-batch K-means on shuffled batches, and labels are written back chunk by
+# chunk, so memory depends on the chunk and buffer sizes and not on the size of the domain
+# or the number of periods
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+from sklearn.preprocessing import StandardScaler
+
+from feature_cube import FeatureCube
+
+
+def _ReadChunk(features, ti, r0, r1):
+
+    # Rows r0:r1 of time step ti: the pixels with no NaN feature, and their mask
+    block = np.stack([np.asarray(f[ti, r0:r1, :], dtype=np.float32) for f in features], axis=-1)
+    valid = ~np.isnan(block).any(axis=-1)
+    return block[valid], valid
+
+
+def IterFeatureChunks(features, chunk_rows=64):
+
+    """
+        Read a feature cube in chunks
+
+        INPUTS
+        - features: list of arrays (time, lat, lon), e.g. numpy, memmap, or lazy xarray
+                    DataArrays; only one chunk of each is loaded at a time
+        - chunk_rows: number of latitude rows per chunk
+
+        OUTPUTS (yields)
+        - (ti, r0, r1): time index and row range of the chunk
+        - X: float32 array (n_valid, n_features) of the pixels with no NaN features
+        - valid: boolean mask (r1-r0, lon) of those pixels
+    """
+    n_time, n_lat, n_lon = features[0].shape
+    for ti in range(n_time):
+        for r0 in range(0, n_lat, chunk_rows):
+            r1 = min(r0 + chunk_rows, n_lat)
+            X, valid = _ReadChunk(features, ti, r0, r1)
+            yield (ti, r0, r1), X, valid
+
+
+def _IterX(features, chunk_rows):
+
+    # Feature rows of a FeatureCube (views of X) or of a list of arrays (read in chunks)
+    if isinstance(features, FeatureCube):
+        n_lon = features.shape[2]
+        yield from features.Chunks(chunk_rows*n_lon)
+    else:
+        for _, X, _ in IterFeatureChunks(features, chunk_rows):
+            yield X
+
+
+def _IterShuffledBatches(features, chunk_rows, batch_size, buffer_rows, rng):
+
+    """
+        Mini-batches in random order: the chunks are read in a random order into a buffer of
+        about buffer_rows rows, which is permuted before it is cut into batches, so a batch
+        is not a run of pixels from one latitude band
+    """
+    if isinstance(features, FeatureCube):
+        chunk_size = chunk_rows*features.shape[2]
+        chunks = [slice(i0, i0+chunk_size) for i0 in range(0, features.n_valid, chunk_size)]
+        read = lambda c: features.X[c]
+    else:
+        n_time, n_lat, n_lon = features[0].shape
+        chunks = [(ti, r0, min(r0 + chunk_rows, n_lat)) for ti in range(n_time) for r0 in range(0, n_lat, chunk_rows)]
+        read = lambda c: _ReadChunk(features, *c)[0]
+
+    buffer, n_buffer = [], 0
+    for ci in rng.permutation(len(chunks)):
+        X = read(chunks[ci])
+        buffer.append(X)
+        n_buffer += X.shape[0]
+        if n_buffer < buffer_rows:
+            continue
+        X = np.concatenate(buffer)
+        X = X[rng.permutation(X.shape[0])]
+        n_full = (X.shape[0]//batch_size)*batch_size
+        for i0 in range(0, n_full, batch_size):
+            yield X[i0:i0+batch_size]
+        buffer, n_buffer = [X[n_full:]], X.shape[0] - n_full
+
+    if n_buffer > 0:
+        X = np.concatenate(buffer)
+        X = X[rng.permutation(X.shape[0])]
+        for i0 in range(0, X.shape[0], batch_size):
+            yield X[i0:i0+batch_size]
+
+
+def FitStreamingKMeans(features, n_clusters, chunk_rows=64, n_passes=2, batch_size=4096,
+                       sample_size=100000, buffer_rows=1000000, random_state=None):
+
+    """
+        Fit a StandardScaler and mini-batch K-means without loading the feature cube
+
+        INPUTS
+        - features: FeatureCube, or list of arrays (time, lat, lon) (see IterFeatureChunks)
+        - n_clusters: number of clusters
+        - chunk_rows: number of latitude rows read at a time
+        - n_passes: number of passes of mini-batch K-means over the data
+        - batch_size: mini-batch size
+        - sample_size: size of the random sample (kept during the scaler pass) used for the
+                       k-means++ initialisation
+        - buffer_rows: number of rows shuffled together to draw the mini-batches
+        - random_state: seed
+
+        OUTPUTS
+        - scaler: fitted StandardScaler
+        - kmeans: fitted MiniBatchKMeans
+    """
+    rng = np.random.default_rng(random_state)
+
+    # Pass 1: scaler, and a reservoir sample for the initial centroids
+    scaler = StandardScaler()
+    n_features = len(features.names) if isinstance(features, FeatureCube) else len(features)
+    sample = np.zeros((0, n_features), dtype=np.float32)
+    sample_keys = np.zeros(0)
+    n_seen = 0
+    for X in _IterX(features, chunk_rows):
+        if X.shape[0] == 0:
+            continue
+        scaler.partial_fit(X)
+        n_seen += X.shape[0]
+
+        # Uniform sample: keep the rows with the sample_size smallest random keys
+        sample = np.concatenate([sample, X])
+        sample_keys = np.concatenate([sample_keys, rng.random(X.shape[0])])
+        if sample.shape[0] > sample_size:
+            keep = np.argpartition(sample_keys, sample_size)[:sample_size]
+            sample = sample[keep]
+            sample_keys = sample_keys[keep]
+
+    if n_seen < n_clusters:
+        raise ValueError('Only ' + str(n_seen) + ' valid pixels for ' + str(n_clusters) + ' clusters')
+
+    init, _ = kmeans_plusplus(scaler.transform(sample), n_clusters,
+                              random_state=int(rng.integers(2**31)))
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, batch_size=batch_size,
+                             random_state=int(rng.integers(2**31)))
+
+    # Next passes: mini-batch K-means, one shuffled batch at a time
+    for _ in range(n_passes):
+        for X in _IterShuffledBatches(features, chunk_rows, batch_size, buffer_rows, rng):
+            kmeans.partial_fit(scaler.transform(X))
+
+    return scaler, kmeans
+
+
+def PredictStreamingLabels(features, scaler, kmeans, out=None, chunk_rows=64):
+
+    """
+        Label every pixel of the feature cube chunk by chunk
+
+        INPUTS
+        - features: FeatureCube, or list of arrays (time, lat, lon)
+        - scaler, kmeans: output of FitStreamingKMeans
+        - out: optional array (time, lat, lon) to write the labels into (e.g. a np.memmap)
+
+        OUTPUTS
+        - labels: float32 (time, lat, lon), NaN where a feature is missing
+    """
+    shape = features.shape if isinstance(features, FeatureCube) else features[0].shape
+    if out is None:
+        out = np.full(shape, np.nan, dtype=np.float32)
+
+    if isinstance(features, FeatureCube):
+        # One time step of labels in memory at a time
+        chunk_size = chunk_rows*shape[2]
+        for ti, valid, X in features.TimeSlices():
+            labels = np.full(X.shape[0], np.nan, dtype=np.float32)
+            for i0 in range(0, X.shape[0], chunk_size):
+                labels[i0:i0+chunk_size] = kmeans.predict(scaler.transform(X[i0:i0+chunk_size]))
+            out[ti] = np.nan
+            out[ti][valid] = labels
+        return out
+
+    for (ti, r0, r1), X, valid in IterFeatureChunks(features, chunk_rows):
+        block = np.full(valid.shape, np.nan, dtype=np.float32)
+        if X.shape[0] > 0:
+            block[valid] = kmeans.predict(scaler.transform(X))
+        out[ti, r0:r1, :] = block
+
+    return out
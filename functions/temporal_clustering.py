@@ -0,0 +1,156 @@
+# Clustering a long series of composite periods one period at a time
+# Every period is scaled with the same scaler, K-means is started from the centroids of the
+# previous period and the new clusters are matched to the previous IDs (Hungarian algorithm)
+# so the cluster IDs mean the same thing in every period. Only one period is in memory
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+from feature_cube import FeatureCube
+from cluster_model import BuildFeatures, ClusterModel
+
+
+def MatchClusters(prev_centers, centers):
+
+    """
+        Match new clusters to previous clusters with the smallest total centroid distance
+
+        OUTPUTS
+        - ids: (n_clusters,) previous cluster ID given to each new cluster
+    """
+    cost = ((np.asarray(centers)[:, None, :] - np.asarray(prev_centers)[None, :, :])**2).sum(axis=-1)
+    rows, cols = linear_sum_assignment(cost)
+    ids = np.empty(len(rows), dtype=np.intp)
+    ids[rows] = cols
+    return ids
+
+
+def IterPeriodFeatures(latN, latS, lonW, lonE, periods, features=('CHL', 'AVW', 'SST', 'POC', 'KD', 'FLH'),
+                       desired_wavelength=475, **kwargs):
+
+    """
+        Features of each period, downloaded one period ahead of the one being clustered
+
+        INPUTS
+        - latN, latS, lonW, lonE: region
+        - periods: start dates of the 8-day composites
+        - features, desired_wavelength: see BuildFeatures
+        - kwargs: passed to GetData (e.g. cache_dir)
+
+        OUTPUTS (yields)
+        - period, dict of name -> array (1, lat, lon)
+    """
+    def Fetch(period):
+        from cluster_fxns import GetData
+        data = GetData(latN, latS, lonW, lonE, periods=[period], **kwargs)
+        return BuildFeatures(data, features, desired_wavelength)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(Fetch, periods[0]) if len(periods) > 0 else None
+        for pi, period in enumerate(periods):
+            products = future.result()
+            if pi + 1 < len(periods):
+                future = pool.submit(Fetch, periods[pi+1])
+            yield period, products
+
+
+def IterTemporalClusters(period_features, n_clusters=None, model=None, n_init=10, max_iter=300,
+                         random_state=None, desired_wavelength=None):
+
+    """
+        Cluster a stream of periods, each started from the previous period's centroids
+
+        INPUTS
+        - period_features: iterable of (period, dict of name -> array (lat, lon) or (1, lat, lon)),
+                           e.g. IterPeriodFeatures
+        - n_clusters: number of clusters (not needed with model)
+        - model: optional ClusterModel; its scaler is used for every period and its centroids
+                 start the first period and set the cluster IDs. Otherwise the scaler is
+                 fitted on the first period
+        - n_init: K-means initialisations of the first period when there is no model
+        - random_state: seed
+        - desired_wavelength: Kd wavelength (nm) the features were built with (the
+                              desired_wavelength of IterPeriodFeatures), saved with the models.
+                              Default 475, or that of model
+
+        OUTPUTS (yields)
+        - period, labels float32 (lat, lon) with NaN where a feature is missing,
+          model: ClusterModel with the centroids of this period (IDs matched to the previous one)
+    """
+    if model is not None and desired_wavelength is not None and desired_wavelength != model.desired_wavelength:
+        raise ValueError('The features use Kd at ' + str(desired_wavelength) + ' nm, the model at '
+                         + str(model.desired_wavelength) + ' nm')
+    if desired_wavelength is None:
+        desired_wavelength = 475 if model is None else model.desired_wavelength
+
+    for period, products in period_features:
+        products = {name: np.asarray(arr).reshape((1,) + np.asarray(arr).shape[-2:])
+                    for name, arr in products.items()}
+        cube = FeatureCube(products)
+
+        if model is None:
+            if n_clusters is None:
+                raise ValueError('n_clusters is needed when no model is given')
+            scaler = StandardScaler().fit(cube.X)
+            mean, scale = scaler.mean_, scaler.scale_
+            X = scaler.transform(cube.X)
+            kmeans = KMeans(n_clusters=n_clusters, n_init=n_init, max_iter=max_iter,
+                            random_state=random_state).fit(X)
+            centers = kmeans.cluster_centers_
+            labels = kmeans.labels_
+        else:
+            if cube.names != model.features:
+                raise ValueError('The data has features ' + str(cube.names) + ', the model ' + str(model.features))
+            mean, scale = model.mean, model.scale
+            X = (cube.X - mean)/scale
+            kmeans = KMeans(n_clusters=model.n_clusters, init=model.centers, n_init=1, max_iter=max_iter,
+                            random_state=random_state).fit(X)
+
+            # Keep the IDs of the previous period
+            ids = MatchClusters(model.centers, kmeans.cluster_centers_)
+            centers = np.empty_like(kmeans.cluster_centers_)
+            centers[ids] = kmeans.cluster_centers_
+            labels = ids[kmeans.labels_]
+
+        model = ClusterModel(cube.names, mean, scale, centers,
+                             desired_wavelength=desired_wavelength,
+                             product_versions=None if model is None else model.product_versions)
+        yield period, cube.Scatter(labels)[0], model
+
+
+def TemporalClusters(period_features, n_periods, n_clusters=None, model=None, out=None, **kwargs):
+
+    """
+        Cluster a stream of periods and collect the labels and centroids
+
+        INPUTS
+        - period_features, n_clusters, model, kwargs: see IterTemporalClusters
+        - n_periods: number of periods
+        - out: optional array (n_periods, lat, lon) for the labels (e.g. a np.memmap for a
+               long series); created on the first period otherwise
+
+        OUTPUTS
+        - periods: list of periods
+        - labels: float32 (n_periods, lat, lon)
+        - centers: (n_periods, n_clusters, n_features) centroids in scaled units
+        - model: ClusterModel of the last period
+
+        EXAMPLE
+            periods = [str(d) for d in np.arange(np.datetime64('2024-03-05'), np.datetime64('2024-12-31'), 8)]
+            features = IterPeriodFeatures(latN, latS, lonW, lonE, periods, desired_wavelength=490)
+            periods, total_labels, centers, model = TemporalClusters(features, len(periods), n_clusters=6,
+                                                                     desired_wavelength=490)
+    """
+    periods = []
+    centers = []
+    for pi, (period, labels, model) in enumerate(IterTemporalClusters(period_features, n_clusters, model, **kwargs)):
+        if out is None:
+            out = np.full((n_periods,) + labels.shape, np.nan, dtype=np.float32)
+        out[pi] = labels
+        periods.append(period)
+        centers.append(model.centers)
+
+    return periods, out, np.array(centers), model
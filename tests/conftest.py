@@ -0,0 +1,8 @@
+# The workflow functions are imported from functions/, as in the notebook
+import os
+import sys
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+sys.path.insert(0, FUNCTIONS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
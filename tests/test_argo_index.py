@@ -0,0 +1,73 @@
+# FilterArgoIndex and LoadArgoIndex against the per-row filter loop of the baseline GetSurfaceFloatValues
+import numpy as np
+import pandas as pd
+import pytest
+
+import argo_index
+import synthetic
+from argo_index import BuildParameterIndex, FilterArgoIndex, LoadArgoIndex, MergeArgoIndex
+
+CFG = dict(synthetic.SIZES['small'], n_profiles=300)
+
+
+def _BaselineFilter(idx, region, date_range, target_parameters, want_all):
+    latN = region[0]; latS = region[1]; lonW = region[2]; lonE = region[3]
+    good_inds = []
+    for pi in np.arange(idx.shape[0]):
+        param_count = 0
+        for ti in np.arange(len(target_parameters)):
+            if target_parameters[ti] in idx.loc[:, 'parameters'].values[pi].split(' '):
+                param_count = param_count + 1
+        if want_all == True:
+            if param_count == len(target_parameters):
+                good_inds.append(pi)
+        else:
+            if param_count > 0:
+                good_inds.append(pi)
+    good_idx = idx.iloc[good_inds, :]
+    good_idx = good_idx.loc[(good_idx.loc[:, 'date'] >= pd.Timestamp(date_range[0])) &
+                            (good_idx.loc[:, 'date'] <= pd.Timestamp(date_range[1])), :]
+    return good_idx.loc[(good_idx.loc[:, 'latitude'] <= latN) & (good_idx.loc[:, 'latitude'] >= latS) &
+                        (good_idx.loc[:, 'longitude'] <= lonE) & (good_idx.loc[:, 'longitude'] >= lonW), :]
+
+
+@pytest.mark.parametrize('target_parameters, want_all', [(['DOXY', 'BBP700'], True),
+                                                         (['CHLA', 'NITRATE'], False),
+                                                         (['DOXY', 'UNKNOWN'], True)])
+def test_filter_matches_baseline(target_parameters, want_all):
+    idx = synthetic.MakeArgoIndex(CFG)
+    region, date_range = [50, 20, -80, -45], ['2024-07-19', '2024-07-30']
+    params, bitmap = BuildParameterIndex(idx)
+
+    mask = FilterArgoIndex(idx, params, bitmap, target_parameters, want_all=want_all, region=region,
+                           date_range=date_range)
+    expected = _BaselineFilter(idx, region, date_range, target_parameters, want_all)
+    assert list(idx.file[mask]) == list(expected.file)
+    assert mask.sum() > 0 or 'UNKNOWN' in target_parameters
+
+
+def test_load_uses_cache_until_refresh(tmp_path, monkeypatch):
+    idx = synthetic.MakeArgoIndex(CFG)
+    downloads = []
+
+    def Download(index_file):
+        downloads.append(index_file)
+        return idx if len(downloads) == 1 else updated
+
+    monkeypatch.setattr(argo_index, '_DownloadIndex', Download)
+    first, params, bitmap = LoadArgoIndex(str(tmp_path))
+    second, params2, bitmap2 = LoadArgoIndex(str(tmp_path))
+    assert len(downloads) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert params == params2 and np.array_equal(bitmap, bitmap2)
+
+    # A refresh downloads the index again and keeps the newest row of each file
+    updated = idx.iloc[:10].assign(date_update=idx.date_update.iloc[:10] + np.timedelta64(1, 'D'),
+                                   parameters='PRES TEMP PSAL DOXY')
+    refreshed, params, bitmap = LoadArgoIndex(str(tmp_path), refresh=True)
+    assert len(downloads) == 2
+    pd.testing.assert_frame_equal(refreshed, MergeArgoIndex(idx, updated))
+    assert refreshed.shape[0] == idx.shape[0]
+    changed = refreshed.file.isin(updated.file).values
+    assert np.all(bitmap[changed][:, params.index('DOXY')])
+    assert not np.any(bitmap[changed][:, params.index('CHLA')])
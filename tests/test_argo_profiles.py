@@ -0,0 +1,118 @@
+# Batched Argo surface values against the per-profile loop of the baseline GetSurfaceFloatValues
+import numpy as np
+import pytest
+
+import argo_profiles
+import synthetic
+from argo_profiles import GetLayerStats, GetProfileColumns, GetSurfaceProfileValues, ParseProfileFile
+
+TARGETS = ['DOXY', 'BBP700', 'CHLA']
+
+
+def _Profiles(n=40):
+    idx = synthetic.MakeArgoIndex(dict(synthetic.SIZES['small'], n_profiles=n), n_other=0)
+    return idx.file.values, idx.parameters.values
+
+
+def _BaselineSurfaceValues(files, parameters, fetch_fn, surf_depth=50):
+    float_values = np.zeros((len(files), len(TARGETS)))*np.nan
+    for fi in np.arange(float_values.shape[0]):
+        wmo, profnum = ParseProfileFile(files[fi])
+        float_data = fetch_fn(wmo, profnum)
+        float_data = float_data.loc[float_data.loc[:, 'PRES'] <= surf_depth, :]
+        for ti in np.arange(len(TARGETS)):
+            if TARGETS[ti] in parameters[fi].split(' '):
+                float_data.loc[(float_data.loc[:, TARGETS[ti]+'_ADJUSTED_QC'] != 1) &
+                               (float_data.loc[:, TARGETS[ti]+'_ADJUSTED_QC'] != 2), TARGETS[ti]+'_ADJUSTED'] = np.nan
+                float_values[fi, ti] = float_data.loc[:, TARGETS[ti]+'_ADJUSTED'].mean()
+    return float_values
+
+
+def test_surface_values_match_baseline(tmp_path):
+    files, parameters = _Profiles()
+    values = GetSurfaceProfileValues(files, parameters, TARGETS, cache_dir=str(tmp_path), max_workers=4,
+                                     fetch_fn=synthetic.MakeProfile)
+    expected = _BaselineSurfaceValues(files, parameters, synthetic.MakeProfile)
+    np.testing.assert_allclose(values, expected, rtol=1e-5)
+    assert np.isfinite(values).sum() > 0
+
+
+def test_layer_stats_match_per_profile_loop(tmp_path):
+    # Several layers, one of them down to a per-profile depth, against the baseline QC and
+    # pandas reductions applied to each profile and layer in turn
+    files, parameters = _Profiles()
+    mld = np.random.default_rng(3).uniform(20, 80, len(files))
+    layers = {'0-10': (0, 10), '0-50': (0, 50), 'mld': (0, mld)}
+    columns = GetProfileColumns(files, parameters, TARGETS, max_depth=100, cache_dir=str(tmp_path),
+                                fetch_fn=synthetic.MakeProfile)
+    stats = GetLayerStats(columns, len(files), layers)
+
+    for fi in range(len(files)):
+        float_data = synthetic.MakeProfile(*ParseProfileFile(files[fi]))
+        for name, (top, bottom) in layers.items():
+            bottom = bottom[fi] if np.ndim(bottom) else bottom
+            layer = float_data.loc[(float_data.loc[:, 'PRES'] >= top) & (float_data.loc[:, 'PRES'] <= bottom), :]
+            for ti, param in enumerate(TARGETS):
+                if param not in parameters[fi].split(' '):
+                    assert stats[name]['count'][fi, ti] == 0
+                    continue
+                good = layer.loc[layer.loc[:, param+'_ADJUSTED_QC'].isin([1, 2]), param+'_ADJUSTED']
+                good = good.astype(float)
+                assert stats[name]['count'][fi, ti] == good.count()
+                np.testing.assert_allclose(stats[name]['mean'][fi, ti], good.mean(), rtol=1e-9)
+                np.testing.assert_allclose(stats[name]['std'][fi, ti], good.std(ddof=0), rtol=1e-6, atol=1e-12)
+
+
+def test_failed_profiles_are_reported_and_retried(tmp_path):
+    files, parameters = _Profiles()
+    broken = {ParseProfileFile(f) for f in files[::7]}
+    calls = []
+
+    def Fetch(wmo, cycle):
+        calls.append((wmo, cycle))
+        if (wmo, cycle) in broken:
+            raise IOError('GDAC timeout')
+        return synthetic.MakeProfile(wmo, cycle)
+
+    with pytest.warns(RuntimeWarning, match='Could not get {} of {}'.format(len(broken), len(files))) as record:
+        columns = GetProfileColumns(files, parameters, TARGETS, cache_dir=str(tmp_path), retries=1, backoff=0,
+                                    fetch_fn=Fetch)
+    assert len(record) == 1
+    assert {tuple(f) for f in columns['FAILED']} == broken
+    assert not np.isin(columns['PROFILE'], np.arange(len(files))[::7]).any()
+
+    # The next run only fetches the profiles that failed
+    calls.clear()
+    broken.clear()
+    columns = GetProfileColumns(files, parameters, TARGETS, cache_dir=str(tmp_path), fetch_fn=Fetch)
+    assert sorted(calls) == sorted(ParseProfileFile(f) for f in files[::7])
+    assert columns['FAILED'].shape == (0, 2)
+
+
+class _HTTPError(Exception):
+
+    def __init__(self, status):
+        super().__init__('HTTP ' + str(status))
+        self.status = status
+
+
+@pytest.mark.parametrize('err, n_calls', [(FileNotFoundError('no such profile'), 1),
+                                          (ValueError('unparsable profile'), 1),
+                                          (_HTTPError(404), 1),
+                                          (_HTTPError(503), 3),
+                                          (ConnectionResetError('reset'), 3),
+                                          (TimeoutError('timed out'), 3)])
+def test_only_transient_errors_are_retried(monkeypatch, err, n_calls):
+    files, parameters = _Profiles()
+    sleeps = []
+    monkeypatch.setattr(argo_profiles.time, 'sleep', sleeps.append)
+    calls = []
+
+    def Fetch(wmo, cycle):
+        calls.append((wmo, cycle))
+        raise err
+
+    with pytest.warns(RuntimeWarning, match='Could not get 1 of 1'):
+        GetProfileColumns(files[:1], parameters[:1], TARGETS, cache_dir=None, retries=2, backoff=2., fetch_fn=Fetch)
+    assert len(calls) == n_calls
+    assert sleeps == [2., 4.][:n_calls - 1]
@@ -0,0 +1,76 @@
+# BandMath against the baseline get_nFLH (F0 table read with pandas, one Rrs.sel per band)
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import band_math
+import synthetic
+from band_math import BandMath, NearestBand
+from get_nFLH import get_nFLH
+
+
+def _Rrs(wavelengths, shape=(2, 23, 31), seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(1e-4, 1e-2, shape + (len(wavelengths),)).astype(np.float32)
+    values[rng.random(shape) < 0.2] = np.nan
+    return xr.DataArray(values, dims=('time', 'lat', 'lon', 'wavelength'),
+                        coords={'wavelength': np.asarray(wavelengths, dtype=np.float32)}, name='Rrs')
+
+
+def _BaselineNFLH(Rrs, method=None):
+    # The baseline, with the F0 path made absolute. method='nearest' for bands that are not
+    # in the cube (the baseline raised a KeyError), F0 then taken at the band that is used
+    F0_table = pd.read_csv(band_math.F0_FILE, skiprows=15, header=None, names=['wv', 'F0'], sep=' ')
+    def nLw(target):
+        band = Rrs.sel({"wavelength": target}, method=method)
+        wv = float(band.wavelength)
+        f0 = np.interp(wv, F0_table.wv.values, F0_table.F0.values)
+        return band.astype(float)*f0, wv
+    nLw_678, lambda1 = nLw(678)
+    nLw_660, lambda2 = nLw(660)
+    nLw_705, lambda3 = nLw(706)
+    return nLw_678 - (lambda3 - lambda1)/(lambda3 - lambda2)*nLw_660 - (lambda1 - lambda2)/(lambda3 - lambda2)*nLw_705
+
+
+def test_nflh_matches_baseline_on_exact_bands():
+    Rrs = _Rrs(np.arange(640, 720, 2))
+    expected = _BaselineNFLH(Rrs)
+    np.testing.assert_allclose(BandMath(Rrs, ['nFLH'], chunk_rows=5)['nFLH'].values, expected.values,
+                               rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(get_nFLH(Rrs).Rrs.values, expected.values, rtol=1e-5, atol=1e-6)
+
+
+def test_nflh_uses_the_nearest_oci_band():
+    wavelengths = synthetic.OCIWavelengths()
+    assert 706 not in wavelengths
+    Rrs = _Rrs(wavelengths, shape=(1, 9, 11))
+    expected = _BaselineNFLH(Rrs, method='nearest')
+    np.testing.assert_allclose(BandMath(Rrs, ['nFLH'])['nFLH'].values, expected.values, rtol=1e-5, atol=1e-6)
+    with pytest.raises(ValueError, match='No band within'):
+        NearestBand(wavelengths, 900)
+
+
+def test_fused_products_match_separate_expressions():
+    Rrs = _Rrs(np.arange(400, 720, 1))
+    out = BandMath(Rrs, ['CI', 'BR_443_555', 'nFLH'], chunk_rows=4)
+    band = lambda wv: Rrs.sel(wavelength=wv).astype(float)
+    ci = band(555) - (670 - 555)/(670 - 443)*band(443) - (555 - 443)/(670 - 443)*band(670)
+    np.testing.assert_allclose(out['CI'].values, ci.values, rtol=1e-4, atol=1e-7)
+    np.testing.assert_allclose(out['BR_443_555'].values, (band(443)/band(555)).values, rtol=1e-6)
+    np.testing.assert_allclose(out['nFLH'].values, _BaselineNFLH(Rrs).values, rtol=1e-5, atol=1e-6)
+
+
+def test_f0_is_read_once(monkeypatch):
+    band_math.LoadF0.cache_clear()
+    reads = []
+    loadtxt = np.loadtxt
+    monkeypatch.setattr(np, 'loadtxt', lambda *args, **kwargs: reads.append(args) or loadtxt(*args, **kwargs))
+    # The baseline path was relative to the repository root, the F0 file is now found from anywhere
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.dirname(band_math.F0_FILE))))
+    Rrs = _Rrs(np.arange(400, 720, 2), shape=(1, 3, 3))
+    BandMath(Rrs, ['nFLH'])
+    BandMath(Rrs, ['nFLH', 'CI'])
+    assert len(reads) == 1
@@ -0,0 +1,56 @@
+# Offline benchmark suite: every benchmark runs on a tiny synthetic domain, and the
+# synthetic generators are reproducible
+import json
+
+import numpy as np
+import pytest
+
+import run_benchmarks
+import synthetic
+
+TINY = dict(n_lat=24, n_lon=30, n_periods=2, n_bands=172, sst_factor=2,
+            n_swaths=2, swath_shape=(40, 30), n_points=500, n_profiles=20)
+
+
+@pytest.fixture
+def tiny(monkeypatch):
+    pytest.importorskip('sklearn')
+    monkeypatch.setitem(synthetic.SIZES, 'tiny', TINY)
+    return 'tiny'
+
+
+def test_every_benchmark_runs(tiny, tmp_path):
+    results = [run_benchmarks.RunCase(name, tiny, str(tmp_path), repeat=1) for name in run_benchmarks.BENCHMARKS]
+    errors = {r['benchmark']: r['error'] for r in results if 'error' in r}
+    assert errors == {}
+    for r in results:
+        assert r['grid'] == '2x24x30'
+        assert r['time_s'] > 0 and r['peak_mb'] > 0
+
+    output = str(tmp_path / 'base.json')
+    run_benchmarks.WriteResults(results, output)
+    with open(output) as f:
+        assert json.load(f) == results
+    run_benchmarks.WriteResults(results, str(tmp_path / 'base.csv'))
+
+
+def test_compare_prints_ratios(capsys):
+    base = [{'benchmark': 'psc', 'size': 'small', 'grid': '2x150x175', 'time_s': 2., 'peak_mb': 10.}]
+    new = [dict(base[0], time_s=1., peak_mb=5., rss_mb=100.)]
+    run_benchmarks.PrintResults(new, base)
+    assert capsys.readouterr().out.splitlines()[-1].split()[-2:] == ['0.50', '0.50']
+
+
+def test_generators_are_reproducible(tmp_path):
+    a = synthetic.MakeDataset(TINY, products=('CHL', 'RRS'), seed=3)
+    b = synthetic.MakeDataset(TINY, products=('CHL', 'RRS'), seed=3)
+    c = synthetic.MakeDataset(TINY, products=('CHL', 'RRS'), seed=4)
+    assert a.identical(b)
+    assert not np.array_equal(a.chlor_a.values, c.chlor_a.values, equal_nan=True)
+
+    idx = synthetic.MakeArgoIndex(TINY, n_other=5)
+    assert idx.file.is_unique and idx.date.is_monotonic_increasing
+    assert idx.equals(synthetic.MakeArgoIndex(TINY, n_other=5))
+    profile = synthetic.MakeProfile(1902303, 12)
+    assert profile.equals(synthetic.MakeProfile(1902303, 12))
+    assert (np.diff(profile.PRES.values) >= 0).all()
@@ -0,0 +1,72 @@
+# GetData with the downloads replaced by synthetic products
+import numpy as np
+import pytest
+import xarray as xr
+
+import cluster_fxns
+import synthetic
+from regridder import Regridder
+
+PERIODS = synthetic.Periods(2)
+
+
+def _L3(product, lat, lon):
+    granules = [synthetic.MakeL3Granule(product, lat, lon, p, n_bands=8, period_index=pi)
+                for pi, p in enumerate(PERIODS)]
+    return xr.concat(granules, dim='date').assign_coords(date=PERIODS.astype('datetime64[ns]'))
+
+
+@pytest.fixture
+def fake_fetchers(monkeypatch):
+    lat, lon = synthetic.Grid(20, 30)
+    lat_avw, lon_avw = synthetic.Grid(40, 60)
+    sst_lat, sst_lon = synthetic.Grid(60, 90)
+    sst = xr.DataArray(np.random.default_rng(0).normal(20, 2, (len(PERIODS), 60, 90)),
+                       coords={'time': PERIODS.astype('datetime64[ns]'), 'latitude': sst_lat, 'longitude': sst_lon},
+                       dims=('time', 'latitude', 'longitude'))
+    products = {'CHL': _L3('CHL', lat, lon), 'RRS': _L3('RRS', lat, lon), 'AVW': _L3('AVW', lat_avw, lon_avw)}
+    monkeypatch.setattr(cluster_fxns, 'get_L3_8Day', lambda var, *args, **kwargs: products[var])
+    monkeypatch.setattr(cluster_fxns, 'get_avw', lambda periods=None: products['AVW'])
+    monkeypatch.setattr(cluster_fxns, 'SST8day', lambda *args, **kwargs: sst)
+    return products, sst
+
+
+def test_get_data_aligns_products(fake_fetchers):
+    products, sst = fake_fetchers
+    data = cluster_fxns.GetData(50, 20, -80, -45, periods=PERIODS, products=('SST', 'AVW', 'CHL', 'RRS'))
+
+    # The L3 products are returned as downloaded (the baseline GetData returned them unchanged)
+    np.testing.assert_array_equal(data.chlor_a.values, products['CHL'].chlor_a.values)
+    np.testing.assert_array_equal(data.Rrs.values, products['RRS'].Rrs.values)
+
+    # AVW is averaged over the finer cells, SST taken from the nearest cell
+    LO, LA = np.meshgrid(data.lon.values, data.lat.values)
+    avw = products['AVW'].avw
+    expected = Regridder((avw.lon.values, avw.lat.values), (LO, LA), method='mean')(avw.values)
+    np.testing.assert_allclose(data.avw.values, expected)
+    assert np.isfinite(data.avw.values).mean() > 0.5
+    expected = Regridder((sst.longitude.values, sst.latitude.values), (LO, LA))(sst.values)
+    np.testing.assert_allclose(data.sst.values, expected)
+    assert 'fetch_seconds_CHL' in data.attrs
+
+
+def test_get_data_validates_arguments(fake_fetchers):
+    with pytest.raises(ValueError, match='date_range or a list of periods'):
+        cluster_fxns.GetData(50, 20, -80, -45)
+    with pytest.raises(ValueError, match='Unknown product'):
+        cluster_fxns.GetData(50, 20, -80, -45, periods=PERIODS, products=('CHL', 'CHLA'))
+    with pytest.raises(ValueError, match='at least one L3 product'):
+        cluster_fxns.GetData(50, 20, -80, -45, periods=PERIODS, products=('SST',))
+
+
+def test_sst_windows_follow_the_periods(fake_fetchers, monkeypatch):
+    products, sst = fake_fetchers
+    calls = []
+    monkeypatch.setattr(cluster_fxns, 'SST8day', lambda *args, **kwargs: calls.append(kwargs['periods']) or sst)
+
+    cluster_fxns.GetData(50, 20, -80, -45, periods=PERIODS, products=('CHL', 'SST'))
+    np.testing.assert_array_equal(np.array(calls[-1], dtype='datetime64[D]'), PERIODS.astype('datetime64[D]'))
+
+    # Without periods, the SST is fetched for the dates of the L3 composites
+    cluster_fxns.GetData(50, 20, -80, -45, date_range=['2024-07-19', '2024-08-03'], products=('SST', 'CHL'))
+    np.testing.assert_array_equal(calls[-1], products['CHL'].date.values)
@@ -0,0 +1,62 @@
+# Saved ClusterModel predictions against the baseline refit path of the notebook
+# (feature DataFrame, StandardScaler, KMeans.predict and scatter-back)
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+import synthetic
+from cluster_model import MODEL_VERSION, BuildFeatures, ClusterModel
+from get_nFLH import get_nFLH
+
+CFG = dict(synthetic.SIZES['small'], n_lat=30, n_lon=40)
+FEATURES = ['CHL', 'AVW', 'SST', 'POC', 'KD', 'FLH']
+
+
+def _BaselineFit(data):
+    products = [data.chlor_a.values, data.avw.values, data.sst.values, data.poc.values,
+                data.Kd.sel(kd_wavelength=475).values, get_nFLH(data.Rrs).Rrs.values]
+    X = pd.DataFrame({name: p.flatten() for name, p in zip(FEATURES, products)})
+    good_inds = np.where(X.isna().sum(axis=1) == 0)[0]
+    scaler = StandardScaler().fit(X.iloc[good_inds].values)
+    kmeans_fit = KMeans(n_clusters=5, n_init=3, random_state=0).fit(scaler.transform(X.iloc[good_inds].values))
+    total_labels = np.zeros(X.shape[0])*np.nan
+    total_labels[good_inds] = kmeans_fit.predict(scaler.transform(X.iloc[good_inds].values))
+    return scaler, kmeans_fit, total_labels.reshape(products[0].shape)
+
+
+def test_saved_model_predicts_the_baseline_labels(tmp_path):
+    data = synthetic.MakeDataset(CFG)
+    scaler, kmeans_fit, expected = _BaselineFit(data)
+
+    ClusterModel.FromFit(scaler, kmeans_fit, FEATURES, data=data).Save(str(tmp_path / 'model.json'))
+    model = ClusterModel.Load(str(tmp_path / 'model.json'))
+    assert model.n_clusters == 5
+    assert model.product_versions['CHL'] == data.attrs['version_CHL']
+
+    labels = model.Predict(data, chunk_size=101)
+    np.testing.assert_array_equal(labels, expected)
+    np.testing.assert_array_equal(model.Predict(BuildFeatures(data, FEATURES)), expected)
+
+
+def test_model_checks_features_and_version(tmp_path):
+    data = synthetic.MakeDataset(CFG)
+    scaler, kmeans_fit, _ = _BaselineFit(data)
+    model = ClusterModel.FromFit(scaler, kmeans_fit, FEATURES)
+
+    features = BuildFeatures(data, FEATURES)
+    del features['FLH']
+    with pytest.raises(KeyError):
+        model.Predict(features)
+
+    path = str(tmp_path / 'model.json')
+    model.Save(path)
+    with open(path) as f:
+        saved = f.read().replace('"model_version": {}'.format(MODEL_VERSION), '"model_version": 0')
+    with open(path, 'w') as f:
+        f.write(saved)
+    with pytest.raises(ValueError, match='model version'):
+        ClusterModel.Load(path)
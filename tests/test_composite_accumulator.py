@@ -0,0 +1,98 @@
+# CompositeAccumulator against composites recomputed from all the days (the full reload it replaces)
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from composite_accumulator import CompositeAccumulator
+
+LAT = np.linspace(45, 25, 12)
+LON = np.linspace(-75, -50, 15)
+
+
+def _Days(n_days, seed=0):
+    # SST in kelvin with a small day to day spread, 20% missing
+    rng = np.random.default_rng(seed)
+    days = [str(np.datetime64('2024-07-19') + i) for i in range(n_days)]
+    data = rng.normal(300., 0.01, (n_days, LAT.shape[0], LON.shape[0]))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    return days, data
+
+
+def _Expected(data):
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(data, axis=0), np.nanstd(data, axis=0, ddof=1), (~np.isnan(data)).sum(axis=0)
+
+
+def _Check(composite, data):
+    mean, std, count = composite
+    expected_mean, expected_std, expected_count = _Expected(data)
+    np.testing.assert_array_equal(count, expected_count)
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-12)
+    np.testing.assert_allclose(std, expected_std, rtol=1e-8)
+
+
+def test_fixed_periods(tmp_path):
+    days, data = _Days(16)
+    acc = CompositeAccumulator(str(tmp_path), 'SST', origin='2024-07-19', keep_days=16)
+    for day, field in zip(days, data):
+        acc.AddDay(day, field, LAT, LON)
+
+    # A reprocessed day replaces the first one
+    data[3] += 0.05
+    acc.AddDay(days[3], data[3], LAT, LON)
+
+    assert acc.Periods() == ['2024-07-19', '2024-07-27']
+    _Check(acc.Composite('2024-07-19'), data[:8])
+    _Check(acc.Composite('2024-07-30'), data[8:])
+
+    # Reopened from disk
+    reopened = CompositeAccumulator(str(tmp_path), 'SST', origin='2024-07-19', keep_days=16)
+    assert reopened.MissingDays('2024-08-03', '2024-08-05') == ['2024-08-04', '2024-08-05']
+
+
+def test_rolling_window(tmp_path):
+    days, data = _Days(12, seed=1)
+    acc = CompositeAccumulator(str(tmp_path), 'SST', mode='rolling')
+    for i, (day, field) in enumerate(zip(days, data)):
+        acc.AddDay(day, field, LAT, LON)
+        if i >= 2:
+            _Check(acc.Composite(), data[max(0, i - 7):i + 1])
+
+    data[9] -= 0.03
+    acc.AddDay(days[9], data[9], LAT, LON)
+    _Check(acc.Composite(), data[4:12])
+
+
+def test_grid_is_checked(tmp_path):
+    days, data = _Days(2)
+    acc = CompositeAccumulator(str(tmp_path), 'SST', origin='2024-07-19')
+    acc.AddDay(days[0], data[0], LAT, LON)
+    with pytest.raises(ValueError, match='grid'):
+        acc.AddDay(days[1], data[1], LAT + 0.1, LON)
+    with pytest.raises(ValueError, match='grid'):
+        acc.AddDay(days[1], data[1][:, :-1], LAT, LON)
+
+
+def test_old_days_are_pruned(tmp_path):
+    days, data = _Days(20, seed=2)
+    fixed = CompositeAccumulator(str(tmp_path), 'SST', origin='2024-07-19')
+    rolling = CompositeAccumulator(str(tmp_path), 'CHL', mode='rolling')
+    for day, field in zip(days, data):
+        fixed.AddDay(day, field, LAT, LON)
+        rolling.AddDay(day, field, LAT, LON)
+
+    # Fixed: the days of the periods overlapping the last 8 days, rolling: the last 8 days
+    assert sorted(os.listdir(os.path.join(fixed.path, 'days'))) == [d + '.npz' for d in days[8:]]
+    assert sorted(os.listdir(os.path.join(rolling.path, 'days'))) == [d + '.npz' for d in days[12:]]
+    _Check(fixed.Composite('2024-07-19'), data[:8])
+    _Check(rolling.Composite(), data[12:])
+
+    with pytest.raises(ValueError, match='pruned'):
+        fixed.AddDay(days[2], data[2], LAT, LON)
+    data[9] += 0.02
+    fixed.AddDay(days[9], data[9], LAT, LON)
+    _Check(fixed.Composite('2024-07-27'), data[8:16])
+    assert fixed.MissingDays(days[0], days[-1]) == []
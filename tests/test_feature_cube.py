@@ -0,0 +1,94 @@
+# FeatureCube against the baseline DataFrame build (flatten, isna, iloc) and label scatter-back
+import numpy as np
+import pandas as pd
+
+from feature_cube import FeatureCube
+
+NAMES = ['CHL', 'avw', 'sst', 'POC']
+
+
+def _Products(shape=(2, 37, 45), seed=0):
+    rng = np.random.default_rng(seed)
+    products = {}
+    for name in NAMES:
+        arr = rng.lognormal(size=shape)
+        arr[rng.random(shape) < 0.2] = np.nan
+        products[name] = arr
+    return products
+
+
+def _BaselineX(products):
+    X = pd.DataFrame({name: products[name].flatten() for name in NAMES})
+    good_inds = np.where(X.isna().sum(axis=1) == 0)[0]
+    return X.iloc[good_inds], good_inds
+
+
+def _BaselineScatter(shape, good_inds, labels):
+    total_labels = np.zeros(shape).flatten()*np.nan
+    total_labels[good_inds] = labels
+    return total_labels.reshape(shape)
+
+
+def test_feature_matrix_matches_baseline():
+    products = _Products()
+    X, good_inds = _BaselineX(products)
+    cube = FeatureCube(products, chunk_rows=8)
+
+    assert cube.names == NAMES
+    assert cube.X.dtype == np.float32 and cube.X.flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(cube.X, X.values.astype(np.float32))
+    np.testing.assert_array_equal(np.flatnonzero(cube.valid), good_inds)
+    # Chunks are views of X
+    chunks = list(cube.Chunks(100))
+    assert all(np.shares_memory(c, cube.X) for c in chunks)
+    np.testing.assert_array_equal(np.concatenate(chunks), cube.X)
+
+
+def test_scatter_matches_baseline():
+    products = _Products()
+    X, good_inds = _BaselineX(products)
+    cube = FeatureCube(products)
+    labels = np.arange(cube.n_valid) % 6
+
+    np.testing.assert_array_equal(cube.Scatter(labels), _BaselineScatter(cube.shape, good_inds, labels))
+
+
+def test_memmap_cube_reopens(tmp_path):
+    products = _Products(seed=1)
+    X, good_inds = _BaselineX(products)
+    path = str(tmp_path / 'features.npy')
+    FeatureCube(products, path=path, chunk_rows=5)
+
+    cube = FeatureCube.Open(path)
+    assert isinstance(cube.X, np.memmap)
+    np.testing.assert_array_equal(cube.X, X.values.astype(np.float32))
+    labels = np.arange(cube.n_valid) % 4
+    np.testing.assert_array_equal(cube.Scatter(labels), _BaselineScatter(cube.shape, good_inds, labels))
+
+
+def test_scatter_into_a_view():
+    # A transposed output: reshape(-1) of it would be a copy and the labels would be lost
+    products = _Products(shape=(3, 11, 13))
+    X, good_inds = _BaselineX(products)
+    cube = FeatureCube(products)
+    labels = np.arange(cube.n_valid) % 5
+    expected = _BaselineScatter(cube.shape, good_inds, labels)
+
+    storage = np.zeros((13, 11, 3), dtype=np.float32)
+    out = storage.T
+    assert not out.flags['C_CONTIGUOUS']
+    cube.Scatter(labels, out=out)
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_array_equal(storage.T, expected)
+
+    strided = np.zeros((3, 22, 13), dtype=np.float32)[:, ::2]
+    np.testing.assert_array_equal(cube.Scatter(labels, out=strided), expected)
+
+
+def test_time_slices():
+    products = _Products(shape=(3, 7, 9))
+    cube = FeatureCube(products)
+    slices = list(cube.TimeSlices())
+    np.testing.assert_array_equal(np.stack([v for ti, v, X in slices]), cube.valid)
+    np.testing.assert_array_equal(np.concatenate([X for ti, v, X in slices]), cube.X)
+    assert all(np.shares_memory(X, cube.X) for ti, v, X in slices if X.shape[0] > 0)
@@ -0,0 +1,68 @@
+# Gap statistic engine against a serial Tibshirani et al. (2001) loop, the computation the
+# baseline GetOptimalK ran through gapstatistics
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.cluster import KMeans
+
+import gap_statistic
+from cluster_fxns import GetOptimalK
+from gap_statistic import GapStatistic, ReferenceDatasets
+
+
+def _Blobs(n_clusters=3, n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0, 0], [8, 0], [0, 8], [8, 8]])[:n_clusters]
+    return (centers[rng.integers(n_clusters, size=n)] + rng.normal(size=(n, 2))).astype(np.float32)
+
+
+def _BaselineGap(data, max_K, n_refs, random_state):
+    # One K-means fit per (K, reference) in turn, with the references and seeds GapStatistic draws
+    rng = np.random.default_rng(random_state)
+    refs = ReferenceDatasets(data, n_refs, random_state=rng)
+    seeds = rng.integers(2**31, size=(max_K, n_refs + 1))
+    gap = np.zeros(max_K)
+    s = np.zeros(max_K)
+    for k in range(1, max_K + 1):
+        log_w = np.log(KMeans(n_clusters=k, n_init=3, random_state=int(seeds[k-1, 0])).fit(data).inertia_)
+        ref_log_w = np.array([np.log(KMeans(n_clusters=k, n_init=3, random_state=int(seeds[k-1, b+1])).fit(refs[b]).inertia_)
+                              for b in range(n_refs)])
+        gap[k-1] = ref_log_w.mean() - log_w
+        s[k-1] = ref_log_w.std()*np.sqrt(1 + 1/n_refs)
+    optimum = next((k for k in range(1, max_K) if gap[k-1] >= gap[k] - s[k]), max_K)
+    return gap, s, optimum
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_gap_statistic_matches_serial_loop(max_workers):
+    data = _Blobs()
+    gs = GapStatistic(data, max_K=5, n_refs=4, early_stop=False, max_workers=max_workers, random_state=0)
+    gap, s, optimum = _BaselineGap(data, 5, 4, random_state=0)
+
+    np.testing.assert_allclose(gs['gap'], gap, rtol=1e-5)
+    np.testing.assert_allclose(gs['s'], s, rtol=1e-4, atol=1e-7)
+    assert gs['optimum'] == optimum == 3
+
+
+def test_serial_run_releases_the_data():
+    GapStatistic(_Blobs(), max_K=2, n_refs=2, max_workers=1, random_state=0)
+    assert gap_statistic._GAP_WORKER == {}
+
+
+def test_early_stop_gives_the_same_optimum():
+    data = _Blobs(n_clusters=2)
+    full = GapStatistic(data, max_K=6, n_refs=4, early_stop=False, max_workers=1, random_state=1)
+    early = GapStatistic(data, max_K=6, n_refs=4, early_stop=True, max_workers=1, k_per_round=1, random_state=1)
+
+    assert early['optimum'] == full['optimum'] == 2
+    evaluated = np.isfinite(early['gap'])
+    assert not evaluated.all()
+    np.testing.assert_array_equal(early['gap'][evaluated], full['gap'][evaluated])
+
+
+def test_get_optimal_k_uses_max_k():
+    # The baseline always evaluated K=10 whatever max_K was
+    gs, optimum = GetOptimalK(4, _Blobs(n_clusters=4), n_refs=3, early_stop=False, max_workers=1, random_state=0)
+    np.testing.assert_array_equal(gs['K'], [1, 2, 3, 4])
+    assert optimum <= 4
@@ -0,0 +1,96 @@
+# Chunked SST8day, with the griddap requests served from a local daily cube, against the
+# OPeNDAP subset + resample of the baseline
+import re
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import getSST8day
+import synthetic
+
+CFG = dict(synthetic.SIZES['small'], n_lat=12, n_lon=16, sst_factor=2)
+URL = 'https://erddap.test/erddap/griddap/test_sst'
+
+
+@pytest.fixture
+def daily(monkeypatch):
+    ds = synthetic.MakeDailySST(CFG, n_days=20)
+    requests = []
+
+    def Fetch(url, retries=3):
+        requests.append(url)
+        query = url.split('?', 1)[1]
+        if '[' not in query:
+            return xr.Dataset(coords={name: ds[name] for name in query.split(',')})
+        variable = query.split('[')[0]
+        slices = [tuple(map(int, m)) for m in re.findall(r'\[(\d+):(\d+):(\d+)\]', query)]
+        return ds[[variable]].isel({dim: slice(a, c + 1, b) for dim, (a, b, c) in zip(ds[variable].dims, slices)})
+
+    monkeypatch.setattr(getSST8day, '_FetchGriddap', Fetch)
+    return ds, requests
+
+
+def _Baseline(ds, start_date, end_date, latmin, latmax, lonmin, lonmax):
+    subset = ds['sea_surface_temperature'].sel(time=slice(start_date, end_date),
+                                               latitude=slice(latmax, latmin),
+                                               longitude=slice(lonmin, lonmax))
+    return subset.resample(time='8D').mean(dim='time')
+
+
+@pytest.mark.parametrize('chunk_days, tile_rows', [(8, None), (3, 5)])
+def test_chunked_matches_baseline(daily, chunk_days, tile_rows):
+    ds, requests = daily
+    region = dict(latmin=25, latmax=45, lonmin=-75, lonmax=-50)
+    sst = getSST8day.SST8day('2024-07-19', '2024-08-03', erddap_url=URL, chunk_days=chunk_days,
+                             tile_rows=tile_rows, max_workers=2, **region)
+    expected = _Baseline(ds, '2024-07-19', '2024-08-03', **region)
+
+    np.testing.assert_array_equal(sst.time.values, expected.time.values)
+    np.testing.assert_array_equal(sst.latitude.values, expected.latitude.values)
+    np.testing.assert_array_equal(sst.longitude.values, expected.longitude.values)
+    np.testing.assert_allclose(sst.values, expected.values, rtol=1e-6)
+    assert len(requests) > 1
+
+
+def test_empty_range_raises(daily):
+    with pytest.raises(ValueError, match='2023-01-01 and 2023-01-05'):
+        getSST8day.SST8day('2023-01-01', '2023-01-05', erddap_url=URL)
+
+
+def _BaselinePeriods(ds, start_date, end_date, periods, latmin, latmax, lonmin, lonmax):
+    # Mean of the days of each period (within the date range), one period at a time
+    subset = ds['sea_surface_temperature'].sel(time=slice(start_date, end_date),
+                                               latitude=slice(latmax, latmin),
+                                               longitude=slice(lonmin, lonmax))
+    days = subset.time.values.astype('datetime64[D]')
+    return np.stack([subset.isel(time=np.where((days >= p) & (days < p + 8))[0]).mean(dim='time').values
+                     for p in np.array(periods, dtype='datetime64[D]')])
+
+
+@pytest.mark.parametrize('chunked', [True, False])
+def test_periods_anchor_the_windows(daily, monkeypatch, chunked):
+    # A date range that does not start on a period: the windows still follow the periods
+    ds, requests = daily
+    open_dataset = xr.open_dataset
+    monkeypatch.setattr(getSST8day.xr, 'open_dataset', lambda url, **kw: ds if url == URL else open_dataset(url, **kw))
+    region = dict(latmin=25, latmax=45, lonmin=-75, lonmax=-50)
+    periods = ['2024-07-19', '2024-07-27', '2024-08-04', '2024-08-20']
+    sst = getSST8day.SST8day('2024-07-22', '2024-08-10', erddap_url=URL, periods=periods, chunked=chunked,
+                             chunk_days=3, max_workers=2, **region)
+    expected = _BaselinePeriods(ds, '2024-07-22', '2024-08-10', periods, **region)
+
+    np.testing.assert_array_equal(sst.time.values, np.array(periods, dtype='datetime64[ns]'))
+    np.testing.assert_allclose(sst.values, expected, rtol=1e-6)
+    # The last period has no data in the range
+    assert np.isnan(sst.values[-1]).all()
+
+
+def test_short_period_before_the_next_start():
+    # A period ends at the next start when they are less than 8 days apart (e.g. at the end of a year)
+    periods = ['2024-12-26', '2025-01-01']
+    days = np.array(['2024-12-25', '2024-12-26', '2024-12-31', '2025-01-01', '2025-01-08', '2025-01-09'],
+                    dtype='datetime64[D]')
+    starts, period, inside = getSST8day._PeriodIndex(days, periods)
+    np.testing.assert_array_equal(inside, [False, True, True, True, True, False])
+    np.testing.assert_array_equal(period[inside], [0, 0, 1, 1])
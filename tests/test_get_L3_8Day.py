@@ -0,0 +1,59 @@
+# get_L3_8Day on local synthetic granules against the baseline open/combine_nested loop
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import get_L3_8Day as l3
+import synthetic
+
+CFG = dict(synthetic.SIZES['small'], n_lat=30, n_lon=40, n_periods=3, n_bands=8)
+ROI = dict(lonE=-50., lonW=-75., latN=45., latS=25.)
+
+
+class _LocalEarthaccess:
+
+    # search_data / open of earthaccess over a list of local files
+    def __init__(self, files):
+        self.files = files
+
+    def search_data(self, **query):
+        return list(self.files)
+
+    def open(self, results):
+        return list(results)
+
+
+def _BaselineL3(paths, lonE, lonW, latN, latS):
+    # The loop of the original get_L3_8Day (non-Rrs products)
+    ds_grid = []
+    for path in paths:
+        dataset = xr.open_dataset(path)
+        dataset = dataset.isel(lon=np.where((dataset.lon.values>=lonW) & (dataset.lon.values<=lonE))[0],
+                               lat=np.where((dataset.lat.values>=latS) & (dataset.lat.values<=latN))[0])
+        d = datetime.fromisoformat(dataset.attrs['time_coverage_start'][:-1]).astimezone(timezone.utc)
+        ds_grid.append(dataset.assign(date=d).set_coords("date"))
+        dataset = xr.combine_nested(ds_grid, concat_dim="date")
+    return dataset
+
+
+def test_get_L3_8Day_matches_baseline(tmp_path, monkeypatch):
+    files = synthetic.WriteL3Granules(str(tmp_path), products=('CHL',), size=CFG)['CHL']
+    monkeypatch.setattr(l3, 'Earthaccess', lambda: _LocalEarthaccess(files[::-1]))
+
+    data = l3.get_L3_8Day('CHL', datetime(2024, 7, 19), datetime(2024, 8, 12), max_workers=2, **ROI)
+    expected = _BaselineL3(files, **ROI)
+
+    # Loaded by default (no dask), one slice per period in date order
+    assert isinstance(data.chlor_a.data, np.ndarray)
+    np.testing.assert_array_equal(data.chlor_a.values, expected.chlor_a.values)
+    np.testing.assert_array_equal(data.lat.values, expected.lat.values)
+    np.testing.assert_array_equal(data.lon.values, expected.lon.values)
+    assert np.all(np.diff(data.date.values) > np.timedelta64(0))
+
+
+def test_no_granules(monkeypatch):
+    monkeypatch.setattr(l3, 'Earthaccess', lambda: _LocalEarthaccess([]))
+    with pytest.raises(ValueError, match='No PACE_OCI_L3M_CHL_NRT granules .* between 2024-07-19 and 2024-08-12'):
+        l3.get_L3_8Day('CHL', datetime(2024, 7, 19), datetime(2024, 8, 12), **ROI)
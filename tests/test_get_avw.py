@@ -0,0 +1,48 @@
+# get_avw on synthetic AVW files against the baseline open/combine_nested loop
+import numpy as np
+import pytest
+import xarray as xr
+
+import get_avw as avw_module
+import synthetic
+
+CFG = dict(synthetic.SIZES['small'], n_lat=20, n_lon=30, n_periods=3)
+
+
+def _BaselineAVW(paths):
+    # The loop of the original get_avw (dates kept as datetime64)
+    ds_grid = []
+    for path in paths:
+        dataset = xr.open_dataset(path)
+        d = np.datetime64(dataset.attrs['time_coverage_start'][:-1], 'ns')
+        ds_grid.append(dataset.assign(date=d).set_coords('date'))
+    return xr.combine_nested(ds_grid, concat_dim='date')
+
+
+def test_get_avw_matches_baseline(tmp_path):
+    files = synthetic.WriteL3Granules(str(tmp_path), ('AVW',), CFG)['AVW']
+    data = avw_module.get_avw(data_dir=str(tmp_path))
+    expected = _BaselineAVW(files)
+    np.testing.assert_array_equal(data.avw.values, expected.avw.values)
+    np.testing.assert_array_equal(data.date.values, expected.date.values)
+
+
+def test_periods_are_filtered_by_file_name(tmp_path, monkeypatch):
+    files = synthetic.WriteL3Granules(str(tmp_path), ('AVW',), CFG)['AVW']
+    periods = synthetic.Periods(3)
+
+    # Only the file of the requested period is opened
+    opened = []
+    open_dataset = xr.open_dataset
+    monkeypatch.setattr(avw_module.xr, 'open_dataset', lambda path, **kw: opened.append(path) or open_dataset(path, **kw))
+    data = avw_module.get_avw(periods=[periods[1]], data_dir=str(tmp_path))
+    assert opened == [files[1]]
+    np.testing.assert_array_equal(data.avw.values, _BaselineAVW(files[1:2]).avw.values)
+
+
+def test_no_matching_files(tmp_path):
+    synthetic.WriteL3Granules(str(tmp_path), ('AVW',), CFG)
+    with pytest.raises(ValueError, match='No AVW files .* for the periods 2020-01-01'):
+        avw_module.get_avw(periods=[np.datetime64('2020-01-01')], data_dir=str(tmp_path))
+    with pytest.raises(ValueError, match='No AVW files'):
+        avw_module.get_avw(data_dir=str(tmp_path / 'empty'))
@@ -0,0 +1,77 @@
+# run_psc, tile by tile to NetCDF, against the size classes of the whole arrays at once
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import get_psc
+import synthetic
+from phyto_size_turner import psc_fractions
+from regridder import Regridder
+
+PERIODS = synthetic.Periods(2).astype('datetime64[ns]')
+
+
+@pytest.fixture
+def fake_inputs(monkeypatch):
+    lat, lon = synthetic.Grid(30, 40)
+    chl = xr.concat([synthetic.MakeL3Granule('CHL', lat, lon, p, period_index=pi) for pi, p in enumerate(PERIODS)],
+                    dim='date').assign_coords(date=PERIODS)
+    sst = synthetic.MakeSST8Day(dict(synthetic.SIZES['small'], n_lat=12, n_lon=16, sst_factor=1))
+    monkeypatch.setattr(get_psc, 'get_L3_8Day', lambda *args, **kwargs: chl)
+    monkeypatch.setattr(get_psc, 'SST8day', lambda *args, **kwargs: sst)
+    return chl, sst
+
+
+def test_run_psc_matches_whole_array(fake_inputs, tmp_path):
+    chl, sst = fake_inputs
+    output = str(tmp_path / 'psize.nc')
+    in_memory = get_psc.run_psc('2024-07-19', '2024-08-03', tile_rows=7)
+    written = get_psc.run_psc('2024-07-19', '2024-08-03', output=output, tile_rows=7)
+
+    # The SST of the nearest cell, then the size classes of the whole period at once
+    lat, lon = chl.lat.values, chl.lon.values
+    index = Regridder((sst.longitude.values, sst.latitude.values), (lon, lat)).index.reshape(lat.shape[0], lon.shape[0])
+    for ti in range(len(PERIODS)):
+        chl_period = chl.chlor_a.values[ti].astype(np.float32)
+        expected = psc_fractions(chl_period, sst.values[ti].ravel()[index])
+        for name in ('fpico', 'fnano', 'fmicro'):
+            np.testing.assert_allclose(in_memory[name].values[ti], expected[name], rtol=1e-6)
+            np.testing.assert_allclose(written[name].values[ti], expected[name], rtol=1e-6)
+        np.testing.assert_array_equal(written['chlor_a'].values[ti], chl_period)
+    written.close()
+    assert not (tmp_path / 'psize.nc.tmp').exists()
+
+
+def test_run_psc_zarr(fake_inputs, tmp_path):
+    pytest.importorskip('zarr')
+    pytest.importorskip('dask')
+    output = str(tmp_path / 'psize.zarr')
+    in_memory = get_psc.run_psc('2024-07-19', '2024-08-03', tile_rows=7)
+    written = get_psc.run_psc('2024-07-19', '2024-08-03', output=output, tile_rows=7)
+    for name in get_psc.PSC_VARIABLES:
+        np.testing.assert_array_equal(written[name].values, in_memory[name].values)
+    assert not (tmp_path / 'psize.zarr.tmp').exists()
+
+
+@pytest.mark.parametrize('fname', ['psize.nc', 'psize.zarr'])
+def test_failed_run_leaves_no_output(fake_inputs, tmp_path, monkeypatch, fname):
+    if fname.endswith('.zarr'):
+        pytest.importorskip('zarr')
+        pytest.importorskip('dask')
+    calls = []
+    def Fails(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise MemoryError('tile 3')
+        return psc_fractions(*args, **kwargs)
+    monkeypatch.setattr(get_psc, 'psc_fractions', Fails)
+
+    with pytest.raises(MemoryError):
+        get_psc.run_psc('2024-07-19', '2024-08-03', output=str(tmp_path / fname), tile_rows=7)
+    assert sorted(os.listdir(tmp_path)) == []
+
+
+def test_netcdf4_imported_by_writer_only():
+    assert 'netCDF4' not in get_psc.__dict__
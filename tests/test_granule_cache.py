@@ -0,0 +1,92 @@
+# GranuleCache with local files standing in for the earthaccess downloads
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+import granule_cache
+import synthetic
+from granule_cache import GranuleCache, SubsetROI
+
+CFG = dict(synthetic.SIZES['small'], n_lat=30, n_lon=40, n_periods=6, n_bands=8)
+ROI = dict(lonE=-50., lonW=-75., latN=45., latS=25.)
+
+
+class _LocalEarthaccess:
+
+    # earthaccess.download copying local files, counting the downloads
+    def __init__(self):
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def download(self, granules, local_path):
+        source = granules[0]['source']
+        with self.lock:
+            self.downloads.append(source)
+        target = os.path.join(local_path, os.path.basename(source))
+        shutil.copy(source, target)
+        return [target]
+
+
+def _Granules(tmp_path, monkeypatch):
+    files = synthetic.WriteL3Granules(str(tmp_path / 'remote'), products=('CHL',), size=CFG)['CHL']
+    earthaccess = _LocalEarthaccess()
+    monkeypatch.setattr(granule_cache, 'Earthaccess', lambda: earthaccess)
+    granules = [{'umm': {'GranuleUR': os.path.basename(f)}, 'source': f} for f in files]
+    return files, granules, earthaccess
+
+
+def test_subset_matches_baseline_roi(tmp_path, monkeypatch):
+    files, granules, earthaccess = _Granules(tmp_path, monkeypatch)
+    cache = GranuleCache(str(tmp_path / 'cache'))
+
+    for fname, granule in zip(files, granules):
+        with xr.open_dataset(fname) as dataset:
+            # The ROI selection of the baseline get_L3_8Day
+            expected = dataset.isel(lon=np.where((dataset.lon.values>=ROI['lonW']) & (dataset.lon.values<=ROI['lonE']))[0],
+                                    lat=np.where((dataset.lat.values>=ROI['latS']) & (dataset.lat.values<=ROI['latN']))[0])
+            np.testing.assert_array_equal(SubsetROI(dataset, **ROI).chlor_a.values, expected.chlor_a.values)
+            with cache.subset(granule, 'CHL', **ROI) as roi:
+                np.testing.assert_array_equal(roi.chlor_a.values, expected.chlor_a.values)
+
+    # Repeat requests are served from the cache
+    for granule in granules:
+        cache.subset(granule, 'CHL', **ROI).close()
+    assert len(earthaccess.downloads) == len(files)
+
+
+def test_granules_in_use_are_not_evicted(tmp_path, monkeypatch):
+    files, granules, earthaccess = _Granules(tmp_path, monkeypatch)
+    cache = GranuleCache(str(tmp_path / 'cache'), max_bytes=0)
+
+    with cache.using(granules[0]) as fname:
+        cache.evict()
+        assert os.path.exists(fname)
+    cache.evict()
+    assert not os.path.exists(fname)
+
+
+def test_concurrent_subsets_with_eviction(tmp_path, monkeypatch):
+    files, granules, earthaccess = _Granules(tmp_path, monkeypatch)
+    cache = GranuleCache(str(tmp_path / 'cache'), max_bytes=2*os.path.getsize(files[0]))
+
+    # Each ROI needs the granule again, and there is room for two granules only: the others
+    # are evicted and downloaded again, but never while they are read
+    rois = [dict(ROI, latS=ROI['latS'] + i) for i in range(4)]
+    tasks = [(fi, ri) for ri in range(len(rois)) for fi in range(len(files))]
+
+    def Subset(task):
+        fi, ri = task
+        with cache.subset(granules[fi], 'CHL', **rois[ri]) as roi:
+            return roi.chlor_a.values
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(Subset, tasks))
+
+    for (fi, ri), values in zip(tasks, results):
+        with xr.open_dataset(files[fi]) as dataset:
+            np.testing.assert_array_equal(values, SubsetROI(dataset, **rois[ri]).chlor_a.values)
+    assert sorted(set(earthaccess.downloads)) == sorted(files)
@@ -0,0 +1,92 @@
+# Stage instrumentation: off by default with the undecorated results, and the run report when on
+import csv
+import json
+
+import numpy as np
+import pytest
+
+import instrument
+from instrument import Instrument, Stage
+
+
+@pytest.fixture
+def enabled():
+    instrument.Reset()
+    instrument.Enable()
+    yield
+    instrument.Disable()
+    instrument.Reset()
+
+
+def _Scale(x, factor=2.):
+    return x*factor
+
+
+Scale = Instrument(_Scale)
+
+
+@Instrument(name='pipeline')
+def _Pipeline(x):
+    with Stage('prepare', rows=x.shape[0]) as stage:
+        y = x + 1
+        stage.output_bytes = y.nbytes
+    return Scale(y)
+
+
+@Instrument
+def _Fails():
+    raise ValueError('no data')
+
+
+def test_off_by_default_and_transparent():
+    assert not instrument.Enabled()
+    instrument.Reset()
+    x = np.arange(10.)
+    np.testing.assert_array_equal(Scale(x, factor=3.), _Scale(x, factor=3.))
+    assert Scale.__name__ == '_Scale'
+    with Stage('nothing') as stage:
+        assert stage is None
+    assert instrument.Records() == []
+
+
+def test_records_nested_stages(enabled):
+    x = np.ones(1000)
+    np.testing.assert_array_equal(_Pipeline(x), _Scale(x + 1))
+    with pytest.raises(ValueError):
+        _Fails()
+
+    records = instrument.Records()
+    assert [r['path'] for r in records] == ['pipeline/prepare', 'pipeline/_Scale', 'pipeline', '_Fails']
+    prepare, scale, pipeline, fails = records
+    assert prepare['info'] == {'rows': 1000} and prepare['output_bytes'] == x.nbytes
+    assert scale['input_bytes'] == x.nbytes and scale['output_bytes'] == x.nbytes
+    assert pipeline['wall_s'] >= scale['wall_s']
+    assert pipeline['peak_rss_mb'] >= scale['peak_rss_mb']
+    assert fails['error'] == 'ValueError' and pipeline['error'] is None
+
+    summary = {s['stage']: s for s in instrument.Summary()}
+    assert summary['_Scale']['calls'] == 1
+
+
+def test_write_report(enabled, tmp_path):
+    _Pipeline(np.ones(10))
+    instrument.WriteReport(str(tmp_path / 'report.json'))
+    instrument.WriteReport(str(tmp_path / 'report.csv'))
+
+    with open(tmp_path / 'report.json') as f:
+        report = json.load(f)
+    assert [r['stage'] for r in report['records']] == ['prepare', '_Scale', 'pipeline']
+    assert {s['stage'] for s in report['summary']} == {'prepare', '_Scale', 'pipeline'}
+    with open(tmp_path / 'report.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == instrument.REPORT_FIELDS
+    assert json.loads(rows[0]['info']) == {'rows': 10}
+
+
+def test_array_bytes():
+    import pandas as pd
+    import xarray as xr
+    a = np.zeros((4, 5))
+    assert instrument.ArrayBytes((a, [a], {'a': a}, 'text', 3)) == 3*a.nbytes
+    assert instrument.ArrayBytes(xr.DataArray(a)) == a.nbytes
+    assert instrument.ArrayBytes(pd.DataFrame(a)) >= a.nbytes
@@ -0,0 +1,56 @@
+# Importing the workflow modules must not log in to Earthdata or import the heavy optional
+# dependencies, as the baseline get_L3_8Day, Rrs_avg and cluster_fxns did at import
+import os
+import subprocess
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import earthdata
+import import_time
+
+
+def test_imports_are_offline_and_lazy():
+    pytest.importorskip('sklearn')
+    modules = sorted(import_time.BUDGETS)
+    code = ('import sys; sys.path.insert(0, {!r})\n'
+            'for module in {!r}: __import__(module)\n'
+            'print(" ".join(m for m in {!r} if m in sys.modules))').format(import_time.FUNCTIONS_DIR, modules,
+                                                                         import_time.LAZY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == ''
+
+
+def test_import_time_budget():
+    seconds, lazy = import_time.ImportTime('get_L3_8Day', repeat=1)
+    assert lazy == []
+    # Generous margin for slow or busy test machines
+    assert seconds < 20*import_time.BUDGETS['get_L3_8Day']
+
+
+def test_login_once_on_first_use(monkeypatch):
+    logins = []
+    fake = types.ModuleType('earthaccess')
+    fake.login = lambda persist=True: logins.append(persist) or 'auth'
+    monkeypatch.setitem(sys.modules, 'earthaccess', fake)
+    monkeypatch.setattr(earthdata, '_SESSION', {})
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        sessions = list(pool.map(lambda i: earthdata.Earthaccess(), range(8)))
+    assert all(s is fake for s in sessions)
+    assert logins == [True]
+
+
+def test_contributor_modules_are_offline():
+    # The contributor copies import earthaccess (and log in) only when they are called
+    kim_dir = os.path.join(import_time.FUNCTIONS_DIR, '..', 'contributors', 'kim')
+    modules = ['getCHL', 'get_avw', 'get_L3_8Day', 'Rrs_avg']
+    code = ('import sys; sys.path.insert(0, {!r})\n'
+            'for module in {!r}: __import__(module)\n'
+            'print(" ".join(m for m in {!r} if m in sys.modules))').format(kim_dir, modules, import_time.LAZY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == ''
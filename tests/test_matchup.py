@@ -0,0 +1,56 @@
+# GetClosestCluster against the per-point KDTree loop of the baseline
+import numpy as np
+import pytest
+from scipy.spatial import KDTree
+
+import synthetic
+from cluster_fxns import GetClosestCluster
+from matchup import GetPeriodIndex, GridMatcher
+
+CFG = dict(synthetic.SIZES['small'], n_lat=40, n_lon=50, n_points=3000)
+
+
+def _BaselineClosestCluster(LO, LA, total_labels, target_lat, target_lon, dates):
+    tree = KDTree(np.c_[LO.ravel(), LA.ravel()])
+    labels = np.zeros(target_lon.shape[0])*np.nan
+    for ti in np.arange(target_lat.shape[0]):
+        dd, ii = tree.query([target_lon[ti], target_lat[ti]])
+        si = 0 if dates[ti] < np.datetime64('2024-07-27') else 1
+        inds = np.unravel_index(ii, LO.shape)
+        labels[ti] = total_labels[si, inds[0], inds[1]]
+    return labels
+
+
+def test_regular_grid_matches_baseline():
+    labels, LO, LA = synthetic.MakeLabels(CFG)
+    lat, lon, dates = synthetic.MakeMatchupPoints(CFG)
+    expected = _BaselineClosestCluster(LO, LA, labels, lat, lon, dates)
+
+    np.testing.assert_array_equal(GetClosestCluster(LO, LA, labels, lat, lon, dates), expected)
+    # The same with the periods given explicitly
+    periods = synthetic.Periods(CFG['n_periods'])
+    np.testing.assert_array_equal(GetClosestCluster(LO, LA, labels, lat, lon, dates, periods=periods), expected)
+
+
+@pytest.mark.parametrize('grid', ['stretched', 'curvilinear'])
+def test_other_grids_match_baseline(grid):
+    labels, LO, LA = synthetic.MakeLabels(CFG)
+    lat, lon, dates = synthetic.MakeMatchupPoints(CFG)
+    if grid == 'stretched':
+        # Rectilinear with uneven spacing (searchsorted path)
+        lon_axis = LO[0]
+        LO = np.broadcast_to(lon_axis[0] + (lon_axis - lon_axis[0])**1.3/(lon_axis[-1] - lon_axis[0])**0.3, LO.shape)
+    else:
+        # Sheared mesh (KDTree path)
+        LO = LO + 0.05*(LA - LA.mean())
+    expected = _BaselineClosestCluster(LO, LA, labels, lat, lon, dates)
+    np.testing.assert_array_equal(GetClosestCluster(LO, LA, labels, lat, lon, dates), expected)
+    assert (GridMatcher(LO, LA).tree is None) == (grid == 'stretched')
+
+
+def test_period_index():
+    periods = [['2024-07-19', '2024-07-26'], ['2024-07-27', '2024-08-03']]
+    dates = np.array(['2024-07-18', '2024-07-19T12', '2024-07-26T23', '2024-07-27', '2024-08-03T06', '2024-08-04'],
+                     dtype='datetime64[ns]')
+    np.testing.assert_array_equal(GetPeriodIndex(dates, periods), [-1, 0, 0, 1, 1, -1])
+    np.testing.assert_array_equal(GetPeriodIndex(dates, ['2024-07-19', '2024-07-27']), [-1, 0, 0, 1, 1, 1])
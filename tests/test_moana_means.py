@@ -0,0 +1,53 @@
+# GetMOANAMeans against the per-file, per-cluster loop of the baseline
+import numpy as np
+import pytest
+import xarray as xr
+
+import cluster_fxns
+import synthetic
+from cluster_fxns import GetClosestCluster, GetMOANAFileDate, GetMOANAMeans
+
+CFG = dict(synthetic.SIZES['small'], n_lat=40, n_lon=50, n_swaths=3, swath_shape=(120, 80))
+PCC_LIST = ['picoeuk_moana', 'prococcus_moana', 'syncoccus_moana']
+
+
+def _BaselineMOANAMeans(flist, optimum_k, LO, LA, total_labels):
+    # The baseline loop, with the date of each file (the baseline used the first file's date for all)
+    moana_results = np.zeros((optimum_k, len(PCC_LIST), 3))
+    for fname in flist:
+        with xr.open_dataset(fname, group='geophysical_data') as prod, \
+             xr.open_dataset(fname, group='navigation_data') as nav:
+            dataset = xr.merge([prod.load(), nav.load()])
+        all_labels = np.zeros(dataset.longitude.values.shape)*np.nan
+        good_inds = np.where(np.isnan(dataset.picoeuk_moana.values) == False)
+        fdate = np.array([GetMOANAFileDate(fname)]*good_inds[0].shape[0])
+        all_labels[good_inds] = GetClosestCluster(LO, LA, total_labels, dataset.latitude.values[good_inds].flatten(),
+                                                  dataset.longitude.values[good_inds].flatten(), fdate)
+        for ci in np.arange(optimum_k):
+            inds = np.where(all_labels == ci)
+            if inds[0].shape[0] > 0:
+                for pi in np.arange(len(PCC_LIST)):
+                    # float64 sums: the baseline summed the float32 products in float32
+                    values = dataset[PCC_LIST[pi]].values[inds].astype(float)
+                    moana_results[ci, pi, 0] += np.nansum(values)
+                    moana_results[ci, pi, 1] += inds[0].shape[0]
+                    moana_results[ci, pi, 2] += np.nansum(values**2)
+    n = moana_results[:, :, 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moana_mean = moana_results[:, :, 0]/n
+        moana_variance = ((moana_results[:, :, 2]/n - moana_mean**2)*n/(n - 1))**(1/2)
+    return moana_mean, moana_variance
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_moana_means_match_baseline(tmp_path, max_workers):
+    files = synthetic.WriteMOANASwaths(str(tmp_path), CFG)
+    labels, LO, LA = synthetic.MakeLabels(CFG)
+
+    mean, sd = GetMOANAMeans(files, 6, LO, LA, labels, max_workers=max_workers)
+    expected_mean, expected_sd = _BaselineMOANAMeans(files, 6, LO, LA, labels)
+
+    assert np.isfinite(expected_mean).sum() > 6
+    assert cluster_fxns._MOANA_WORKER == {}
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-9)
+    np.testing.assert_allclose(sd, expected_sd, rtol=1e-6)
@@ -0,0 +1,99 @@
+# SweepK against the baseline elbow loop (a KMeans refit per K and cdist distortion) and the
+# scikit-learn metrics
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+import sklearn.cluster
+from scipy.spatial.distance import cdist
+from sklearn.cluster import KMeans
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
+
+import model_selection
+from model_selection import NearestCenters, SweepK
+
+K = range(1, 7)
+
+
+def _Data(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=4, size=(4, 3))
+    return centers[rng.integers(4, size=n)] + rng.normal(size=(n, 3))
+
+
+def _BaselineElbow(X):
+    distortions = []
+    inertias = []
+    for k in K:
+        kmeanModel = KMeans(n_clusters=k, n_init=3, random_state=0).fit(X)
+        distortions.append(sum(np.min(cdist(X, kmeanModel.cluster_centers_, 'euclidean'), axis=1))/X.shape[0])
+        inertias.append(kmeanModel.inertia_)
+    return np.array(distortions), np.array(inertias)
+
+
+def test_sweep_matches_baseline_elbow():
+    X = _Data()
+    model_selection._SWEEP_CACHE.clear()
+    sweep = SweepK(X, K=K, silhouette_sample=X.shape[0], max_workers=2)
+    distortions, inertias = _BaselineElbow(X)
+
+    # Same minimum found (warm starts may land on an equally good or better one)
+    assert (sweep['inertia'] <= inertias*1.01).all()
+    np.testing.assert_allclose(sweep['inertia'][:4], inertias[:4], rtol=1e-3)
+    np.testing.assert_allclose(sweep['distortion'][:4], distortions[:4], rtol=1e-3)
+
+    # The metrics of each fit, against scikit-learn on the same centroids
+    for ki, k in enumerate(K):
+        centers = sweep['centers'][ki]
+        labels, sq_dist = NearestCenters(X, centers, chunk_size=97)
+        np.testing.assert_array_equal(labels, cdist(X, centers).argmin(axis=1))
+        np.testing.assert_allclose(sweep['distortion'][ki], cdist(X, centers).min(axis=1).mean(), rtol=1e-9)
+        if k > 1:
+            np.testing.assert_allclose(sweep['calinski_harabasz'][ki], calinski_harabasz_score(X, labels), rtol=1e-9)
+            np.testing.assert_allclose(sweep['silhouette'][ki], silhouette_score(X, labels), rtol=1e-9)
+
+
+def test_sweep_is_cached_and_extended(tmp_path, monkeypatch):
+    X = _Data(seed=1)
+    model_selection._SWEEP_CACHE.clear()
+    first = SweepK(X, K=range(1, 4), cache_dir=str(tmp_path))
+
+    # A new session reloads the fits from cache_dir and only fits the new K
+    model_selection._SWEEP_CACHE.clear()
+    fitted = []
+
+    class CountingKMeans(KMeans):
+        def fit(self, X, *args, **kwargs):
+            fitted.append(self.n_clusters)
+            return super().fit(X, *args, **kwargs)
+
+    monkeypatch.setattr(sklearn.cluster, 'KMeans', CountingKMeans)
+    extended = SweepK(X, K=range(1, 6), cache_dir=str(tmp_path))
+    assert sorted(set(fitted)) == [4, 5]
+    np.testing.assert_array_equal(extended['inertia'][:3], first['inertia'])
+
+
+def test_named_sweeps_do_not_hash_the_data(monkeypatch):
+    X = _Data(seed=2)
+    model_selection._SWEEP_CACHE.clear()
+    first = SweepK(X, K=range(1, 4), key='cube.npy')
+
+    # Reused by name: no hash of X and no new fit
+    def Fail(*args):
+        raise AssertionError('X was hashed')
+    monkeypatch.setattr(model_selection, 'GridHash', Fail)
+    monkeypatch.setattr(sklearn.cluster, 'KMeans', None)
+    again = SweepK(X, K=range(1, 4), key='cube.npy')
+    np.testing.assert_array_equal(again['inertia'], first['inertia'])
+    assert len(model_selection._SWEEP_CACHE) == 1
+
+
+@pytest.mark.parametrize('warm_start', [True, False])
+def test_parallel_fits_match_serial(warm_start):
+    X = _Data(seed=3)
+    model_selection._SWEEP_CACHE.clear()
+    serial = SweepK(X, K=K, warm_start=warm_start, max_workers=1)
+    model_selection._SWEEP_CACHE.clear()
+    parallel = SweepK(X, K=K, warm_start=warm_start, max_workers=4)
+    for name in ('inertia', 'calinski_harabasz', 'silhouette'):
+        np.testing.assert_array_equal(parallel[name], serial[name])
@@ -0,0 +1,68 @@
+# psc_fractions against the xarray LUT lookup of the baseline psc in contributors/kim
+import numpy as np
+import pandas
+import xarray as xr
+
+import phyto_size_turner
+from phyto_size_turner import psc, psc_fractions
+
+SST_FILE = phyto_size_turner.os.path.join(phyto_size_turner.os.path.dirname(phyto_size_turner.__file__),
+                                          'TURNER_PSIZE_SST_LUT_VER1.csv')
+
+
+def _Inputs(shape=(3, 41, 37), seed=0):
+    rng = np.random.default_rng(seed)
+    dims = ('time', 'lat', 'lon')[-len(shape):]
+    chl = xr.DataArray(rng.lognormal(0, 1.2, shape).astype(np.float32), dims=dims)
+    chl.values[rng.random(shape) < 0.2] = np.nan
+    # Covers SST below and above the LUT
+    sst = xr.DataArray(rng.uniform(2, 32, shape), dims=dims)
+    return chl, sst
+
+
+def _BaselinePSC(chlarr, sstarr):
+    # The baseline lookup and fractions (the file path and version handling were broken)
+    sstlut = pandas.read_csv(SST_FILE, index_col='SST', encoding='utf-8-sig')
+    sstlut = sstlut.to_xarray()
+    sst_coeffs = sstlut.sel({"SST": sstarr}, method="nearest")
+    fpico = (sst_coeffs.COEFF3 * (1 - np.exp(-1 * (sst_coeffs.COEFF4 / sst_coeffs.COEFF3) * chlarr))) / chlarr
+    fnanopico = (sst_coeffs.COEFF1 * (1 - np.exp(-1 * (sst_coeffs.COEFF2 / sst_coeffs.COEFF1) * chlarr))) / chlarr
+    fnano = fnanopico - fpico
+    fmicro = (chlarr - (sst_coeffs.COEFF1 * (1 - np.exp(-1 * (sst_coeffs.COEFF2 / sst_coeffs.COEFF1) * chlarr)))) / chlarr
+    return xr.Dataset({"fmicro": fmicro, "fnano": fnano, "fpico": fpico, "chlor_a": chlarr})
+
+
+def test_fractions_match_baseline():
+    chl, sst = _Inputs()
+    expected = _BaselinePSC(chl.astype(float), sst)
+    fractions = psc_fractions(chl.values, sst.values, chunk_size=1000)
+    for name in ('fpico', 'fnano', 'fmicro'):
+        assert fractions[name].dtype == np.float32
+        np.testing.assert_allclose(fractions[name], expected[name].values, rtol=2e-5, atol=2e-6)
+
+    phyto = psc(chl, sst)
+    np.testing.assert_allclose(phyto.fmicro.values, expected.fmicro.values, rtol=2e-5, atol=2e-6)
+    xr.testing.assert_equal(phyto.chlor_a, chl)
+
+
+def test_ties_go_to_the_higher_sst():
+    # SST halfway between LUT rows, and exactly on them
+    lut_sst = phyto_size_turner.read_lut()[0]
+    sst = xr.DataArray(np.concatenate([(lut_sst[:-1] + lut_sst[1:])/2, lut_sst]), dims='pixel')
+    chl = xr.DataArray(np.full(sst.shape, 0.7), dims='pixel')
+    expected = _BaselinePSC(chl, sst)
+    fractions = psc_fractions(chl.values, sst.values)
+    for name in ('fpico', 'fnano', 'fmicro'):
+        np.testing.assert_allclose(fractions[name], expected[name].values, rtol=2e-5, atol=2e-6)
+
+
+def test_missing_sst_and_zero_chl_are_nan():
+    chl, sst = _Inputs(shape=(50,))
+    chl.values[:5] = 0
+    sst.values[5:10] = np.nan
+    out = {name: np.zeros(50, dtype=np.float32) for name in ('fpico', 'fnano', 'fmicro')}
+    fractions = psc_fractions(chl.values, sst.values, out=out)
+    assert fractions is out
+    assert np.isnan(out['fmicro'][:10]).all()
+    good = np.isfinite(chl.values) & np.isfinite(sst.values) & (chl.values > 0)
+    np.testing.assert_allclose((out['fpico'] + out['fnano'] + out['fmicro'])[good], 1, rtol=1e-5)
@@ -0,0 +1,107 @@
+# Pipeline runner: labels against the notebook cells it replaces (feature DataFrame,
+# StandardScaler, KMeans) and stage checkpoints reused across reruns
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+pytest.importorskip('sklearn')
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+import cluster_fxns
+import getSST8day
+import pipeline
+import synthetic
+from cluster_model import BuildFeatures
+
+CFG = dict(synthetic.SIZES['small'], n_lat=20, n_lon=24, sst_factor=2)
+UPSTREAM = ['fetch', 'regrid', 'features', 'argo_fetch']
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    # The downloads are replaced by the synthetic products, AVW is read from synthetic files
+    fetched = []
+    def GetData(*args, **kwargs):
+        fetched.append(kwargs['products'])
+        return synthetic.MakeDataset(CFG, products=('CHL', 'POC', 'KD', 'RRS'))
+    monkeypatch.setattr(cluster_fxns, 'GetData', GetData)
+    monkeypatch.setattr(getSST8day, 'SST8day', lambda *args, **kwargs: synthetic.MakeSST8Day(CFG))
+    avw_dir = str(tmp_path / 'avw')
+    synthetic.WriteL3Granules(avw_dir, ('AVW',), CFG)
+
+    path = str(tmp_path / 'config.json')
+    with open(path, 'w') as f:
+        json.dump({'data': {'periods': [str(p) for p in synthetic.Periods(2)], 'avw_dir': avw_dir},
+                   'clustering': {'n_clusters': 3, 'n_init': 2},
+                   'output': {'dir': str(tmp_path / 'output'), 'checkpoint_dir': str(tmp_path / 'checkpoints')}}, f)
+    config = pipeline.LoadConfig(path)
+    config['fetched'] = fetched
+    return config
+
+
+def _BaselineLabels(data, n_clusters, n_init):
+    features = BuildFeatures(data)
+    X = pd.DataFrame({name: value.flatten() for name, value in features.items()})
+    good_inds = np.where(X.isna().sum(axis=1) == 0)[0]
+    scaler = StandardScaler().fit(X.iloc[good_inds].values)
+    kmeans_fit = KMeans(n_clusters=n_clusters, n_init=n_init, random_state=0).fit(
+        scaler.transform(X.iloc[good_inds].values))
+    total_labels = np.zeros(X.shape[0])*np.nan
+    total_labels[good_inds] = kmeans_fit.labels_
+    return total_labels.reshape(features['CHL'].shape)
+
+
+def test_pipeline_labels_match_notebook(config):
+    fetched = config.pop('fetched')
+    status = pipeline.RunPipeline(config)
+    assert {state for key, state in status.values()} == {'run'}
+    assert len(fetched) == 1
+
+    out_dir = config['output']['dir']
+    labels = xr.load_dataset(os.path.join(out_dir, 'labels.nc'))
+    keys = pipeline.StageKeys(config)
+    data = xr.load_dataset(os.path.join(config['output']['checkpoint_dir'], 'regrid', keys['regrid'], 'data.nc'))
+    assert {'sst', 'avw', 'chlor_a', 'Rrs'} <= set(data.data_vars)
+    np.testing.assert_array_equal(labels['labels'].values, _BaselineLabels(data, 3, 2))
+    assert {'cluster_model.json', 'cluster_counts.csv', 'rrs_stats.nc'} <= set(os.listdir(out_dir))
+
+
+def test_rerun_only_runs_changed_stages(config):
+    fetched = config.pop('fetched')
+    pipeline.RunPipeline(config)
+    keys = pipeline.StageKeys(config)
+
+    status = pipeline.RunPipeline(config)
+    assert {state for key, state in status.values()} == {'cached'}
+
+    # Changing K refits and relabels, without downloading or regridding again
+    config['clustering']['n_clusters'] = 4
+    assert pipeline.RunPipeline(config, dry_run=True)['fit'][1] == 'would run'
+    status = pipeline.RunPipeline(config)
+    new_keys = pipeline.StageKeys(config)
+    for name in pipeline.STAGES:
+        assert status[name][1] == ('cached' if name in UPSTREAM else 'run')
+        assert (new_keys[name] == keys[name]) == (name in UPSTREAM)
+    assert len(fetched) == 1
+    labels = xr.load_dataset(os.path.join(config['output']['dir'], 'labels.nc'))
+    assert labels.attrs['n_clusters'] == 4
+
+    # Forcing a stage also reruns everything downstream of it
+    status = pipeline.RunPipeline(config, until='features', force=['regrid'])
+    assert [status[name][1] for name in ('fetch', 'regrid', 'features')] == ['cached', 'run', 'run']
+
+
+def test_config_errors(tmp_path):
+    path = str(tmp_path / 'config.json')
+    with open(path, 'w') as f:
+        json.dump({'clustering': {'k': 3}}, f)
+    with pytest.raises(ValueError, match='Unknown setting clustering.k'):
+        pipeline.LoadConfig(path)
+    with pytest.raises(ValueError, match='Unknown stage'):
+        pipeline.RunPipeline(pipeline.LoadConfig(os.path.join(os.path.dirname(pipeline.__file__), '..',
+                                                              'pipeline_example.toml')), until='plot')
@@ -0,0 +1,60 @@
+# Regrid / Regridder against the griddata loop of the baseline Regrid
+import numpy as np
+import pytest
+from scipy.interpolate import griddata
+
+import regridder
+import synthetic
+from cluster_fxns import Regrid
+from regridder import Regridder
+
+
+def _Grids(factor=3):
+    lat, lon = synthetic.Grid(20, 25)
+    lat_hr, lon_hr = synthetic.Grid(20*factor, 25*factor)
+    rng = np.random.default_rng(0)
+    data = rng.normal(20, 3, (2, lat_hr.shape[0], lon_hr.shape[0]))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    return (lon_hr, lat_hr), np.meshgrid(lon, lat), data
+
+
+def _BaselineRegrid(high_res_data, high_res_grid, target_grid):
+    data = np.zeros((high_res_data.shape[0], target_grid[0].shape[0], target_grid[0].shape[1]))*np.nan
+    LO, LA = np.meshgrid(high_res_grid[0], high_res_grid[1])
+    points = (LO.flatten(), LA.flatten())
+    for i in np.arange(data.shape[0]):
+        data[i, :, :] = griddata(points, high_res_data[i].flatten(), target_grid, method='nearest')
+    return data
+
+
+def test_nearest_matches_baseline():
+    source, target, data = _Grids()
+    np.testing.assert_array_equal(Regrid(data, source, target), _BaselineRegrid(data, source, target))
+
+
+def test_block_mean():
+    (lon_hr, lat_hr), (LO, LA), data = _Grids()
+    out = Regridder((lon_hr, lat_hr), (LO, LA), method='mean')(data)
+
+    # Mean of the source cells whose nearest target cell is each target cell
+    rows = np.abs(lat_hr[:, None] - LA[:, 0][None, :]).argmin(axis=1)
+    cols = np.abs(lon_hr[:, None] - LO[0][None, :]).argmin(axis=1)
+    for i in range(data.shape[0]):
+        for r in range(LO.shape[0]):
+            for c in range(LO.shape[1]):
+                block = data[i][np.ix_(rows == r, cols == c)]
+                expected = np.nanmean(block) if np.isfinite(block).any() else np.nan
+                np.testing.assert_allclose(out[i, r, c], expected, rtol=1e-12)
+
+
+def test_mapping_is_cached(tmp_path, monkeypatch):
+    source, target, data = _Grids(factor=2)
+    first = Regridder(source, target, cache_dir=str(tmp_path))
+    assert Regridder(source, target).index is first.index
+    assert len(list(tmp_path.glob('regrid_*.npy'))) == 1
+
+    # A new session loads the mapping from cache_dir instead of computing it
+    monkeypatch.setattr(regridder, '_MAPPING_CACHE', {})
+    monkeypatch.setattr(Regridder, '_ComputeIndex', lambda self: pytest.fail('mapping recomputed'))
+    again = Regridder(source, target, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(again(data), first(data))
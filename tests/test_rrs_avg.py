@@ -0,0 +1,50 @@
+# Rrs_cluster_stats against the per-cluster Rrs_avg loop of the notebook
+import numpy as np
+import pytest
+import xarray as xr
+
+from Rrs_avg import Rrs_avg, Rrs_cluster_stats
+from grouped_stats import GroupedMoments, FinalizeMoments
+
+
+def _Dataset(rng, n_time=2, n_lat=70, n_lon=40, n_wv=30, offset=0.005, spread=0.002):
+    rrs = rng.normal(offset, spread, (n_time, n_lat, n_lon, n_wv))
+    rrs[rng.random(rrs.shape) < 0.01] = np.nan
+    return xr.Dataset({'Rrs': (('time', 'lat', 'lon', 'wavelength'), rrs)},
+                      coords={'time': np.arange(n_time), 'lat': np.arange(n_lat), 'lon': np.arange(n_lon),
+                              'wavelength': 340. + 2*np.arange(n_wv)})
+
+
+@pytest.mark.parametrize('offset, spread', [(0.005, 0.002), (0.01, 1e-6)])
+def test_rrs_cluster_stats_matches_rrs_avg(offset, spread):
+    rng = np.random.default_rng(0)
+    data = _Dataset(rng, offset=offset, spread=spread)
+    n_clusters = 5
+    labels = rng.integers(0, n_clusters, data.Rrs.shape[:3]).astype(float)
+    labels[:, :3] = np.nan
+
+    stats = Rrs_cluster_stats(data, labels, n_clusters, chunk_rows=16)
+
+    for ti in range(labels.shape[0]):
+        for n in range(n_clusters):
+            mean, sd, wv = Rrs_avg(data.isel(time=ti), labels[ti], n)
+            np.testing.assert_allclose(stats['mean'].values[ti, n], mean, rtol=1e-6)
+            np.testing.assert_allclose(stats['sd'].values[ti, n], sd, rtol=1e-6)
+            assert stats['n_pixels'].values[ti, n] == (labels[ti] == n).sum()
+
+
+@pytest.mark.parametrize('n_groups', [3, 500])
+def test_grouped_moments_matches_numpy(n_groups):
+    rng = np.random.default_rng(1)
+    values = rng.normal(100., 0.01, (5000, 4))
+    values[rng.random(values.shape) < 0.05] = np.nan
+    labels = rng.integers(-1, n_groups, 5000).astype(float)
+
+    count, mean, variance = FinalizeMoments(GroupedMoments(labels, values, n_groups), ddof=0)
+
+    for g in range(n_groups):
+        rows = values[labels == g]
+        np.testing.assert_array_equal(count[g], (~np.isnan(rows)).sum(axis=0))
+        if len(rows):
+            np.testing.assert_allclose(mean[g], np.nanmean(rows, axis=0), rtol=1e-12)
+            np.testing.assert_allclose(variance[g], np.nanvar(rows, axis=0), rtol=1e-8, atol=1e-14)
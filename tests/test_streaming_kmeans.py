@@ -0,0 +1,86 @@
+# Streaming K-means against the baseline StandardScaler + KMeans fit on every valid pixel
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+from sklearn.preprocessing import StandardScaler
+
+from feature_cube import FeatureCube
+from streaming_kmeans import FitStreamingKMeans, PredictStreamingLabels, _IterShuffledBatches
+
+N_CLUSTERS = 4
+
+
+def _Features(shape=(2, 60, 50), seed=0):
+    # Well separated clusters in 3 features, with missing pixels
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=5, size=(N_CLUSTERS, 3))
+    member = rng.integers(N_CLUSTERS, size=shape)
+    features = [centers[member, fi] + rng.normal(size=shape) for fi in range(3)]
+    features[0][rng.random(shape) < 0.15] = np.nan
+    return features
+
+
+def _BaselineLabels(features):
+    X = np.stack([f.ravel() for f in features], axis=1)
+    good_inds = np.where(~np.isnan(X).any(axis=1))[0]
+    scaler = StandardScaler().fit(X[good_inds])
+    labels = KMeans(n_clusters=N_CLUSTERS, n_init=10, random_state=0).fit_predict(scaler.transform(X[good_inds]))
+    total_labels = np.zeros(X.shape[0])*np.nan
+    total_labels[good_inds] = labels
+    return scaler, total_labels.reshape(features[0].shape)
+
+
+def _Inertia(features, scaler, labels):
+    # Within-cluster sum of squares of the scaled features
+    X = np.stack([f.ravel() for f in features], axis=1)
+    valid = ~np.isnan(labels.ravel())
+    X = scaler.transform(X[valid])
+    labels = labels.ravel()[valid].astype(int)
+    return sum(((X[labels == k] - X[labels == k].mean(axis=0))**2).sum() for k in np.unique(labels))
+
+
+def test_streaming_kmeans_matches_baseline():
+    features = _Features()
+    expected_scaler, expected = _BaselineLabels(features)
+
+    scaler, kmeans = FitStreamingKMeans(features, N_CLUSTERS, chunk_rows=16, batch_size=512, random_state=0)
+    np.testing.assert_allclose(scaler.mean_, expected_scaler.mean_, rtol=1e-5)
+    np.testing.assert_allclose(scaler.scale_, expected_scaler.scale_, rtol=1e-5)
+
+    labels = PredictStreamingLabels(features, scaler, kmeans, chunk_rows=16)
+    valid = ~np.isnan(expected)
+    np.testing.assert_array_equal(~np.isnan(labels), valid)
+    # Mini-batch centroids move a little: same partition up to a few border pixels
+    assert adjusted_rand_score(expected[valid], labels[valid]) > 0.9
+    assert _Inertia(features, expected_scaler, labels) < 1.01*_Inertia(features, expected_scaler, expected)
+
+
+def test_feature_cube_and_arrays_give_the_same_labels(tmp_path):
+    features = _Features(seed=1)
+    scaler, kmeans = FitStreamingKMeans(features, N_CLUSTERS, chunk_rows=16, random_state=0)
+
+    cube = FeatureCube({str(fi): f for fi, f in enumerate(features)}, path=str(tmp_path / 'X.npy'))
+    out = np.lib.format.open_memmap(str(tmp_path / 'labels.npy'), mode='w+', dtype=np.float32,
+                                    shape=cube.shape)
+    from_cube = PredictStreamingLabels(cube, scaler, kmeans, out=out)
+    from_arrays = PredictStreamingLabels(features, scaler, kmeans, chunk_rows=7)
+    np.testing.assert_array_equal(from_cube, from_arrays)
+
+
+def test_too_few_pixels():
+    features = _Features(shape=(1, 2, 1))
+    with pytest.raises(ValueError, match='valid pixels'):
+        FitStreamingKMeans(features, 10)
+
+
+
+def test_batches_span_the_domain():
+    # With the row index as a feature: a batch in row order would cover a few rows only
+    features = _Features(shape=(2, 60, 50), seed=4)
+    features.append(np.broadcast_to(np.arange(60.)[None, :, None], (2, 60, 50)))
+    for source in (features, FeatureCube({str(fi): f for fi, f in enumerate(features)})):
+        for X in list(_IterShuffledBatches(source, 4, 256, 10000, np.random.default_rng(0)))[:-1]:
+            assert np.ptp(X[:, -1]) > 50
@@ -0,0 +1,84 @@
+# Warm-started temporal clustering against independent K-means fits of each period
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+from sklearn.preprocessing import StandardScaler
+
+import cluster_fxns
+import synthetic
+import temporal_clustering
+from cluster_model import BuildFeatures
+from temporal_clustering import IterPeriodFeatures, TemporalClusters
+
+
+def _Periods(n_periods=4, shape=(30, 40), seed=0):
+    # Three water types in fixed regions, drifting a little from period to period
+    rng = np.random.default_rng(seed)
+    region = np.zeros(shape, dtype=int)
+    region[:, 15:] = 1
+    region[20:, 25:] = 2
+    centers = np.array([[0.1, 25.], [1., 18.], [5., 12.]])
+    for pi in range(n_periods):
+        values = centers[region] + 0.05*pi + rng.normal(0, [0.05, 0.3], shape + (2,))
+        values[rng.random(shape) < 0.1] = np.nan
+        yield str(np.datetime64('2024-07-19') + 8*pi), {'CHL': values[..., 0], 'SST': values[..., 1]}, region
+
+
+def test_matches_independent_fits_with_stable_ids():
+    periods = list(_Periods())
+    labels_periods, labels, centers, model = TemporalClusters(((p, f) for p, f, r in periods), len(periods),
+                                                              n_clusters=3, random_state=0)
+    assert labels.shape == (4, 30, 40)
+    assert centers.shape == (4, 3, 2)
+
+    first_ids = None
+    for (period, features, region), period_labels in zip(periods, labels):
+        X = np.stack([features['CHL'].ravel(), features['SST'].ravel()], axis=1)
+        good = np.isfinite(X).all(axis=1)
+        independent = KMeans(n_clusters=3, n_init=10, random_state=0).fit_predict(
+            StandardScaler().fit_transform(X[good]))
+        assert adjusted_rand_score(independent, period_labels.ravel()[good]) == 1.
+        assert np.all(np.isnan(period_labels.ravel()[~good]))
+
+        # The same water type keeps its cluster ID in every period
+        ids = [np.nanmedian(period_labels[region == r]) for r in range(3)]
+        first_ids = ids if first_ids is None else first_ids
+        assert ids == first_ids
+
+
+def test_models_keep_the_kd_wavelength():
+    periods = list(_Periods(n_periods=2))
+    features = [(p, f) for p, f, r in periods]
+    _, _, _, model = TemporalClusters(iter(features), 2, n_clusters=3, random_state=0, desired_wavelength=490)
+    assert model.desired_wavelength == 490
+
+    # Continuing from a saved model keeps its wavelength, and refuses features built at another one
+    _, _, _, model = TemporalClusters(iter(features), 2, model=model)
+    assert model.desired_wavelength == 490
+    with pytest.raises(ValueError, match='490 nm'):
+        TemporalClusters(iter(features), 2, model=model, desired_wavelength=475)
+
+
+def test_iter_period_features_uses_get_data(monkeypatch):
+    data = synthetic.MakeDataset(dict(synthetic.SIZES['small'], n_lat=10, n_lon=12, n_periods=3, n_bands=8),
+                                 products=('SST', 'CHL'))
+    calls = []
+
+    def GetData(latN, latS, lonW, lonE, periods=None, **kwargs):
+        calls.append((periods, kwargs))
+        return data.sel(time=np.array(periods, dtype='datetime64[ns]'))
+
+    monkeypatch.setattr(cluster_fxns, 'GetData', GetData)
+    periods = list(data.time.values)
+    out = list(IterPeriodFeatures(50, 20, -80, -45, periods, features=('CHL', 'SST'), cache_dir='x'))
+
+    assert [p for p, f in out] == periods
+    assert [c[1] for c in calls] == [{'cache_dir': 'x'}]*3
+    for pi, (period, features) in enumerate(out):
+        expected = BuildFeatures(data.isel(time=[pi]), ('CHL', 'SST'))
+        for name in ('CHL', 'SST'):
+            np.testing.assert_array_equal(features[name], expected[name])
+    assert 'GetData' not in vars(temporal_clustering)